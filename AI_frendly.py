@@ -1,94 +1,639 @@
 import os
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
+import sys
+import argparse
+import ast
+import bisect
+import codecs
+import contextlib
+import hashlib
+import heapq
+import io
+import lzma
 import threading
 import subprocess
 import time
+import tokenize
 import json
+import queue
+import math
+import multiprocessing
 import re
+import sqlite3
+import stat
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
+# Tkinter загружается только в режиме GUI (см. start_gui), чтобы CLI и
+# библиотечный API работали на машинах без дисплея.
+
+CONFIG_FILE = "file_scanner_config.txt"
+
+# Настройки по умолчанию: те же ключи, что и в файле конфигурации
+DEFAULT_SETTINGS = {
+    "source_folder": "",
+    "output_file": "",
+    "exclude_extensions": ".exe, .dll, .zip, .mp4, .jpg, .jpeg, .png, .gif, .bin",
+    "exclude_folders": "node_modules, __pycache__, .git, venv, .vscode, build, dist",
+    "exclude_files": "",
+    "exclude_patterns": "",  # шаблоны в синтаксисе .gitignore: *.min.js, docs/**/generated, !keep.min.js
+    "use_gitignore": False,  # добавлять шаблоны из .gitignore в корне проекта
+    "max_file_size": 50000,
+    "output_format": "txt",
+    "group_by_type": False,
+    "prioritize_files": "settings.py, urls.py, models.py, views.py",
+    "include_metadata": True,
+    "ai_friendly": False,
+    "read_workers": 4,  # потоков чтения файлов (1 = последовательно)
+    "parse_workers": 0,  # процессов для разбора кода Python (0 = по числу ядер, 1 = без отдельных процессов)
+    "prefetch_depth": 32,  # сколько файлов читается с опережением записи
+    "truncate_mode": "head",  # head — начало большого файла, head_tail — начало и конец, skeleton — объявления
+    "fallback_encodings": "cp1251",  # кодировки для файлов не в UTF-8, по порядку
+    "use_cache": False,  # хранить обработанные файлы между запусками
+    "cache_path": "file_scanner_cache.sqlite",
+    "cache_max_mb": 256,
+    "source_mode": "fs",  # fs — обход папки, git — список файлов из git ls-files
+    "since": "",  # ревизия git: выводить только файлы, измененные с нее
+    "token_budget": 0,  # примерный бюджет токенов на весь результат (0 = без ограничения)
+    "deduplicate": True,  # одинаковые по содержимому файлы выводить один раз
+    "shard_max_bytes": 0,  # делить результат на части name.001.txt, ... не больше N байт (0 = один файл)
+    "shard_max_tokens": 0,  # то же, но по оценке числа токенов
+    "tree_max_entries": 0,  # сворачивать в структуре папки, где больше N элементов (0 = полный список)
+    "compression": "auto",  # auto — по расширению результата (.gz, .xz), none, gzip или xz
+    "write_stats": False,  # сохранять рядом с результатом name.txt.stats.json: фазы, чтение, исключения
+    "query": "",  # выводить только файлы, подходящие к запросу (BM25)
+    "query_top_k": 20,  # сколько лучших по запросу файлов выводить (0 = все совпавшие)
+    "query_neighbors": 1,  # сколько соседних файлов из той же папки добавлять к каждому найденному
+    "minify": False,  # убирать из кода комментарии, пробелы в концах строк и серии пустых строк
+}
+
+
+PROGRESS_INTERVAL = 0.1  # не чаще, чем раз в столько секунд, прогресс передается в callback
+GUI_POLL_MS = 100  # как часто GUI забирает события рабочего потока
+
+
+class ScanCancelled(Exception):
+    """Сканирование остановлено по запросу пользователя (cancel_event)."""
+
+
+def new_progress(callback=None, cancel_event=None, interval=PROGRESS_INTERVAL):
+    """Создает счетчик прогресса (считаются выведенные файлы).
+
+    callback(value, maximum) вызывается не чаще раза в interval секунд, а также при
+    set_progress и на последнем файле. Если cancel_event (threading.Event) установлен,
+    следующий advance_progress бросает ScanCancelled.
+    """
+    return {"value": 0, "maximum": 0, "callback": callback, "cancel": cancel_event,
+            "interval": interval, "reported": 0.0}
+
+
+def report_progress(progress, force=False):
+    """Передает текущее значение в callback, если с прошлого раза прошло достаточно времени."""
+    if progress["callback"] is None:
+        return
+    now = time.monotonic()
+    if force or progress["value"] >= progress["maximum"] or now - progress["reported"] >= progress["interval"]:
+        progress["reported"] = now
+        progress["callback"](progress["value"], progress["maximum"])
+
+
+def set_progress(progress, value=None, maximum=None):
+    """Устанавливает значение и/или максимум прогресса."""
+    if maximum is not None:
+        progress["maximum"] = maximum
+    if value is not None:
+        progress["value"] = value
+    report_progress(progress, force=True)
+
+
+def advance_progress(progress, step=1):
+    """Увеличивает прогресс на step; здесь же проверяется запрос на отмену."""
+    check_cancelled(progress)
+    progress["value"] += step
+    report_progress(progress)
+
+
+def check_cancelled(progress):
+    """Бросает ScanCancelled, если пользователь запросил отмену."""
+    if progress["cancel"] is not None and progress["cancel"].is_set():
+        raise ScanCancelled("Сканирование отменено")
+
+
+def format_progress(value, maximum, elapsed):
+    """Строка вида "120/500 файлов, 40 файлов/с, осталось ~0:09" для GUI и консоли."""
+    text = f"{value}/{maximum} файлов"
+    if elapsed > 0 and value > 0:
+        rate = value / elapsed
+        text += f", {rate:.0f} файлов/с"
+        if maximum > value:
+            remaining = int((maximum - value) / rate)
+            text += f", осталось ~{remaining // 60}:{remaining % 60:02d}"
+    return text
+
+
+# Статистика запуска: собирается, только если передан словарь new_stats(), иначе проверки сводятся к "is None"
+STATS_TOP_FILES = 10  # сколько самых медленных и самых больших файлов сохранять
+
+
+def new_stats():
+    """Создает пустую статистику запуска (см. write_stats). Обновляется из потоков чтения под замком."""
+    return {
+        "lock": threading.Lock(),
+        "start": time.perf_counter(),
+        "phases": {},
+        "files": {"listed": 0, "read": 0, "binary": 0, "truncated": 0, "skeleton": 0, "errors": 0,
+                  "decode_errors": 0, "fallback_encoding": 0},
+        "bytes_read": 0,
+        "read_seconds": 0.0,  # сумма по файлам во всех потоках чтения
+        "parse_seconds": 0.0,  # из них разбор кода (символы, скелет)
+        "excluded": {"files": {}, "folders": {}, "token_budget": 0},
+        "slowest": [],  # куча (секунды, путь, размер)
+        "largest": [],  # куча (размер, путь)
+    }
 
-def create_ai_friendly_summary(directory, output_path, exclude_extensions, exclude_folders, exclude_files, progress, status_label):
-    """Создает краткое описание проекта, оптимизированное для ИИ."""
-    try:
-        total_items = count_items(directory, exclude_folders)
-        progress["maximum"] = total_items
-
-        # Создаем структуру для хранения информации
-        project_info = {
-            "project_name": os.path.basename(directory),
-            "structure": [],
-            "key_files": {},
-            "file_types": {},
-            "summary": ""
-        }
-
-        # Получаем структуру проекта
-        project_info["structure"] = generate_project_structure(directory, exclude_folders).split("\n")
-
-        # Собираем информацию о файлах
-        collect_file_info(directory, project_info, exclude_extensions, exclude_folders, exclude_files, progress)
 
-        # Создаем краткое описание
-        generate_summary(project_info)
+def add_phase(stats, name, start):
+    """Добавляет к фазе name время с момента start (time.perf_counter())."""
+    if stats is not None:
+        stats["phases"][name] = stats["phases"].get(name, 0.0) + time.perf_counter() - start
+
+
+def add_parse_time(stats, start):
+    if stats is not None:
+        with stats["lock"]:
+            stats["parse_seconds"] += time.perf_counter() - start
+
+
+def add_file_stats(stats, entry, record, seconds):
+    """Учитывает один прочитанный файл: время, байты, ошибки декодирования, самые медленные и большие."""
+    with stats["lock"]:
+        files = stats["files"]
+        files["read"] += 1
+        stats["read_seconds"] += seconds
+        stats["bytes_read"] += record.get("shown_size") or 0
+        error = record["error"]
+        if isinstance(error, UnicodeDecodeError):
+            files["decode_errors"] += 1
+        elif error is not None:
+            files["errors"] += 1
+        if record["binary"]:
+            files["binary"] += 1
+        if record["truncated"]:
+            files["truncated"] += 1
+        if record.get("skeleton"):
+            files["skeleton"] += 1
+        if record["encoding"] not in (None, "utf-8", "utf-8-sig"):
+            files["fallback_encoding"] += 1
+        for heap, item in (("slowest", (seconds, entry["path"], entry["size"])), ("largest", (entry["size"], entry["path"]))):
+            if len(stats[heap]) < STATS_TOP_FILES:
+                heapq.heappush(stats[heap], item)
+            else:
+                heapq.heappushpop(stats[heap], item)
+
+
+def add_index_stats(stats, tree):
+    """Учитывает индекс: сколько файлов выводится и сколько исключено каждым правилом."""
+    if stats is None:
+        return
+    excluded = stats["excluded"]
+
+    def visit(node):
+        for _, pattern in node.get("pruned", ()):
+            excluded["folders"][pattern] = excluded["folders"].get(pattern, 0) + 1
+        for entry in node["children"]:
+            if entry["is_dir"]:
+                visit(entry)
+            elif entry["excluded"]:
+                excluded["files"][entry["excluded"]] = excluded["files"].get(entry["excluded"], 0) + 1
+            elif is_budget_omitted(entry):
+                excluded["token_budget"] += 1
+            else:
+                stats["files"]["listed"] += 1
+
+    visit(tree)
+
+
+def stats_report(stats, output_path=None, cache=None):
+    """Статистика в виде словаря для stats.json."""
+    report = {
+        "output": output_path,
+        "total_seconds": round(time.perf_counter() - stats["start"], 4),
+        "phases": {name: round(seconds, 4) for name, seconds in stats["phases"].items()},
+        "files": dict(stats["files"]),
+        "bytes_read": stats["bytes_read"],
+        "read_seconds": round(stats["read_seconds"], 4),
+        "parse_seconds": round(stats["parse_seconds"], 4),
+        "excluded": stats["excluded"],
+        "slowest_files": [{"path": path, "seconds": round(seconds, 4), "size": size}
+                          for seconds, path, size in sorted(stats["slowest"], reverse=True)],
+        "largest_files": [{"path": path, "size": size} for size, path in sorted(stats["largest"], reverse=True)],
+    }
+    if output_path and os.path.exists(output_path):
+        report["output_bytes"] = os.path.getsize(output_path)
+    if cache is not None:
+        report["cache"] = {"hits": cache["hits"], "misses": cache["misses"]}
+    if "snapshot" in stats:
+        report["snapshot"] = stats["snapshot"]
+    if "minify" in stats:
+        report["minify"] = dict(stats["minify"], saved=stats["minify"]["bytes_before"] - stats["minify"]["bytes_after"])
+    return report
+
+
+def format_stats_summary(report):
+    """Одна строка для статуса GUI и консоли."""
+    files = report["files"]
+    excluded = sum(report["excluded"]["files"].values()) + report["excluded"]["token_budget"]
+    phases = ", ".join(f"{name} {seconds:.2f} с" for name, seconds in report["phases"].items())
+    text = (f"{report['total_seconds']:.2f} с ({phases}); прочитано {files['read']} файлов, "
+            f"{report['bytes_read'] / (1024 * 1024):.1f} МБ; исключено {excluded}")
+    if files["errors"] or files["decode_errors"]:
+        text += f"; ошибок {files['errors'] + files['decode_errors']}"
+    if report["slowest_files"]:
+        text += f"; дольше всех {os.path.basename(report['slowest_files'][0]['path'])}"
+    if "minify" in report:
+        text += f"; минификация: {format_minify_report(report['minify'])}"
+    return text
+
+
+def stats_path(output_path):
+    """Файл статистики рядом с результатом: dump.txt -> dump.txt.stats.json.
+
+    Расширение остается в имени, чтобы у dump.txt и dump.json в одной папке была своя статистика.
+    """
+    return strip_compression_suffix(output_path) + ".stats.json"
+
+
+def write_stats(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def parse_name_list(value):
+    """Превращает строку "a, b, c" (или готовую коллекцию) в множество имен."""
+    if isinstance(value, str):
+        return set(item.strip() for item in value.split(",") if item.strip())
+    return set(value)
+
+
+def parse_ordered_list(value):
+    """Превращает строку "a, b, c" в кортеж, сохраняя порядок (для кодировок и шаблонов)."""
+    if isinstance(value, str):
+        return tuple(item.strip() for item in value.split(",") if item.strip())
+    return tuple(value)
+
+
+def load_settings_file(path=CONFIG_FILE):
+    """Читает файл конфигурации key=value и возвращает настройки поверх значений по умолчанию."""
+    settings = dict(DEFAULT_SETTINGS)
+    if not os.path.exists(path):
+        return settings
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f.readlines():
+            apply_setting_line(settings, line)
+    return settings
+
+
+def apply_setting_line(settings, line):
+    """Применяет к settings строку key=value из файла настроек; неизвестные ключи пропускаются."""
+    if "=" not in line:
+        return
+    key, value = line.strip().split("=", 1)
+    if key not in DEFAULT_SETTINGS:
+        return
+    default = DEFAULT_SETTINGS[key]
+    if isinstance(default, bool):
+        settings[key] = value == "True"
+    elif isinstance(default, int):
+        if value.isdigit():
+            settings[key] = int(value)
+    else:
+        settings[key] = value
+
+
+def save_settings_file(settings, path=CONFIG_FILE):
+    """Сохраняет настройки в файл конфигурации key=value."""
+    with open(path, "w", encoding="utf-8") as f:
+        for key in DEFAULT_SETTINGS:
+            f.write(f"{key}={settings.get(key, DEFAULT_SETTINGS[key])}\n")
+
+
+def load_batch_file(path, base_settings=None):
+    """Читает профили пакетного запуска (см. run_batch) и возвращает список пар (имя, настройки).
+
+    Формат тот же, что у файла настроек, но разбит на секции [имя]: строки до первой секции
+    задают общие значения, строки секции — настройки одного проекта поверх них. Относительные
+    пути source_folder и output_file отсчитываются от папки файла профилей.
+    """
+    common = dict(base_settings or DEFAULT_SETTINGS)
+    profiles = []
+    settings = common
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f.readlines():
+            line = line.strip()
+            if line.startswith("[") and line.endswith("]"):
+                settings = dict(common)
+                profiles.append((line[1:-1].strip(), settings))
+            elif not line.startswith("#"):
+                apply_setting_line(settings, line)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    outputs = {}
+    for name, settings in profiles:
+        for key in ("source_folder", "output_file"):
+            if not settings[key]:
+                raise ValueError(f"В профиле [{name}] не указан {key}")
+            settings[key] = os.path.normpath(os.path.join(base_dir, settings[key]))
+        # Проекты идут параллельно, поэтому писать в один файл они не могут
+        output = os.path.normcase(os.path.abspath(settings["output_file"]))
+        if output in outputs:
+            raise ValueError(f"Профили [{outputs[output]}] и [{name}] пишут в один файл {settings['output_file']}")
+        outputs[output] = name
+    if not profiles:
+        raise ValueError(f"В {path} нет ни одного профиля [имя]")
+    return profiles
+
+
+def run_scan(settings, progress_callback=None, cancel_event=None, stats=None, resources=None):
+    """Запускает сканирование по словарю настроек без GUI. Возвращает путь к результату.
+
+    Если установить cancel_event (threading.Event) из другого потока, сканирование
+    остановится на следующем файле с исключением ScanCancelled.
+    Если передан stats (new_stats()) или включен write_stats, собирается статистика запуска:
+    итог кладется в stats["report"], а при write_stats еще и в name.txt.stats.json.
+    resources — общие ресурсы пакетного запуска (см. run_batch): пул разбора, кэш и лимит открытых файлов.
+    """
+    settings = dict(DEFAULT_SETTINGS, **settings)
+    if stats is None and settings["write_stats"]:
+        stats = new_stats()
+    source_folder = settings["source_folder"]
+    output_file = settings["output_file"]
+    if not source_folder or not output_file:
+        raise ValueError("Не указаны папка с файлами или файл для сохранения")
+    if not os.path.isdir(source_folder):
+        raise ValueError(f"Папка не найдена: {source_folder}")
+
+    compression = output_compression(output_file, settings["compression"])
+    if compression and not output_file.lower().endswith(COMPRESSION_SUFFIXES[compression]):
+        output_file += COMPRESSION_SUFFIXES[compression]
+
+    exclude_extensions = parse_name_list(settings["exclude_extensions"])
+    exclude_folders = parse_name_list(settings["exclude_folders"])
+    exclude_files = parse_name_list(settings["exclude_files"])
+    exclude_patterns = parse_ordered_list(settings["exclude_patterns"])
+    if settings["use_gitignore"]:
+        exclude_patterns = (*read_gitignore_patterns(source_folder), *exclude_patterns)
+
+    read_workers = int(settings["read_workers"])
+    io_limit = None
+    if resources is not None:
+        symbol_pool = resources["symbol_pool"]
+        io_limit = resources["io_limit"]
+        cache = batch_scan_cache(resources, settings) if settings["use_cache"] else None
+    else:
+        cache = None
+        if settings["use_cache"]:
+            cache = open_scan_cache(settings["cache_path"], int(settings["cache_max_mb"]) * 1024 * 1024)
+        # Разбор кода занимает процессор, поэтому идет в отдельных процессах; пул запускает их при первом файле.
+        # Файлы отдаются пулу из потоков чтения: при одном потоке (и в кратком описании, где ключевые файлы
+        # читаются по одному) разбор шел бы через процессы последовательно, и быстрее разбирать здесь же
+        parse_workers = int(settings["parse_workers"]) or os.cpu_count() or 1
+        symbol_pool = None
+        if read_workers > 1 and not settings["ai_friendly"]:
+            symbol_pool = new_symbol_pool(parse_workers)
+        if symbol_pool is not None:
+            read_workers = max(read_workers, parse_workers)  # иначе потоков чтения не хватит на все процессы
+    try:
+        if settings["ai_friendly"]:
+            output_path = create_ai_friendly_summary(
+                source_folder, output_file, exclude_extensions, exclude_folders, exclude_files, progress_callback,
+                cancel_event=cancel_event, fallback_encodings=parse_ordered_list(settings["fallback_encodings"]),
+                cache=cache, symbol_pool=symbol_pool, exclude_patterns=exclude_patterns,
+                source_mode=settings["source_mode"], since=settings["since"] or None, compression=compression,
+                tree_max_entries=int(settings["tree_max_entries"]), stats=stats, io_limit=io_limit,
+                query=settings["query"].strip(), query_top_k=int(settings["query_top_k"]),
+                query_neighbors=int(settings["query_neighbors"]))
+        else:
+            output_path = process_directory(
+                source_folder, output_file, exclude_extensions, exclude_folders, exclude_files,
+                int(settings["max_file_size"]), settings["output_format"], settings["group_by_type"],
+                settings["prioritize_files"], settings["include_metadata"], progress_callback,
+                cancel_event=cancel_event, read_workers=read_workers, prefetch_depth=int(settings["prefetch_depth"]),
+                truncate_mode=settings["truncate_mode"],
+                fallback_encodings=parse_ordered_list(settings["fallback_encodings"]),
+                cache=cache, symbol_pool=symbol_pool, exclude_patterns=exclude_patterns,
+                source_mode=settings["source_mode"], since=settings["since"] or None,
+                token_budget=int(settings["token_budget"]), deduplicate=settings["deduplicate"],
+                shard_max_bytes=shard_limit(settings["shard_max_bytes"], settings["shard_max_tokens"]),
+                compression=compression, tree_max_entries=int(settings["tree_max_entries"]), stats=stats,
+                io_limit=io_limit, query=settings["query"].strip(), query_top_k=int(settings["query_top_k"]),
+                query_neighbors=int(settings["query_neighbors"]), minify=settings["minify"])
+    finally:
+        # Общие ресурсы пакетного запуска закрывает run_batch
+        if resources is None and symbol_pool is not None:
+            symbol_pool.shutdown(cancel_futures=True)
+        if resources is None and cache is not None:
+            close_scan_cache(cache)
+
+    if stats is not None:
+        # Счетчики общего кэша относятся ко всем проектам пакета, а не к этому
+        stats["report"] = stats_report(stats, output_path, cache if resources is None else None)
+        if settings["write_stats"]:
+            write_stats(stats["report"], stats_path(output_file))
+    return output_path
+
+
+BATCH_WORKERS = 4  # сколько проектов пакета обрабатывается одновременно
+BATCH_MAX_OPEN_FILES = 64  # сколько файлов всех проектов пакета может читаться одновременно
+
+
+def run_batch(profiles, workers=BATCH_WORKERS, parse_workers=0, max_open_files=BATCH_MAX_OPEN_FILES,
+              cancel_event=None, done_callback=None):
+    """Обрабатывает профили (имя, настройки) параллельно, не больше workers проектов сразу.
+
+    Проекты делят один пул процессов разбора (parse_workers, 0 = по числу ядер), кэши с
+    одинаковым cache_path и общий лимит одновременно читаемых файлов max_open_files.
+    Ошибка одного проекта не останавливает остальные. Возвращает результаты в порядке
+    профилей: словари name, output, seconds, files и error (исключение или None);
+    done_callback(результат) вызывается по мере завершения проектов.
+    """
+    parse_workers = parse_workers or os.cpu_count() or 1
+    resources = {
+        "symbol_pool": new_symbol_pool(parse_workers),
+        "io_limit": threading.BoundedSemaphore(max_open_files),
+        "caches": {},
+        "lock": threading.Lock(),
+    }
 
-        # Записываем в файл
-        with open(output_path, "w", encoding="utf-8") as out:
-            out.write(f"# Проект: {project_info['project_name']}\n\n")
+    def run_profile(name, settings):
+        result = {"name": name, "output": None, "seconds": 0.0, "files": 0, "error": None}
+        start = time.perf_counter()
+        stats = new_stats()
+        try:
+            result["output"] = run_scan(settings, cancel_event=cancel_event, stats=stats, resources=resources)
+            result["files"] = stats["report"]["files"]["listed"]
+        except Exception as e:
+            result["error"] = e
+        result["seconds"] = time.perf_counter() - start
+        if done_callback is not None:
+            with resources["lock"]:  # callback вызывается из потоков пакета по одному
+                done_callback(result)
+        return result
 
-            # Добавляем README если он есть
-            if "readme_content" in project_info:
-                out.write("## README\n\n")
-                out.write(project_info["readme_content"] + "\n\n")
-
-            # Добавляем сгенерированное описание
-            out.write("## Краткое описание проекта\n\n")
-            out.write(project_info["summary"] + "\n\n")
-
-            # Добавляем структуру проекта
-            out.write("## Структура проекта\n\n")
-            out.write("```\n")
-            out.write("\n".join(project_info["structure"]) + "\n")
-            out.write("```\n\n")
-
-            # Добавляем информацию о ключевых файлах
-            out.write("## Ключевые файлы\n\n")
-            for file_path, info in project_info["key_files"].items():
-                out.write(f"### {os.path.basename(file_path)}\n\n")
-                out.write(f"Путь: `{file_path}`\n\n")
-
-                if info.get("docstring"):
-                    out.write(f"Документация: {info['docstring']}\n\n")
-
-                if info.get("classes"):
-                    out.write(f"Классы: {', '.join(info['classes'])}\n\n")
-
-                if info.get("functions"):
-                    out.write(f"Функции: {', '.join(info['functions'])}\n\n")
-
-                if info.get("summary"):
-                    out.write(f"Описание: {info['summary']}\n\n")
-
-                # Добавляем код с выделением синтаксиса
-                if info.get("content"):
-                    out.write(f"```{info.get('language', 'python')}\n")
-                    out.write(info["content"] + "\n")
-                    out.write("```\n\n")
-
-        progress["value"] = total_items
-        progress.update_idletasks()
-        status_label.config(text="✅ Готово!")
-        messagebox.showinfo("Готово", f"Краткое описание сохранено в {output_path}")
-    except Exception as e:
-        messagebox.showerror("Ошибка", f"Произошла ошибка при создании краткого описания: {e}")
-        status_label.config(text="❌ Ошибка!")
+    try:
+        with ThreadPoolExecutor(max(1, workers)) as executor:
+            futures = [executor.submit(run_profile, name, settings) for name, settings in profiles]
+            return [future.result() for future in futures]
+    finally:
+        if resources["symbol_pool"] is not None:
+            resources["symbol_pool"].shutdown(cancel_futures=True)
+        for cache in resources["caches"].values():
+            close_scan_cache(cache)
+
+
+def batch_scan_cache(resources, settings):
+    """Кэш пакетного запуска: проекты с одинаковым cache_path пишут через одно соединение."""
+    path = os.path.abspath(settings["cache_path"])
+    with resources["lock"]:
+        cache = resources["caches"].get(path)
+        if cache is None:
+            cache = open_scan_cache(path, int(settings["cache_max_mb"]) * 1024 * 1024)
+            resources["caches"][path] = cache
+    return cache
+
+
+def format_batch_summary(results):
+    """Таблица итогов пакетного запуска: по строке на проект и общая строка."""
+    width = max(len(result["name"]) for result in results)
+    lines = []
+    for result in results:
+        if result["error"] is None:
+            lines.append(f"✅ {result['name']:<{width}}  {result['seconds']:7.2f} с  "
+                         f"{result['files']:6d} файлов  {result['output']}")
+        else:
+            lines.append(f"❌ {result['name']:<{width}}  {result['seconds']:7.2f} с  ошибка: {result['error']}")
+    succeeded = sum(1 for result in results if result["error"] is None)
+    lines.append(f"Успешно {succeeded} из {len(results)}")
+    return "\n".join(lines)
+
+
+def create_ai_friendly_summary(directory, output_path, exclude_extensions, exclude_folders, exclude_files,
+                               progress_callback=None, fallback_encodings=("cp1251",), cache=None,
+                               symbol_pool=None, exclude_patterns=(), source_mode="fs", since=None, cancel_event=None,
+                               compression=None, tree_max_entries=0, stats=None, io_limit=None, query="",
+                               query_top_k=20, query_neighbors=1):
+    """Создает краткое описание проекта, оптимизированное для ИИ.
+
+    При непустом query ключевыми файлами становятся файлы, выбранные plan_query: лучшие по BM25 и их соседи.
+    """
+    progress = new_progress(progress_callback, cancel_event)
+    phase_start = time.perf_counter()
+    rules = make_exclude_rules(exclude_extensions, exclude_folders, exclude_files, exclude_patterns)
+    tree = build_source_index(directory, rules, source_mode, since)
+    add_phase(stats, "index", phase_start)
+    check_cancelled(progress)
+    phase_start = time.perf_counter()
+    total_items = count_listed_files(tree)
+    set_progress(progress, maximum=total_items)
+    add_phase(stats, "count", phase_start)
+    add_index_stats(stats, tree)
+
+    # Создаем структуру для хранения информации
+    project_info = {
+        "project_name": os.path.basename(directory),
+        "structure": [],
+        "key_files": {},
+        "file_types": {},
+        "summary": ""
+    }
 
+    # Получаем структуру проекта
+    phase_start = time.perf_counter()
+    project_info["structure"] = generate_project_structure(tree, max_entries=tree_max_entries).split("\n")
+    add_phase(stats, "structure", phase_start)
+
+    # Ключевые файлы по запросу — те же, что и в полном выводе: top_k лучших и соседи
+    key_paths = None
+    if query:
+        phase_start = time.perf_counter()
+        read_options = {"max_file_size": 0, "fallback_encodings": fallback_encodings, "cache": cache,
+                        "io_limit": io_limit}
+        _, key_paths = plan_query(tree, query, read_options, query_top_k, query_neighbors, progress=progress)
+        add_phase(stats, "query", phase_start)
+
+    # Собираем информацию о файлах
+    phase_start = time.perf_counter()
+    collect_file_info(tree, project_info, progress, fallback_encodings, cache, symbol_pool, stats, io_limit,
+                      key_paths)
+
+    # Создаем краткое описание
+    generate_summary(project_info)
+    add_phase(stats, "read", phase_start)
+
+    # Записываем в файл
+    phase_start = time.perf_counter()
+    with open_output(output_path, compression=compression) as out:
+        out.write(f"# Проект: {project_info['project_name']}\n\n")
+
+        # Добавляем README если он есть
+        if "readme_content" in project_info:
+            out.write("## README\n\n")
+            out.write(project_info["readme_content"] + "\n\n")
+
+        # Добавляем сгенерированное описание
+        out.write("## Краткое описание проекта\n\n")
+        out.write(project_info["summary"] + "\n\n")
+
+        # Добавляем структуру проекта
+        out.write("## Структура проекта\n\n")
+        out.write("```\n")
+        out.write("\n".join(project_info["structure"]) + "\n")
+        out.write("```\n\n")
+
+        # Добавляем информацию о ключевых файлах
+        out.write("## Ключевые файлы\n\n")
+        for file_path, info in project_info["key_files"].items():
+            out.write(f"### {os.path.basename(file_path)}\n\n")
+            out.write(f"Путь: `{file_path}`\n\n")
+
+            if info.get("docstring"):
+                out.write(f"Документация: {info['docstring']}\n\n")
+
+            write_code_info(out, info, "\n\n")
+
+            if info.get("summary"):
+                out.write(f"Описание: {info['summary']}\n\n")
+
+            # Добавляем код с выделением синтаксиса
+            if info.get("content"):
+                out.write(f"```{info.get('language', 'python')}\n")
+                out.write(info["content"] + "\n")
+                out.write("```\n\n")
+
+    set_progress(progress, value=total_items)
+    add_phase(stats, "output", phase_start)
+    return output_path
+
+
+# Файлы и расширения, которые считаются ключевыми для понимания проекта
+KEY_FILE_NAMES = ["settings.py", "urls.py", "models.py", "views.py", "main.py", "app.py", "index.py"]
+KEY_EXTENSIONS = [".py", ".js", ".html", ".css", ".java"]
+
+
+def collect_file_info(tree, project_info, progress, fallback_encodings=("cp1251",), cache=None, symbol_pool=None,
+                      stats=None, io_limit=None, key_paths=None):
+    """Собирает информацию о файлах проекта.
+
+    key_paths — пути ключевых файлов (например, выбранных plan_query); по умолчанию ключевые
+    файлы определяются по имени и расширению.
+    """
+    # Ключевые файлы попадают в описание целиком
+    read_options = {"max_file_size": 0, "fallback_encodings": fallback_encodings, "cache": cache,
+                    "symbol_pool": symbol_pool, "stats": stats, "io_limit": io_limit}
 
-def collect_file_info(directory, project_info, exclude_extensions, exclude_folders, exclude_files, progress):
-    """Собирает информацию о файлах проекта."""
     # Найдем README файл
-    readme_path = find_readme(directory)
+    readme_path = find_readme(tree)
     if readme_path:
         try:
             with open(readme_path, "r", encoding="utf-8") as readme_file:
@@ -96,66 +641,59 @@ def collect_file_info(directory, project_info, exclude_extensions, exclude_folde
         except Exception:
             project_info["readme_content"] = "[Ошибка чтения README]"
 
-    # Список приоритетных файлов и расширений
-    priority_files = ["settings.py", "urls.py", "models.py", "views.py", "main.py", "app.py", "index.py"]
-    priority_extensions = [".py", ".js", ".html", ".css", ".java"]
-
     # Счетчик файлов
     file_count = 0
 
-    # Обходим директорию
-    for root, dirs, files in os.walk(directory):
-        # Исключаем папки
-        dirs[:] = [d for d in dirs if d not in exclude_folders]
-
-        for file in files:
-            # Add check for excluded files
-            if file in exclude_files:
-                continue
-            file_path = os.path.join(root, file)
-            ext = os.path.splitext(file)[1].lower()
-
-            # Пропускаем исключенные расширения
-            if ext in exclude_extensions:
-                continue
-
-            # Учитываем этот тип файла
-            project_info["file_types"].setdefault(ext, 0)
-            project_info["file_types"][ext] += 1
-
-            # Определяем, является ли файл ключевым
-            is_key_file = file in priority_files or ext in priority_extensions
-
-            # Ограничиваем количество ключевых файлов
-            if is_key_file and len(project_info["key_files"]) < 10:
-                language = get_language_by_extension(ext)
-                file_info = {
-                    "language": language,
-                    "size": os.path.getsize(file_path)
-                }
+    # Обходим индекс директории
+    for entry in iter_tree_files(tree):
+        if entry["excluded"]:
+            continue
+        file = entry["name"]
+        file_path = entry["path"]
+        ext = entry["ext"]
+
+        # Учитываем этот тип файла
+        project_info["file_types"].setdefault(ext, 0)
+        project_info["file_types"][ext] += 1
+
+        # Определяем, является ли файл ключевым
+        if key_paths is not None:
+            is_key_file = file_path in key_paths
+        else:
+            is_key_file = file in KEY_FILE_NAMES or ext in KEY_EXTENSIONS
+
+        # Ограничиваем количество ключевых файлов; выбор по запросу уже ограничен top_k
+        if is_key_file and (key_paths is not None or len(project_info["key_files"]) < 10):
+            language = get_language_by_extension(ext)
+            file_info = {
+                "language": language,
+                "size": entry["size"]
+            }
 
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        content = f.read()
-                        file_info["content"] = content
+            record = load_file_record(entry, read_options, language)
+            if record["error"] is not None:
+                file_info["content"] = "[Ошибка чтения файла]"
+            elif record["binary"]:
+                file_info["content"] = "[Двоичный файл]"
+            else:
+                content = record["content"]
+                file_info["content"] = content
 
-                        # Для Python файлов извлекаем дополнительную информацию
-                        if language == "python":
-                            code_info = extract_functions_and_classes(content, language)
-                            file_info.update(code_info)
-                            file_info["docstring"] = extract_docstring(content, language)
+                # Для кода на поддерживаемых языках добавляем символы и документацию из разбора
+                if language in SYMBOL_EXTRACTORS:
+                    code_info = record["code_info"]
+                    file_info.update(code_info)
+                    file_info["docstring"] = record["docstring"]
 
-                            # Генерируем краткое описание файла
-                            file_info[
-                                "summary"] = f"Файл содержит {len(code_info.get('functions', []))} функций и {len(code_info.get('classes', []))} классов."
-                except Exception:
-                    file_info["content"] = "[Ошибка чтения файла]"
+                    # Генерируем краткое описание файла
+                    file_info["summary"] = (f"Файл содержит {len(code_info['functions'])} функций, "
+                                            f"{len(code_info.get('methods', []))} методов и "
+                                            f"{len(code_info['classes'])} классов.")
 
-                project_info["key_files"][file_path] = file_info
+            project_info["key_files"][file_path] = file_info
 
-            file_count += 1
-            progress["value"] += 1
-            progress.update_idletasks()
+        file_count += 1
+        advance_progress(progress)
 
     # Добавляем общую статистику
     project_info["total_files"] = file_count
@@ -185,97 +723,152 @@ def generate_summary(project_info):
     # Объединяем всё в одну строку
     project_info["summary"] = "\n".join(summary)
 
-def collect_files_by_type(directory, grouped_files, exclude_extensions, exclude_folders, exclude_files):
+def collect_files_by_type(tree, grouped_files):
     """Собирает файлы по типам расширений."""
-    try:
-        for root, dirs, files in os.walk(directory):
-            dirs[:] = [d for d in dirs if d not in exclude_folders]  # Исключаем папки
-            for file in files:
-                # Add check for excluded files
-                if file in exclude_files:
-                    continue
-                ext = os.path.splitext(file)[1].lower()
-                if ext in exclude_extensions:
-                    continue
-                file_path = os.path.join(root, file)
-                grouped_files.setdefault(ext, []).append(file_path)
-    except Exception:
-        pass  # Игнорируем ошибки при сканировании
-
-def scan_folder_json(directory, files_list, exclude_extensions, exclude_folders, exclude_files, max_file_size, progress):
-    try:
-        items = os.listdir(directory)
+    for entry in iter_tree_files(tree):
+        if entry["excluded"]:
+            continue
+        if is_budget_omitted(entry):
+            continue
+        grouped_files.setdefault(entry["ext"], []).append(entry)
+
+def iter_scan_items(node, level=0):
+    """Перебирает индекс в порядке вывода: кортежи (вид, элемент, уровень), вид — "dir", "file" или "error"."""
+    if node["error"] is not None:
+        yield "error", node, level
+        return
+    for entry in node["children"]:
+        if entry["is_dir"]:
+            yield "dir", entry, level
+            yield from iter_scan_items(entry, level + 1)
+        elif not entry["excluded"] and not is_budget_omitted(entry):
+            yield "file", entry, level
+
+
+def iter_prefetched(items, load, workers=4, prefetch_depth=32, stats=None):
+    """Выполняет load(item) в пуле потоков с опережением и отдает пары (item, результат) в исходном порядке.
+
+    Одновременно в работе и в буфере находится не больше prefetch_depth элементов,
+    поэтому расход памяти ограничен. При workers <= 1 все выполняется в текущем потоке.
+    Если передан stats, время, которое потребитель ждет результатов, добавляется к фазе "read".
+    """
+    if workers <= 1:
         for item in items:
-            item_path = os.path.join(directory, item)
-            if os.path.isdir(item_path):
-                if item in exclude_folders:
-                    continue
-                scan_folder_json(item_path, files_list, exclude_extensions, exclude_folders, exclude_files, max_file_size, progress)
+            start = time.perf_counter()
+            result = load(item)
+            add_phase(stats, "read", start)
+            yield item, result
+        return
+
+    def wait(future):
+        start = time.perf_counter()
+        result = future.result()
+        add_phase(stats, "read", start)
+        return result
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for item in items:
+                pending.append((item, pool.submit(load, item)))
+                if len(pending) >= max(prefetch_depth, 1):
+                    item, future = pending.popleft()
+                    yield item, wait(future)
+            while pending:
+                item, future = pending.popleft()
+                yield item, wait(future)
+        finally:
+            # Если потребитель остановился раньше, не дочитываем лишнее
+            for _, future in pending:
+                future.cancel()
+
+
+def scan_folder_json(tree, files_list, read_options, progress,
+                     read_workers=4, prefetch_depth=32, seen_hashes=None, minifier=None):
+    def load(item):
+        kind, entry, _ = item
+        if kind != "file":
+            return None
+        return load_file_record(entry, read_options)
+
+    items = iter_scan_items(tree)
+    for (kind, entry, _), record in iter_prefetched(items, load, read_workers, prefetch_depth,
+                                                    read_options.get("stats")):
+        if kind == "error":
+            if isinstance(entry["error"], PermissionError):
+                files_list.append({"error": f"Ошибка доступа к папке: {entry['path']}"})
             else:
-                # Add check for excluded files
-                if item in exclude_files:
-                    continue
-                ext = os.path.splitext(item)[1].lower()
-                if ext in exclude_extensions:
-                    continue
-                file_data = {
-                    "path": item_path,
-                    "name": item,
-                    "extension": ext,
-                    "language": get_language_by_extension(ext),
-                    "size": os.path.getsize(item_path),
-                    "modified": time.ctime(os.path.getmtime(item_path))
-                }
-                try:
-                    with open(item_path, "r", encoding="utf-8") as f:
-                        content = f.read()
-                        if max_file_size > 0 and len(content) > max_file_size:
-                            file_data["content"] = content[:max_file_size]
-                            file_data["truncated"] = True
-                            file_data["original_size"] = len(content)
-                        else:
-                            file_data["content"] = content
-                            file_data["truncated"] = False
-                except Exception as e:
-                    file_data["error"] = str(e)
-                files_list.append(file_data)
-            progress["value"] += 1
-            progress.update_idletasks()
-    except PermissionError:
-        files_list.append({"error": f"Ошибка доступа к папке: {directory}"})
-    except Exception as e:
-        files_list.append({"error": f"Ошибка обработки папки {directory}: {e}"})
-
-def scan_folder(directory, out, exclude_extensions, exclude_folders, exclude_files, max_file_size, include_metadata, progress, level=0):
-    indent = "    " * level
-    try:
-        items = os.listdir(directory)
-        for item in items:
-            item_path = os.path.join(directory, item)
-            if os.path.isdir(item_path):
-                if item in exclude_folders:
-                    continue
-                out.write(f"{indent}📂 {item}/\n")
-                scan_folder(item_path, out, exclude_extensions, exclude_folders, exclude_files, max_file_size, include_metadata, progress, level + 1)
+                files_list.append({"error": f"Ошибка обработки папки {entry['path']}: {entry['error']}"})
+            continue
+        if kind == "file":
+            ext = entry["ext"]
+            file_data = {
+                "path": entry["path"],
+                "name": entry["name"],
+                "extension": ext,
+                "language": get_language_by_extension(ext),
+                "size": entry["size"],
+                "modified": time.ctime(entry["mtime"])
+            }
+            if record.get("budget"):
+                file_data["budget"] = record["budget"]
+            original = find_duplicate(seen_hashes, entry, record)
+            if original is not None:
+                file_data["duplicate_of"] = original
+            elif record["error"] is not None:
+                file_data["error"] = str(record["error"])
+            elif record["binary"]:
+                file_data["binary"] = True
+            elif record["content"] is None:
+                # Только сигнатуры: содержимое не вошло в бюджет токенов
+                file_data.update(record.get("code_info") or {})
+                if record.get("docstring"):
+                    file_data["docstring"] = record["docstring"]
             else:
-                # Add check for excluded files
-                if item in exclude_files:
-                    continue
-                ext = os.path.splitext(item)[1].lower()
-                if ext in exclude_extensions:
-                    continue
-                out.write(f"{indent}📄 {item}\n")
-                language = get_language_by_extension(ext)
-                process_file(item_path, out, max_file_size, include_metadata, ext, language, progress)
-            progress["value"] += 1
-            progress.update_idletasks()
-    except PermissionError:
-        out.write(f"{indent}[Ошибка доступа к папке: {directory}]\n\n")
-    except Exception as e:
-        out.write(f"{indent}[Ошибка обработки папки {directory}: {e}]\n\n")
+                file_data["encoding"] = record["encoding"]
+                file_data["content"] = record["content"]
+                if minifier is not None:
+                    file_data["content"] = minify_content(minifier, record["content"], file_data["language"],
+                                                          entry["path"])
+                file_data["truncated"] = record["truncated"]
+                if record["truncated"]:
+                    file_data["original_size"] = record["original_size"]
+                if record.get("skeleton"):
+                    file_data["skeleton"] = True
+            files_list.append(file_data)
+            advance_progress(progress)
+
+def scan_folder(tree, out, read_options, include_metadata, progress,
+                read_workers=4, prefetch_depth=32, seen_hashes=None, skip_paths=(), minifier=None):
+    """Выводит файлы индекса по папкам; файлы из skip_paths (уже выведенные приоритетные) пропускаются."""
+    def load(item):
+        kind, entry, _ = item
+        if kind != "file":
+            return None
+        return load_file_record(entry, read_options, get_language_by_extension(entry["ext"]))
+
+    items = (item for item in iter_scan_items(tree) if item[0] != "file" or item[1]["path"] not in skip_paths)
+    for (kind, entry, level), record in iter_prefetched(items, load, read_workers, prefetch_depth,
+                                                        read_options.get("stats")):
+        indent = "    " * level
+        if kind == "error":
+            if isinstance(entry["error"], PermissionError):
+                out.write(f"{indent}[Ошибка доступа к папке: {entry['path']}]\n\n")
+            else:
+                out.write(f"{indent}[Ошибка обработки папки {entry['path']}: {entry['error']}]\n\n")
+            continue
+        if kind == "dir":
+            out.write(f"{indent}📂 {entry['name']}/\n")
+        else:
+            out.write(f"{indent}📄 {entry['name']}\n")
+            language = get_language_by_extension(entry["ext"])
+            process_file(entry, out, read_options, include_metadata, language, record, seen_hashes, minifier)
+            advance_progress(progress)
 
 
 def create_context_menu(widget):
+    import tkinter as tk
+
     menu = tk.Menu(widget, tearoff=0)
     menu.add_command(label="Копировать", command=lambda: widget.event_generate("<<Copy>>"))
     menu.add_command(label="Вставить", command=lambda: widget.event_generate("<<Paste>>"))
@@ -341,208 +934,2634 @@ def get_language_by_extension(ext):
     return language_map.get(ext.lower(), "text")
 
 
+# Запасной разбор Python регулярными выражениями (для файлов, которые не разбирает ast)
+PY_DOCSTRING_RE = re.compile(r'\A\s*(?:#[^\n]*\n\s*)*[rRuU]?("""|\'\'\')(.*?)\1', re.DOTALL)
+PY_FUNCTION_RE = re.compile(r'^[ \t]*(?:async[ \t]+)?def[ \t]+(\w+)[ \t]*\(', re.MULTILINE)
+PY_CLASS_RE = re.compile(r'^[ \t]*class[ \t]+(\w+)[ \t]*[(:]', re.MULTILINE)
+
+
 def extract_docstring(content, language):
-    """Извлекает документацию из файла."""
+    """Извлекает документацию модуля: строку в тройных кавычках в самом начале файла."""
     if language == "python":
-        # Ищем строки документации Python
-        docstring_pattern = r'"""(.*?)"""'
-        docstrings = re.findall(docstring_pattern, content, re.DOTALL)
-        if docstrings:
-            return docstrings[0].strip()
+        match = PY_DOCSTRING_RE.match(content)
+        if match:
+            return match.group(2).strip()
     return ""
 
 
 def extract_functions_and_classes(content, language):
     """Извлекает имена функций и классов из кода."""
     if language == "python":
-        # Ищем определения функций и классов
-        functions = re.findall(r'def\s+(\w+)\s*\(', content)
-        classes = re.findall(r'class\s+(\w+)\s*[\(:]', content)
+        # Ищем определения функций и классов в начале строк
         return {
-            "functions": functions,
-            "classes": classes
+            "functions": PY_FUNCTION_RE.findall(content),
+            "classes": PY_CLASS_RE.findall(content)
         }
     return {"functions": [], "classes": []}
 
 
+def extract_python_symbols(content):
+    """Разбирает код Python через ast: функции модуля, классы, методы, их сигнатуры и документация модуля.
+
+    Определения внутри if/try/with на уровне модуля и класса тоже учитываются, вложенные в
+    функции — нет. Если файл не разбирается (другая версия Python, синтаксическая ошибка),
+    используются регулярные выражения: без методов и сигнатур.
+    Функция выполняется в пуле процессов, поэтому возвращает только простые типы.
+    """
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        info = extract_functions_and_classes(content, "python")
+        return dict(info, methods=[], signatures=[], docstring=extract_docstring(content, "python"))
+
+    # Аннотации, значения по умолчанию и базовые классы берутся из исходника по позициям узлов:
+    # это намного быстрее ast.unparse. Смещения col_offset считаются в байтах UTF-8.
+    data = content.encode("utf-8")
+    line_starts = [0, *(match.end() for match in re.finditer(b"\n", data))]
+
+    def source(node):
+        start = line_starts[node.lineno - 1] + node.col_offset
+        end = line_starts[node.end_lineno - 1] + node.end_col_offset
+        text = data[start:end].decode("utf-8", "replace")
+        return " ".join(text.split()) if "\n" in text else text  # многострочное выражение — в одну строку
+
+    def argument(arg, default=None):
+        text = arg.arg
+        if arg.annotation is not None:
+            text += ": " + source(arg.annotation)
+        if default is not None:
+            text += (" = " if arg.annotation is not None else "=") + source(default)
+        return text
+
+    def arguments(args):
+        parts = []
+        positional = args.posonlyargs + args.args
+        defaults = [None] * (len(positional) - len(args.defaults)) + args.defaults
+        for index, (arg, default) in enumerate(zip(positional, defaults)):
+            parts.append(argument(arg, default))
+            if index == len(args.posonlyargs) - 1:
+                parts.append("/")
+        if args.vararg is not None:
+            parts.append("*" + argument(args.vararg))
+        elif args.kwonlyargs:
+            parts.append("*")
+        parts.extend(argument(arg, default) for arg, default in zip(args.kwonlyargs, args.kw_defaults))
+        if args.kwarg is not None:
+            parts.append("**" + argument(args.kwarg))
+        return ", ".join(parts)
+
+    info = {"functions": [], "classes": [], "methods": [], "signatures": [],
+            "docstring": (ast.get_docstring(tree) or "").strip()}
+
+    def visit(nodes, prefix):
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                name = prefix + node.name
+                (info["methods"] if prefix else info["functions"]).append(name)
+                keyword = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+                returns = f" -> {source(node.returns)}" if node.returns is not None else ""
+                info["signatures"].append(f"{keyword} {name}({arguments(node.args)}){returns}")
+            elif isinstance(node, ast.ClassDef):
+                name = prefix + node.name
+                info["classes"].append(name)
+                bases = ", ".join(source(base) for base in node.bases + node.keywords)
+                info["signatures"].append(f"class {name}({bases})" if bases else f"class {name}")
+                visit(node.body, name + ".")
+            elif isinstance(node, (ast.If, ast.Try, ast.With, ast.ExceptHandler)):
+                visit(ast.iter_child_nodes(node), prefix)
+
+    visit(tree.body, "")
+    return info
+
+
+# Символы остальных языков: один проход finditer по объединенному регулярному выражению языка.
+# Комментарии и строки входят в выражение как "skip" и поглощаются целиком, поэтому объявления
+# внутри них не находятся. Объявления ищутся только в начале строки.
+SYMBOL_KEYS = {"function": "functions", "method": "methods", "class": "classes", "type": "types",
+               "export": "exports"}
+C_LIKE_SKIP = [r'//[^\n]*', r'/\*(?s:.*?)\*/', r'"(?:\\.|[^"\\\n])*"', r"'(?:\\.|[^'\\\n])*'"]
+# Имена, которые шаблон метода в Java/C# может принять за объявление: "else if (x) {"
+C_LIKE_RESERVED = {"if", "for", "foreach", "while", "switch", "catch", "return", "new", "else", "do", "try",
+                   "throw", "case", "using", "lock", "fixed", "when", "synchronized"}
+
+
+def compile_symbol_rules(skip, rules):
+    """Собирает одно регулярное выражение: сначала пропуски, затем правила (вид, шаблон).
+
+    В шаблоне имя символа — группа (?P<name>...), она должна закрываться последней;
+    необязательная группа (?P<owner>...) перед ней дает префикс "Владелец.имя".
+    """
+    parts = [f"(?P<skip_{index}>{pattern})" for index, pattern in enumerate(skip)]
+    for index, (kind, pattern) in enumerate(rules):
+        parts.append(pattern.replace("(?P<owner>", f"(?P<owner_{index}>").replace("(?P<name>", f"(?P<{kind}_{index}>"))
+    return re.compile("|".join(parts), re.MULTILINE)
+
+
+def make_symbol_extractor(skip, rules, exported=None, reserved=frozenset()):
+    """Создает функцию content -> code_info для языка; регулярное выражение компилируется один раз.
+
+    exported(текст объявления, имя) решает, попадает ли символ в "exports".
+    Если функции передать список offsets, в него добавляются позиции начала строк объявлений.
+    """
+    regex = compile_symbol_rules(skip, rules)
+    owners = {str(index) for index, (_, pattern) in enumerate(rules) if "(?P<owner>" in pattern}
+
+    def extract(content, offsets=None):
+        info = {"functions": [], "classes": [], "methods": [], "types": [], "exports": [], "signatures": [],
+                "docstring": ""}
+        for match in regex.finditer(content):
+            kind, _, index = match.lastgroup.rpartition("_")
+            if kind == "skip":
+                continue
+            name = match.group(match.lastgroup)
+            if kind == "export":
+                # export { a, b as c } — экспортируются внешние имена
+                info["exports"].extend(part.split(" as ")[-1].strip() for part in name.split(",") if part.strip())
+                continue
+            if name in reserved:
+                continue
+            if index in owners:
+                name = f"{match.group('owner_' + index)}.{name}"
+            info[SYMBOL_KEYS[kind]].append(name)
+            if offsets is not None:
+                offsets.append(match.start())
+            if exported is not None and exported(match.group(0), name):
+                info["exports"].append(name)
+            line_end = content.find("\n", match.start())
+            line = content[match.start():line_end if line_end != -1 else len(content)]
+            info["signatures"].append(declaration_head(line[:200]))
+        # Перегрузки и конструкторы дают одно и то же имя несколько раз
+        info["exports"] = list(dict.fromkeys(info["exports"]))
+        return info
+
+    return extract
+
+
+def declaration_head(line):
+    """Строка объявления без тела: обрезается по первой "{" вне скобок."""
+    depth = 0
+    for index, char in enumerate(line):
+        if char in "([<":
+            depth += 1
+        elif char in ")]>" and depth:
+            depth -= 1
+        elif char == "{" and depth == 0:
+            return line[:index].strip()
+    return line.strip()
+
+
+def js_symbol_rules(prefix):
+    """Правила для JavaScript; prefix — модификаторы перед объявлением (в TypeScript еще declare)."""
+    ident = r"[A-Za-z_$][\w$]*"
+    return [
+        ("class", rf"^[ \t]*{prefix}(?:abstract[ \t]+)?class[ \t]+(?P<name>{ident})"),
+        ("function", rf"^[ \t]*{prefix}(?:async[ \t]+)?function\b[ \t]*\*?[ \t]*(?P<name>{ident})"),
+        ("function", rf"^[ \t]*{prefix}(?:const|let|var)[ \t]+(?P<name>{ident})[ \t]*(?::[^=\n]+)?=[ \t]*"
+                     rf"(?:async[ \t]+)?(?:function\b|\([^)\n]*\)[ \t]*(?::[^=\n]+)?=>|{ident}[ \t]*=>)"),
+        ("export", r"^[ \t]*export[ \t]*\{(?P<name>[^}]*)\}"),
+        ("export", rf"^[ \t]*(?:module\.)?exports\.(?P<name>{ident})[ \t]*="),
+    ]
+
+
+def c_like_method_rule(modifiers):
+    """Метод Java/C#: модификаторы, тип результата (у конструктора — только модификатор) и имя.
+
+    После списка параметров должна идти "{" или конец строки; вызовы вида "return f(x);" не подходят.
+    """
+    type_name = r"[\w.$]+(?:<[^>\n]*>)?(?:\[\])*\??"
+    parameters = r"\((?:[^;\n]*\)[ \t]*(?:throws[^{;\n]*)?(?:\{|$)|[^;)\n]*$)"
+    return ("method", rf"^[ \t]*{modifiers}(?:<[^>\n]+>[ \t]+)?{type_name}[ \t]+(?P<name>\w+)[ \t]*{parameters}")
+
+
+JS_EXPORT = r"(?:export[ \t]+(?:default[ \t]+)?)?"
+JAVA_MODIFIERS = (r"(?:(?:public|protected|private|abstract|final|static|sealed|non-sealed|strictfp|"
+                  r"synchronized|native|default)[ \t]+)*")
+CSHARP_MODIFIERS = (r"(?:(?:public|protected|private|internal|static|virtual|override|abstract|sealed|"
+                    r"async|partial|readonly|unsafe|extern|new)[ \t]+)*")
+RUST_VISIBILITY = r"(?:pub(?:\([^)\n]*\))?[ \t]+)?"
+GO_IDENT = r"[A-Za-z_]\w*"
+
+# Реестр: язык (как в get_language_by_extension) -> функция content -> code_info.
+# Новый язык добавляется одной записью; Python разбирается через ast (extract_python_symbols).
+SYMBOL_EXTRACTORS = {
+    "python": extract_python_symbols,
+    "javascript": make_symbol_extractor(
+        C_LIKE_SKIP + [r"`(?:\\.|[^`\\])*`"], js_symbol_rules(JS_EXPORT),
+        exported=lambda text, name: text.lstrip().startswith("export")),
+    "typescript": make_symbol_extractor(
+        C_LIKE_SKIP + [r"`(?:\\.|[^`\\])*`"],
+        js_symbol_rules(JS_EXPORT + r"(?:declare[ \t]+)?") + [
+            ("type", rf"^[ \t]*{JS_EXPORT}(?:declare[ \t]+)?(?:interface|type|(?:const[ \t]+)?enum)[ \t]+"
+                     r"(?P<name>[A-Za-z_$][\w$]*)"),
+        ],
+        exported=lambda text, name: text.lstrip().startswith("export")),
+    "go": make_symbol_extractor(
+        C_LIKE_SKIP + [r"`[^`]*`"],
+        [
+            ("method", rf"^func[ \t]*\([ \t]*(?:{GO_IDENT}[ \t]+)?\*?[ \t]*(?P<owner>{GO_IDENT})(?:\[[^\]\n]*\])?"
+                       rf"[ \t]*\)[ \t]*(?P<name>{GO_IDENT})"),
+            ("function", rf"^func[ \t]+(?P<name>{GO_IDENT})"),
+            ("type", rf"^type[ \t]+(?P<name>{GO_IDENT})"),
+        ],
+        exported=lambda text, name: name.rpartition(".")[2][:1].isupper()),
+    "rust": make_symbol_extractor(
+        # Одинарные кавычки в Rust — еще и времена жизни ('a), поэтому символьные литералы не пропускаются
+        [r"//[^\n]*", r"/\*(?s:.*?)\*/", r'r#"(?s:.*?)"#', r'r"[^"]*"', r'"(?:\\.|[^"\\])*"'],
+        [
+            ("function", rf'^[ \t]*{RUST_VISIBILITY}(?:(?:const|async|unsafe|extern[ \t]+"[^"\n]*")[ \t]+)*'
+                         r"fn[ \t]+(?P<name>\w+)"),
+            ("type", rf"^[ \t]*{RUST_VISIBILITY}(?:struct|enum|union|trait|type)[ \t]+(?P<name>\w+)"),
+        ],
+        exported=lambda text, name: text.lstrip().startswith("pub")),
+    "java": make_symbol_extractor(
+        C_LIKE_SKIP,
+        [
+            ("class", rf"^[ \t]*{JAVA_MODIFIERS}(?:class|record)[ \t]+(?P<name>\w+)"),
+            ("type", rf"^[ \t]*{JAVA_MODIFIERS}(?:interface|enum|@interface)[ \t]+(?P<name>\w+)"),
+            c_like_method_rule(JAVA_MODIFIERS),
+        ],
+        exported=lambda text, name: re.search(r"\bpublic\b", text) is not None,
+        reserved=C_LIKE_RESERVED),
+    "csharp": make_symbol_extractor(
+        C_LIKE_SKIP,
+        [
+            ("class", rf"^[ \t]*{CSHARP_MODIFIERS}(?:class|record|struct)[ \t]+(?P<name>\w+)"),
+            ("type", rf"^[ \t]*{CSHARP_MODIFIERS}(?:interface|enum)[ \t]+(?P<name>\w+)"),
+            c_like_method_rule(CSHARP_MODIFIERS),
+        ],
+        exported=lambda text, name: re.search(r"\bpublic\b", text) is not None,
+        reserved=C_LIKE_RESERVED),
+    "php": make_symbol_extractor(
+        C_LIKE_SKIP + [r"#[^\n]*"],
+        [
+            ("class", r"^[ \t]*(?:(?:abstract|final|readonly)[ \t]+)*class[ \t]+(?P<name>\w+)"),
+            ("type", r"^[ \t]*(?:interface|trait|enum)[ \t]+(?P<name>\w+)"),
+            ("function", r"^[ \t]*(?:(?:public|protected|private|static|abstract|final)[ \t]+)*"
+                         r"function[ \t]+&?(?P<name>\w+)"),
+        ]),
+    "ruby": make_symbol_extractor(
+        [r"^=begin\b(?s:.*?)^=end\b", r"#[^\n]*", r'"(?:\\.|[^"\\])*"', r"'(?:\\.|[^'\\])*'"],
+        [
+            ("class", r"^[ \t]*class[ \t]+(?P<name>[A-Z][\w:]*)"),
+            ("type", r"^[ \t]*module[ \t]+(?P<name>[A-Z][\w:]*)"),
+            ("function", r"^[ \t]*def[ \t]+(?P<name>(?:self\.)?[\w?!]+=?)"),
+        ]),
+}
+
+
+def extract_symbols(content, language):
+    """Символы файла по реестру SYMBOL_EXTRACTORS; для неизвестного языка — пустые списки."""
+    extractor = SYMBOL_EXTRACTORS.get(language)
+    if extractor is None:
+        return {"functions": [], "classes": [], "docstring": ""}
+    return extractor(content)
+
+
+# Скелет большого файла: импорты, константы, объявления и документация без тел функций
+SKELETON_READ_LIMIT = 16 * 1024 * 1024  # файлы больше этого размера усекаются как обычно
+SKELETON_VALUE_LINES = 5  # присваивания и блоки длиннее стольких строк сокращаются до первой
+SKELETON_DOC_LINES = 30  # сколько строк комментариев над объявлением сохраняется
+SKELETON_DOC_PREFIXES = ("//", "/*", "*", "#", "@")  # комментарии, атрибуты и аннотации над объявлением
+# Импорты и константы уровня модуля для языков с разбором регулярными выражениями
+SKELETON_KEEP_RES = {
+    "javascript": r"^(?:import\b|export[ \t]+(?:\*|\{)|(?:const|let|var)[ \t]+[^=\n]*=[ \t]*require\(|"
+                  r"(?:export[ \t]+)?const[ \t]+[A-Z][A-Z0-9_]*[ \t]*=)[^\n]*",
+    "go": r"^(?:import|const|var)[ \t]*\((?s:.*?)^\)|^(?:package|import|const|var)\b[^\n]*",
+    "rust": r"^[ \t]*(?:pub(?:\([^)\n]*\))?[ \t]+)?(?:use|mod|extern[ \t]+crate|const|static)\b[^\n]*|"
+            r"^[ \t]*(?:unsafe[ \t]+)?impl\b[^\n]*",
+    "java": r"^(?:package|import)\b[^\n]*|^[ \t]*(?:(?:public|protected|private)[ \t]+)?static[ \t]+final\b[^\n]*",
+    "csharp": r"^(?:using|namespace)\b[^\n]*|^[ \t]*(?:(?:public|protected|private|internal)[ \t]+)?const\b[^\n]*",
+    "php": r"^(?:namespace|use|require|require_once|include|include_once)\b[^\n]*|^define\([^\n]*|"
+           r"^[ \t]*(?:(?:public|protected|private)[ \t]+)?const\b[^\n]*",
+    "ruby": r"^(?:require|require_relative|include|extend)\b[^\n]*|^[ \t]*[A-Z][A-Z0-9_]*[ \t]*=[^\n]*",
+}
+SKELETON_KEEP_RES["typescript"] = SKELETON_KEEP_RES["javascript"]
+SKELETON_KEEP_RES = {language: re.compile(pattern, re.MULTILINE) for language, pattern in SKELETON_KEEP_RES.items()}
+
+
+def build_skeleton(content, language):
+    """Скелет кода: импорты, константы, сигнатуры классов и функций и их документация.
+
+    Тела функций заменяются на "...". Время работы линейно по размеру файла.
+    Возвращает None, если язык не поддерживается или объявлений не нашлось.
+    """
+    if language == "python":
+        return python_skeleton(content)
+    if language in SYMBOL_EXTRACTORS:
+        return regex_skeleton(content, language)
+    return None
+
+
+def leading_whitespace(line):
+    return line[:len(line) - len(line.lstrip())]
+
+
+def python_skeleton(content):
+    """Скелет кода Python по ast; строки берутся из исходника как есть."""
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        return None
+    lines = content.split("\n")
+    result = []
+    last = [0]  # последняя выведенная строка: в одной строке может быть несколько инструкций
+
+    def emit(first, end):
+        first = max(first, last[0] + 1)
+        if first <= end:
+            result.extend(lines[first - 1:end])
+            last[0] = end
+
+    def elide(node):
+        result.append(leading_whitespace(lines[node.lineno - 1]) + "...")
+
+    def is_docstring(node):
+        return (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)
+                and isinstance(node.value.value, str))
+
+    def visit(nodes, top_level):
+        for node in nodes:
+            if isinstance(node, (ast.Import, ast.ImportFrom)) or is_docstring(node):
+                emit(node.lineno, node.end_lineno)
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                if node.end_lineno - node.lineno < SKELETON_VALUE_LINES:
+                    emit(node.lineno, node.end_lineno)
+                else:
+                    emit(node.lineno, node.lineno)
+                    result.append(leading_whitespace(lines[node.lineno - 1]) + "    ...")
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if top_level and result and result[-1]:
+                    result.append("")
+                start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+                first = node.body[0]
+                if first.lineno == node.lineno:
+                    emit(start, node.lineno)  # тело в той же строке: def f(): pass
+                    continue
+                emit(start, first.lineno - 1)
+                if isinstance(node, ast.ClassDef):
+                    visit(node.body, False)
+                    continue
+                rest = node.body
+                if is_docstring(first):
+                    emit(first.lineno, first.end_lineno)
+                    rest = node.body[1:]
+                if rest:
+                    elide(rest[0])
+            elif isinstance(node, (ast.If, ast.Try, ast.With)):
+                # if TYPE_CHECKING / try: import ... / with: — короткие блоки целиком, длинные — только ветка body
+                if node.end_lineno - node.lineno < SKELETON_VALUE_LINES:
+                    emit(node.lineno, node.end_lineno)
+                elif node.body[0].lineno > node.lineno:
+                    emit(node.lineno, node.body[0].lineno - 1)
+                    visit(node.body, False)
+                    elide(node.body[0])
+
+    visit(tree.body, True)
+    return "\n".join(result).strip("\n") or None
+
+
+def regex_skeleton(content, language):
+    """Скелет кода по реестру SYMBOL_EXTRACTORS: строки объявлений без тел, комментарии над ними,
+    импорты и константы (SKELETON_KEEP_RES)."""
+    offsets = []
+    SYMBOL_EXTRACTORS[language](content, offsets)
+    if not offsets:
+        return None
+    lines = content.split("\n")
+    line_starts = [0, *(match.end() for match in re.finditer("\n", content))]
+
+    def line_of(offset):
+        return bisect.bisect_right(line_starts, offset) - 1
+
+    selected = {}
+    opened = set()  # строки объявлений, которые заканчиваются открывающей скобкой тела
+    keep = SKELETON_KEEP_RES.get(language)
+    if keep is not None:
+        for match in keep.finditer(content):
+            first, last = line_of(match.start()), line_of(max(match.end() - 1, match.start()))
+            for index in range(first, last + 1):
+                selected[index] = lines[index]
+            if first == last and lines[first].rstrip().endswith("{"):
+                # Например, impl в Rust: тело не выводится, скобка закрывается ниже
+                selected[first] = lines[first].rstrip()[:-1].rstrip()
+                opened.add(first)
+    for offset in offsets:
+        index = line_of(offset)
+        line = lines[index].rstrip()
+        head = declaration_head(line)
+        rest = line.strip()[len(head):].strip()
+        if rest == "{":
+            opened.add(index)
+        elif rest.startswith("{"):
+            head += " { ... }"  # тело в той же строке
+        elif rest:
+            head += " " + rest
+        selected[index] = leading_whitespace(line) + head
+        # Документирующие комментарии, атрибуты и аннотации над объявлением
+        above = index - 1
+        while (above >= 0 and index - above <= SKELETON_DOC_LINES and above not in selected
+               and lines[above].strip().startswith(SKELETON_DOC_PREFIXES)):
+            selected[above] = lines[above]
+            above -= 1
+
+    # Скобка тела закрывается: сразу ("{ ... }"), если внутри ничего не выводится,
+    # иначе отдельной строкой после вложенных объявлений (методов класса и т.п.)
+    indexes = sorted(selected)
+    result = []
+    closing = []  # (отступ, строка с закрывающей скобкой)
+    for position, index in enumerate(indexes):
+        line = selected[index]
+        indent = len(leading_whitespace(line))
+        while closing and line.strip() and indent <= closing[-1][0]:
+            result.append(closing.pop()[1])
+        if index in opened:
+            following = selected[indexes[position + 1]] if position + 1 < len(indexes) else ""
+            if len(leading_whitespace(following)) > indent and following.strip():
+                closing.append((indent, leading_whitespace(line) + "}"))
+                line += " {"
+            else:
+                line += " { ... }"
+        result.append(line)
+    result.extend(line for _, line in reversed(closing))
+    return "\n".join(result)
+
+
+# Правила исключения в синтаксисе .gitignore, компилируются один раз на запуск
+GLOB_CHARS = set("*?[")
+
+
+def glob_to_regex(pattern):
+    """Переводит шаблон .gitignore (*, ?, [...], **) в регулярное выражение без якорей."""
+    result = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**/", i):
+                result.append("(?:.*/)?")  # ноль или больше папок
+                i += 3
+                continue
+            if pattern.startswith("**", i):
+                result.append(".*")
+                i += 2
+                continue
+            result.append("[^/]*")
+        elif c == "?":
+            result.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                result.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                result.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            result.append(re.escape(pattern[i]))
+        else:
+            result.append(re.escape(c))
+        i += 1
+    return "".join(result)
+
+
+def parse_exclude_rule(pattern, index, kind=None, icase=False):
+    """Разбирает строку .gitignore в правило; kind: "dir" или "file" — к чему правило применимо.
+
+    Возвращает None для пустых строк и комментариев.
+    """
+    text = pattern.strip()
+    if not text or text.startswith("#"):
+        return None
+    negate = text.startswith("!")
+    if negate:
+        text = text[1:]
+    if text.startswith("\\") and text[1:2] in ("#", "!"):
+        text = text[1:]
+    if text.endswith("/"):
+        kind = "dir"
+        text = text.rstrip("/")
+    # Шаблон со слэшем (кроме завершающего) привязан к корню проекта и сравнивается с путем
+    anchored = "/" in text
+    text = text.lstrip("/")
+    if text.startswith("**/") and "/" not in text[3:]:
+        text, anchored = text[3:], False
+    if not text:
+        return None
+    if icase:
+        text = text.lower()
+    return {"pattern": pattern.strip(), "index": index, "negate": negate, "kind": kind,
+            "icase": icase, "anchored": anchored, "text": text}
+
+
+def make_exclude_rules(exclude_extensions=(), exclude_folders=(), exclude_files=(), patterns=()):
+    """Компилирует все исключения в один набор правил, общий для всех обходов.
+
+    exclude_extensions — расширения (".png") без учета регистра, exclude_folders — имена или
+    шаблоны папок, exclude_files — имена или шаблоны файлов, patterns — строки в синтаксисе
+    .gitignore (глобы, пути от корня, ** и отрицание через "!"). Как в .gitignore, при
+    нескольких совпадениях решает последнее правило.
+    """
+    specs = []
+    for ext in sorted(exclude_extensions):
+        ext = ext.strip().lower()
+        if ext:
+            specs.append(("*" + (ext if ext.startswith(".") else "." + ext), "file", True))
+    specs.extend((name, "dir", False) for name in sorted(exclude_folders))
+    specs.extend((name, "file", False) for name in sorted(exclude_files))
+    specs.extend((pattern, None, False) for pattern in patterns)
+
+    rules = {"names": {}, "inames": {}, "suffixes": {}, "globs": [], "combined": [],
+             "has_negation": False, "count": 0}
+    for pattern, kind, icase in specs:
+        rule = parse_exclude_rule(pattern, rules["count"], kind, icase)
+        if rule is None:
+            continue
+        rules["count"] += 1
+        rules["has_negation"] = rules["has_negation"] or rule["negate"]
+        text = rule["text"]
+        if not rule["anchored"] and not GLOB_CHARS & set(text):
+            # Быстрый путь: точное имя (без учета регистра — в отдельном словаре)
+            rules["inames" if icase else "names"].setdefault(text, []).append(rule)
+        elif (not rule["anchored"] and text.startswith("*") and text[1:2] == "."
+              and not GLOB_CHARS & set(text[1:])):
+            # Быстрый путь: "*.ext" и "*.min.js" ищутся по последнему расширению имени
+            rule["suffix"] = text[1:]
+            rules["suffixes"].setdefault(os.path.splitext(text)[1].lower(), []).append(rule)
+        else:
+            rule["regex"] = re.compile(glob_to_regex(text), re.IGNORECASE if icase else 0)
+            rules["globs"].append(rule)
+
+    # Без отрицаний порядок не важен: глобы одного вида объединяются в одно выражение
+    if not rules["has_negation"]:
+        groups = {}
+        for rule in rules["globs"]:
+            groups.setdefault((rule["anchored"], rule["kind"], rule["icase"]), []).append(rule)
+        for (anchored, kind, icase), group in groups.items():
+            regex = re.compile("|".join(f"({glob_to_regex(rule['text'])})" for rule in group),
+                               re.IGNORECASE if icase else 0)
+            rules["combined"].append({"anchored": anchored, "kind": kind, "regex": regex, "rules": group})
+    return rules
+
+
+def _rule_applies(rule, is_dir):
+    return rule["kind"] is None or (rule["kind"] == "dir") == is_dir
+
+
+def match_exclude_rule(rules, name, rel_path, is_dir):
+    """Возвращает исходный шаблон правила, исключающего элемент, или None, если элемент не исключен."""
+    best = None
+    lower = name.lower()
+
+    for rule in (*rules["names"].get(name, ()), *rules["inames"].get(lower, ())):
+        if _rule_applies(rule, is_dir) and (best is None or rule["index"] > best["index"]):
+            best = rule
+
+    for rule in rules["suffixes"].get(os.path.splitext(lower)[1], ()):
+        if (_rule_applies(rule, is_dir) and (best is None or rule["index"] > best["index"])
+                and (lower if rule["icase"] else name).endswith(rule["suffix"])):
+            best = rule
+
+    if not rules["has_negation"]:
+        if best is not None:
+            return best["pattern"]
+        for group in rules["combined"]:
+            if group["kind"] is not None and (group["kind"] == "dir") != is_dir:
+                continue
+            match = group["regex"].fullmatch(rel_path if group["anchored"] else name)
+            if match:
+                return group["rules"][match.lastindex - 1]["pattern"]
+        return None
+
+    # С отрицаниями решает правило с наибольшим номером
+    for rule in reversed(rules["globs"]):
+        if best is not None and rule["index"] < best["index"]:
+            break
+        if _rule_applies(rule, is_dir) and rule["regex"].fullmatch(rel_path if rule["anchored"] else name):
+            best = rule
+            break
+    if best is None or best["negate"]:
+        return None
+    return best["pattern"]
+
+
+def read_gitignore_patterns(directory):
+    """Читает шаблоны из .gitignore в корне проекта (вложенные .gitignore учитывает режим git)."""
+    path = os.path.join(directory, ".gitignore")
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return [line.rstrip("\n") for line in f]
+    except OSError:
+        return []
+
+
+# Индекс дерева проекта: один проход os.scandir на каждую папку
+def build_tree_index(directory, rules):
+    """Строит индекс дерева проекта, сохраняя данные stat из DirEntry.
+
+    Исключенные папки не обходятся; исключенные файлы остаются в индексе с пометкой
+    "excluded" (шаблон сработавшего правила).
+    """
+
+    def _scan_dir(node, rel_prefix):
+        try:
+            with os.scandir(node["path"]) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+
+                    rel_path = rel_prefix + entry.name
+                    if is_dir:
+                        pattern = match_exclude_rule(rules, entry.name, rel_path, True)
+                        if pattern:
+                            # Для статистики запоминаем, какое правило отсекло папку
+                            node.setdefault("pruned", []).append((entry.name, pattern))
+                            continue
+                        child = make_dir_entry(entry.name, entry.path, rel_path)
+                        node["children"].append(child)
+                        # Символические ссылки на папки не раскрываем, как os.walk
+                        if not entry.is_symlink():
+                            _scan_dir(child, rel_path + "/")
+                    else:
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            st = None
+                        file_entry = make_file_entry(entry.name, entry.path, rel_path, st)
+                        file_entry["excluded"] = match_exclude_rule(rules, entry.name, rel_path, False)
+                        node["children"].append(file_entry)
+        except Exception as e:
+            node["error"] = e
+
+    tree = make_dir_entry(os.path.basename(directory), directory, "")
+    _scan_dir(tree, "")
+    return tree
+
+
+def make_dir_entry(name, path, rel_path):
+    return {"name": name, "path": path, "rel_path": rel_path, "is_dir": True, "children": [], "error": None}
+
+
+def make_file_entry(name, path, rel_path, st):
+    """Запись о файле для индекса; st — результат stat (или None, если stat не удался)."""
+    return {
+        "name": name,
+        "path": path,
+        "rel_path": rel_path,
+        "is_dir": False,
+        "ext": os.path.splitext(name)[1].lower(),
+        "size": st.st_size if st else 0,
+        "mtime": st.st_mtime if st else 0,
+        "mtime_ns": st.st_mtime_ns if st else 0,
+        "excluded": None,
+        "budget": None,  # (режим, лимит в байтах), если задан бюджет токенов
+        "dup_candidate": False,  # есть другой файл того же размера — нужен хэш содержимого
+    }
+
+
+def run_git(directory, *args):
+    """Запускает локальный git в directory и возвращает stdout (bytes)."""
+    try:
+        result = subprocess.run(["git", "-C", directory, *args], capture_output=True,
+                                creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+    except FileNotFoundError:
+        raise RuntimeError("git не найден: установите git или выберите обычный обход папки")
+    if result.returncode != 0:
+        message = result.stderr.decode("utf-8", "replace").strip()
+        raise RuntimeError(f"Ошибка git {' '.join(args[:1])}: {message}")
+    return result.stdout
+
+
+def list_git_files(directory, since=None):
+    """Возвращает пути файлов (относительно directory) из git с учетом .gitignore.
+
+    Без since — все отслеживаемые и неигнорируемые неотслеживаемые файлы; с since — только
+    измененные относительно ревизии since (включая незакоммиченные) и новые неотслеживаемые.
+    """
+    untracked = run_git(directory, "ls-files", "-z", "--others", "--exclude-standard")
+    if since:
+        listed = run_git(directory, "diff", "--name-only", "-z", "--relative", "--diff-filter=d", since, "--")
+    else:
+        listed = run_git(directory, "ls-files", "-z", "--cached")
+
+    paths = []
+    seen = set()
+    for raw in (listed + untracked).split(b"\0"):
+        if raw and raw not in seen:
+            seen.add(raw)
+            paths.append(os.fsdecode(raw))
+    paths.sort()
+    return paths
+
+
+def build_tree_index_from_paths(directory, rel_paths, rules):
+    """Строит такой же индекс, как build_tree_index, но по готовому списку путей (например, из git)."""
+    tree = make_dir_entry(os.path.basename(directory), directory, "")
+    dirs = {"": tree}
+    excluded_dirs = set()
+    for rel_path in rel_paths:
+        parts = rel_path.split("/")
+
+        # Папки проверяются один раз; файлы внутри исключенной папки пропускаются
+        node = tree
+        for i in range(len(parts) - 1):
+            key = "/".join(parts[:i + 1])
+            child = dirs.get(key)
+            if child is None:
+                if key in excluded_dirs:
+                    node = None
+                    break
+                pattern = match_exclude_rule(rules, parts[i], key, True)
+                if pattern:
+                    excluded_dirs.add(key)
+                    node.setdefault("pruned", []).append((parts[i], pattern))
+                    node = None
+                    break
+                child = make_dir_entry(parts[i], os.path.join(directory, *parts[:i + 1]), key)
+                dirs[key] = child
+                child["pending"] = node  # в родителя добавим, когда найдется хотя бы один файл
+            node = child
+        if node is None:
+            continue
+
+        path = os.path.join(directory, *parts)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # удален в рабочей копии
+        if not stat.S_ISREG(st.st_mode):
+            continue  # подмодули и прочее
+
+        # Подключаем к дереву папки, созданные для этого пути
+        parent = node
+        while "pending" in parent:
+            grandparent = parent.pop("pending")
+            grandparent["children"].append(parent)
+            parent = grandparent
+
+        file_entry = make_file_entry(parts[-1], path, rel_path, st)
+        file_entry["excluded"] = match_exclude_rule(rules, parts[-1], rel_path, False)
+        node["children"].append(file_entry)
+    return tree
+
+
+def build_source_index(directory, rules, source_mode="fs", since=None):
+    """Строит индекс обходом папки (source_mode="fs") или по списку файлов git ("git" или задан since)."""
+    if source_mode == "git" or since:
+        return build_tree_index_from_paths(directory, list_git_files(directory, since), rules)
+    return build_tree_index(directory, rules)
+
+
+def iter_tree_files(node):
+    """Перебирает файлы индекса в порядке os.walk: сначала файлы папки, затем подпапки."""
+    for entry in node["children"]:
+        if not entry["is_dir"]:
+            yield entry
+    for entry in node["children"]:
+        if entry["is_dir"]:
+            yield from iter_tree_files(entry)
+
+
 # Функция для генерации структуры проекта
-def generate_project_structure(directory, exclude_folders, max_depth=10):
-    """Генерирует текстовое представление структуры проекта."""
+def generate_project_structure(tree, max_depth=10, max_entries=0):
+    """Генерирует текстовое представление структуры проекта.
+
+    При max_entries > 0 строится компактное дерево (см. compact_project_structure).
+    """
+    if max_entries > 0:
+        return compact_project_structure(tree, max_depth, max_entries)
     result = []
 
-    def _scan_dir(path, prefix="", depth=0):
+    def _scan_dir(node, prefix="", depth=0):
         if depth > max_depth:
             return
 
-        try:
-            items = sorted(os.listdir(path))
-            for i, item in enumerate(items):
-                if item in exclude_folders:
-                    continue
+        if node["error"] is not None:
+            if isinstance(node["error"], PermissionError):
+                result.append(prefix + f"[Ошибка доступа: {node['path']}]")
+            else:
+                result.append(prefix + f"[Ошибка: {node['error']}]")
+            return
 
-                item_path = os.path.join(path, item)
-                is_last = i == len(items) - 1
+        items = sorted(node["children"], key=lambda e: e["name"])
+        for i, entry in enumerate(items):
+            is_last = i == len(items) - 1
 
-                # Определяем префикс для текущего элемента
-                curr_prefix = prefix + ("└── " if is_last else "├── ")
-                result.append(curr_prefix + item)
+            # Определяем префикс для текущего элемента
+            curr_prefix = prefix + ("└── " if is_last else "├── ")
+            result.append(curr_prefix + entry["name"])
 
-                # Если это папка, рекурсивно сканируем
-                if os.path.isdir(item_path):
-                    # Следующий префикс для элементов в этой папке
-                    next_prefix = prefix + ("    " if is_last else "│   ")
-                    _scan_dir(item_path, next_prefix, depth + 1)
-        except PermissionError:
-            result.append(prefix + f"[Ошибка доступа: {path}]")
-        except Exception as e:
-            result.append(prefix + f"[Ошибка: {e}]")
+            # Если это папка, рекурсивно сканируем
+            if entry["is_dir"]:
+                # Следующий префикс для элементов в этой папке
+                next_prefix = prefix + ("    " if is_last else "│   ")
+                _scan_dir(entry, next_prefix, depth + 1)
+
+    _scan_dir(tree)
+    return "\n".join(result)
+
+
+TREE_SUMMARY_EXTENSIONS = 3  # сколько самых частых расширений называть в свернутой папке
+
+
+def compact_project_structure(tree, max_depth=10, max_entries=100):
+    """Компактная структура проекта из того же индекса: только файлы, которые не исключены.
+
+    У папок указаны число файлов и размер. Если в папке больше max_entries элементов, ее файлы
+    сворачиваются в строку "… 12 340 файлов (*.png 12 000, *.json 340), 1.2 ГБ" (а при
+    слишком большом числе подпапок — и подпапки). Пустые после исключений папки не выводятся.
+    """
+    totals = {}  # id(папки) -> (файлов, байт) с учетом вложенных папок
 
-    _scan_dir(directory)
+    def count(node):
+        files = size = 0
+        for entry in node["children"]:
+            if entry["is_dir"]:
+                sub_files, sub_size = count(entry)
+                files += sub_files
+                size += sub_size
+            elif not entry["excluded"]:
+                files += 1
+                size += entry["size"]
+        totals[id(node)] = (files, size)
+        return files, size
+
+    count(tree)
+    result = []
+
+    def _scan_dir(node, prefix="", depth=0):
+        if depth > max_depth:
+            return
+
+        if node["error"] is not None:
+            if isinstance(node["error"], PermissionError):
+                result.append(prefix + f"[Ошибка доступа: {node['path']}]")
+            else:
+                result.append(prefix + f"[Ошибка: {node['error']}]")
+            return
+
+        dirs = [entry for entry in node["children"]
+                if entry["is_dir"] and (totals[id(entry)][0] or entry["error"] is not None)]
+        files = [entry for entry in node["children"] if not entry["is_dir"] and not entry["excluded"]]
+        lines = []  # (текст, папка для обхода или None)
+        if len(dirs) + len(files) <= max_entries:
+            for entry in sorted(dirs + files, key=lambda e: e["name"]):
+                lines.append((format_tree_entry(entry, totals), entry if entry["is_dir"] else None))
+        else:
+            if len(dirs) <= max_entries:
+                for entry in sorted(dirs, key=lambda e: e["name"]):
+                    lines.append((format_tree_entry(entry, totals), entry))
+            else:
+                dir_files = sum(totals[id(entry)][0] for entry in dirs)
+                dir_size = sum(totals[id(entry)][1] for entry in dirs)
+                lines.append((f"… {format_count(len(dirs))} папок: {format_count(dir_files)} файлов, "
+                              f"{format_size(dir_size)}", None))
+            if files:
+                lines.append((summarize_files(files), None))
+
+        for i, (text, entry) in enumerate(lines):
+            is_last = i == len(lines) - 1
+            result.append(prefix + ("└── " if is_last else "├── ") + text)
+            if entry is not None:
+                _scan_dir(entry, prefix + ("    " if is_last else "│   "), depth + 1)
+
+    _scan_dir(tree)
     return "\n".join(result)
 
 
-# Функция для подсчёта всех элементов в папке
-def count_items(directory, exclude_folders):
-    total = 0
-    for root, dirs, files in os.walk(directory):
-        dirs[:] = [d for d in dirs if d not in exclude_folders]  # Исключаем папки
-        total += len(dirs) + len(files)  # Считаем и файлы, и папки
-    return total
+def format_tree_entry(entry, totals):
+    """Строка компактного дерева: у папки — число файлов и размер."""
+    if not entry["is_dir"]:
+        return entry["name"]
+    files, size = totals[id(entry)]
+    return f"{entry['name']}/ ({format_count(files)} файлов, {format_size(size)})"
+
+
+def summarize_files(files):
+    """Сводка по списку файлов: "… 12 340 файлов (*.png 12 000, *.json 340), 1.2 ГБ"."""
+    by_ext = {}
+    for entry in files:
+        by_ext[entry["ext"]] = by_ext.get(entry["ext"], 0) + 1
+    common = sorted(by_ext.items(), key=lambda item: (-item[1], item[0]))
+    parts = [f"*{ext} {format_count(number)}" if ext else f"без расширения {format_count(number)}"
+             for ext, number in common[:TREE_SUMMARY_EXTENSIONS]]
+    others = sum(number for _, number in common[TREE_SUMMARY_EXTENSIONS:])
+    if others:
+        parts.append(f"прочие {format_count(others)}")
+    size = sum(entry["size"] for entry in files)
+    return f"… {format_count(len(files))} файлов ({', '.join(parts)}), {format_size(size)}"
+
+
+def format_count(number):
+    """12340 -> "12 340"."""
+    return f"{number:,}".replace(",", " ")
+
+
+def format_size(size):
+    """Размер в байтах для человека: 512 Б, 3.4 КБ, 1.2 ГБ."""
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if size < 1024 or unit == "ГБ":
+            return f"{size} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def count_listed_files(tree):
+    """Число файлов, которые попадут в результат (не исключены и вошли в бюджет токенов)."""
+    return sum(1 for entry in iter_tree_files(tree) if not entry["excluded"] and not is_budget_omitted(entry))
 
 
 # Найти файл README в директории
-def find_readme(directory):
-    """Ищет файл README в директории."""
-    for item in os.listdir(directory):
-        if item.lower().startswith("readme"):
-            return os.path.join(directory, item)
+def find_readme(tree):
+    """Ищет файл README в корне индекса."""
+    for entry in tree["children"]:
+        if not entry["is_dir"] and entry["name"].lower().startswith("readme"):
+            return entry["path"]
     return None
 
 
+# Приоритетные файлы: имена ("settings.py"), глобы по имени ("settings*.py") и пути от корня ("src/main.*")
+def find_priority_files(tree, patterns):
+    """Находит выводимые файлы по шаблонам prioritize_files за один проход по индексу.
+
+    Файлы идут в порядке шаблонов, а для одного шаблона — ближе к корню раньше, затем по пути.
+    Шаблон без "/" сравнивается с именем файла, шаблон с "/" — с путем от корня проекта
+    ("**/" — любые папки). Файл, подходящий под несколько шаблонов, выводится один раз.
+    """
+    names = {}  # имя -> номер первого шаблона с этим именем
+    globs = []
+    for rank, pattern in enumerate(patterns):
+        pattern = pattern.strip()
+        if not pattern:
+            continue
+        if "/" in pattern:
+            globs.append(f"(?P<p{rank}>{glob_to_regex(pattern.lstrip('/'))})")
+        elif GLOB_CHARS & set(pattern):
+            globs.append(f"(?P<p{rank}>(?:.*/)?{glob_to_regex(pattern)})")
+        else:
+            names.setdefault(pattern, rank)
+    if not names and not globs:
+        return []
+    # Альтернативы проверяются по порядку, поэтому fullmatch находит первый подходящий шаблон
+    regex = re.compile("|".join(globs)) if globs else None
+
+    found = []
+    for entry in iter_tree_files(tree):
+        if entry["excluded"]:
+            continue
+        rank = names.get(entry["name"])
+        if regex is not None:
+            match = regex.fullmatch(entry["rel_path"])
+            if match is not None:
+                glob_rank = int(match.lastgroup[1:])
+                rank = glob_rank if rank is None else min(rank, glob_rank)
+        if rank is not None:
+            found.append((rank, entry["rel_path"].count("/"), entry["rel_path"], entry))
+    found.sort(key=lambda item: item[:3])
+    return [item[3] for item in found]
+
+
+# Бюджет токенов: какие файлы выводить целиком, усеченными или только сигнатурами
+CHARS_PER_TOKEN = 4  # грубая оценка: около 4 байт исходного текста на токен
+HEADER_TOKENS = 250  # заголовок результата и служебные строки
+FILE_OVERHEAD_TOKENS = 140  # разделители, метаданные и служебные строки одного файла, без пути (~560 байт)
+MIN_TRUNCATED_TOKENS = 256  # меньший кусок файла бесполезен, лучше оставить сигнатуры
+SIGNATURE_SHARE = 0.5  # какая часть бюджета может уйти на сигнатуры всех файлов
+SIGNATURE_READ_LIMIT = 1024 * 1024  # файлы больше этого размера не читаются ради сигнатур
+
+
+def estimate_tokens(text):
+    """Быстрая оценка числа токенов в тексте, без токенизатора."""
+    return (len(text.encode("utf-8")) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def file_priority(entry, priority_ranks=None):
+    """Оценка важности файла для бюджета токенов: чем больше, тем раньше файл получает место.
+
+    priority_ranks — путь -> место файла в списке find_priority_files.
+    """
+    score = 0.0
+    rank = priority_ranks.get(entry["path"]) if priority_ranks else None
+    if rank is not None:
+        # Файлы из настройки важнее всех, причем в найденном порядке
+        score += 1000 + 10 * (len(priority_ranks) - rank)
+    if entry["name"] in KEY_FILE_NAMES:
+        score += 100
+    if entry["ext"] in KEY_EXTENSIONS:
+        score += 50
+    elif get_language_by_extension(entry["ext"]) != "text":
+        score += 20
+    # Ближе к корню и меньше по размеру — важнее
+    score -= 5 * entry["rel_path"].count("/")
+    score -= math.log2(entry["size"] + 1)
+    return score
+
+
+def plan_token_budget(tree, token_budget, base_tokens=0, max_file_size=0, priority_ranks=None):
+    """Распределяет бюджет токенов между файлами индекса и помечает каждый файл entry["budget"].
+
+    Режимы: "full" — целиком (в пределах max_file_size), "truncated" — первые N байт,
+    "signatures" — только классы, функции и документация не длиннее N байт, "omitted" — файл не выводится
+    (он остается в структуре проекта). Размер оценивается по stat, без чтения файлов.
+
+    Файлы перебираются в порядке file_priority. Сначала под сигнатуры резервируется
+    не больше SIGNATURE_SHARE бюджета, затем эти файлы получают содержимое целиком или
+    усеченным, и наконец оставшийся бюджет достается файлам, которым не хватило резерва.
+    Возвращает отчет о плане.
+    """
+    # Файлы, уже отсеянные запросом (plan_query), в бюджете не участвуют
+    entries = [entry for entry in iter_tree_files(tree) if not entry["excluded"] and not is_budget_omitted(entry)]
+    entries.sort(key=lambda e: file_priority(e, priority_ranks), reverse=True)  # sort стабилен
+
+    available = token_budget - base_tokens
+    signature_room = max(available, 0) * SIGNATURE_SHARE
+    reserved, deferred = [], []
+    for entry in entries:
+        size = min(entry["size"], max_file_size) if max_file_size > 0 else entry["size"]
+        full = (size + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+        # Стоимость вывода файла: содержимое целиком и только сигнатуры; путь выводится в заголовке файла
+        overhead = FILE_OVERHEAD_TOKENS + estimate_tokens(entry["path"])
+        full_cost = overhead + full
+        signature_cost = overhead + min(full, max(32, full // 10))
+        if signature_cost <= signature_room:
+            signature_room -= signature_cost
+            available -= signature_cost
+            reserved.append((entry, overhead, full_cost, signature_cost, signature_cost))
+        else:
+            deferred.append((entry, overhead, full_cost, signature_cost, 0))
+
+    report = {"budget": token_budget, "estimated": 0, "full": 0, "truncated": 0, "signatures": 0, "omitted": 0}
+    # paid — уже зарезервированная под сигнатуры часть стоимости
+    for entry, overhead, full_cost, signature_cost, paid in reserved + deferred:
+        if full_cost - paid <= available:
+            mode, limit, cost = "full", None, full_cost
+        elif available + paid - overhead >= MIN_TRUNCATED_TOKENS:
+            tokens = available + paid - overhead
+            mode, limit, cost = "truncated", tokens * CHARS_PER_TOKEN, overhead + tokens
+        elif signature_cost - paid <= available:
+            # Лимит соблюдается при выводе (fit_signatures), а не только в оценке
+            limit = (signature_cost - overhead) * CHARS_PER_TOKEN
+            mode, cost = "signatures", signature_cost
+        else:
+            entry["budget"] = ("omitted", None)
+            report["omitted"] += 1
+            continue
+        available -= cost - paid
+        entry["budget"] = (mode, limit)
+        report[mode] += 1
+    report["estimated"] = token_budget - available
+    return report
+
+
+def is_budget_omitted(entry):
+    """True, если файл не вошел в бюджет токенов и не выводится."""
+    return entry["budget"] is not None and entry["budget"][0] == "omitted"
+
+
+def format_budget_report(report):
+    """Отчет plan_token_budget одной строкой для текстового результата."""
+    return (f"{report['budget']} (оценка {report['estimated']}; целиком {report['full']}, "
+            f"усечено {report['truncated']}, только сигнатуры {report['signatures']}, "
+            f"пропущено {report['omitted']})")
+
+
+def fit_signatures(record, limit):
+    """Оставляет в записи сигнатуры (или списки символов) и документацию не длиннее limit байт.
+
+    Иначе размер сигнатур, который plan_token_budget только оценивает, мог бы превысить бюджет.
+    """
+    code_info = record.get("code_info") or {}
+    # Сигнатуры заменяют списки символов, поэтому выводится что-то одно
+    if code_info.get("signatures"):
+        groups = [("signatures", code_info["signatures"])]
+    else:
+        groups = [(key, code_info.get(key) or []) for _, key in CODE_INFO_TITLES]
+    fitted = {}
+    for key, items in groups:
+        kept = []
+        for item in items:
+            size = len(item.encode("utf-8")) + 2  # с разделителем
+            if size > limit:
+                break
+            limit -= size
+            kept.append(item)
+        if kept:
+            fitted[key] = kept
+    docstring = record.get("docstring") or ""
+    if len(docstring.encode("utf-8")) > limit:
+        docstring = docstring.encode("utf-8")[:max(limit, 0)].decode("utf-8", "ignore").rstrip()
+    return dict(record, code_info=fitted, docstring=docstring or None)
+
+
+def load_budgeted_record(entry, read_options, language=None):
+    """Читает файл в режиме, назначенном plan_token_budget. Запись получает ключ "budget".
+
+    Вызывается из load_file_record, поэтому сам читает через _load_file_record: статистика
+    учитывает файл один раз.
+    """
+    mode, limit = entry["budget"]
+    entry = dict(entry, budget=None)
+    if mode == "truncated":
+        record = _load_file_record(entry, dict(read_options, max_file_size=limit), language)
+    elif mode == "signatures" and language not in (None, "text") and entry["size"] <= SIGNATURE_READ_LIMIT:
+        # Для сигнатур нужен полный текст, но в результат он не попадает
+        record = dict(_load_file_record(entry, dict(read_options, max_file_size=0), language), content=None)
+        record = fit_signatures(record, limit)
+    else:
+        record = empty_file_record()
+    return dict(record, budget=mode)
+
+
+# Выбор файлов по запросу: ранжирование BM25 по словам из пути и текста файла
+BM25_K1 = 1.2
+BM25_B = 0.75
+QUERY_PATH_WEIGHT = 3  # слово в пути файла весит как столько же вхождений в тексте
+WORD_RE = re.compile(r"\w+")
+# Части идентификатора: parseHTTPResponse -> parse, HTTP, Response; parse_config -> parse, config
+WORD_PART_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+|[^\W\d_]+")
+
+
+def word_terms(word):
+    """Термы слова для поиска: само слово и части составного идентификатора, в нижнем регистре."""
+    parts = WORD_PART_RE.findall(word)
+    if len(parts) > 1:
+        return {word.lower(), *(part.lower() for part in parts)}
+    return {word.lower()}
+
+
+def query_terms(query):
+    terms = set()
+    for word in WORD_RE.findall(query):
+        terms |= word_terms(word)
+    return terms
+
+
+def count_query_terms(text, terms, tf, splits, weight=1):
+    """Добавляет в tf вхождения термов запроса в text и возвращает длину текста в словах (с весом).
+
+    splits — общий для всех файлов словарь слово -> термы запроса в нем, поэтому каждое
+    различное слово разбирается один раз, и стоимость остается линейной по размеру проекта.
+    """
+    counts = Counter(WORD_RE.findall(text))
+    for word, count in counts.items():
+        matched = splits.get(word)
+        if matched is None:
+            matched = splits[word] = tuple(word_terms(word) & terms)
+        for term in matched:
+            tf[term] = tf.get(term, 0) + count * weight
+    return sum(counts.values()) * weight
+
+
+def rank_files_by_query(tree, query, read_options, read_workers=4, prefetch_depth=32, progress=None):
+    """Ранжирует файлы индекса по запросу (BM25) и возвращает пары (оценка, файл) только для совпавших,
+    лучшие первыми. Каждый файл читается один раз, от индекса остаются только частоты слов запроса.
+    """
+    terms = query_terms(query)
+    # Скелет для ранжирования не нужен, а строится дорого. Статистика чтения относится к выводу:
+    # время ранжирования попадает в фазу "query", а выбранные файлы учитываются при выводе
+    read_options = dict(read_options, stats=None)
+    if read_options.get("truncate_mode") == "skeleton":
+        read_options["truncate_mode"] = "head"
+
+    def load(entry):
+        return load_file_record(entry, read_options)
+
+    entries = [entry for entry in iter_tree_files(tree) if not entry["excluded"]]
+    docs = []  # (файл, частоты термов, длина)
+    df = {}
+    splits = {}
+    for entry, record in iter_prefetched(entries, load, read_workers, prefetch_depth):
+        if progress is not None:
+            check_cancelled(progress)
+        tf = {}
+        length = count_query_terms(entry["rel_path"], terms, tf, splits, QUERY_PATH_WEIGHT)
+        if record["content"] is not None:
+            length += count_query_terms(record["content"], terms, tf, splits)
+        for term in tf:
+            df[term] = df.get(term, 0) + 1
+        docs.append((entry, tf, length))
+
+    if not docs:
+        return []
+    total = len(docs)
+    average_length = sum(length for _, _, length in docs) / total
+    idf = {term: math.log(1 + (total - count + 0.5) / (count + 0.5)) for term, count in df.items()}
+    ranked = []
+    for entry, tf, length in docs:
+        if not tf:
+            continue
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+        score = sum(idf[term] * count * (BM25_K1 + 1) / (count + norm) for term, count in tf.items())
+        ranked.append((score, entry))
+    ranked.sort(key=lambda item: item[0], reverse=True)  # sort стабилен: при равенстве — порядок обхода
+    return ranked
+
+
+def plan_query(tree, query, read_options, top_k=20, neighbors=1, read_workers=4, prefetch_depth=32, progress=None):
+    """Оставляет в выводе только файлы, подходящие к запросу, остальные помечает entry["budget"] = ("omitted", None).
+
+    Выводятся top_k лучших по BM25 (0 — все совпавшие) и у каждого до neighbors соседних
+    файлов с каждой стороны в той же папке (по имени), например тест рядом с модулем.
+    Возвращает (отчет, путь -> место), места задают порядок для plan_token_budget.
+    """
+    ranked = rank_files_by_query(tree, query, read_options, read_workers, prefetch_depth, progress)
+    hits = ranked[:top_k] if top_k > 0 else ranked
+    ranks = {entry["path"]: rank for rank, (_, entry) in enumerate(hits)}
+
+    if neighbors > 0 and hits:
+        added = []  # (место найденного файла, сосед)
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            stack.extend(entry for entry in node["children"] if entry["is_dir"])
+            files = sorted((entry for entry in node["children"] if not entry["is_dir"] and not entry["excluded"]),
+                           key=lambda entry: entry["name"])
+            for i, entry in enumerate(files):
+                rank = ranks.get(entry["path"])
+                if rank is not None:
+                    added.extend((rank, neighbor) for neighbor in files[max(i - neighbors, 0):i + neighbors + 1])
+        # Соседи идут после всех найденных файлов: соседи лучших — раньше
+        added.sort(key=lambda item: item[0])
+        for _, entry in added:
+            ranks.setdefault(entry["path"], len(ranks))
+
+    for entry in iter_tree_files(tree):
+        if not entry["excluded"] and entry["path"] not in ranks:
+            entry["budget"] = ("omitted", None)
+    report = {"query": query, "matched": len(ranked), "selected": len(hits), "neighbors": len(ranks) - len(hits)}
+    return report, ranks
+
+
+def format_query_report(report):
+    return (f"{report['query']} (совпало файлов: {report['matched']}, выведено лучших: {report['selected']}, "
+            f"соседних: {report['neighbors']})")
+
+
 # Функция обработки файлов
 def process_directory(directory, output_path, exclude_extensions, exclude_folders, exclude_files,
                       max_file_size, output_format, group_by_type, prioritize_files,
-                      include_metadata, progress, status_label):
-    try:
-        total_items = count_items(directory, exclude_folders)  # Считаем файлы и папки
-        progress["maximum"] = total_items  # Устанавливаем правильное максимальное значение
-
-        # Проверяем формат выходного файла
-        if output_format == "txt":
-            with open(output_path, "w", encoding="utf-8") as out:
-                # Добавляем заголовок и метаданные
-                out.write("=" * 80 + "\n")
-                out.write(f"ПРОЕКТ: {os.path.basename(directory)}\n")
-                out.write(f"ДАТА СКАНИРОВАНИЯ: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                out.write("=" * 80 + "\n\n")
-
-                # Добавляем README если он есть
-                readme_path = find_readme(directory)
-                if readme_path:
-                    try:
-                        with open(readme_path, "r", encoding="utf-8") as readme_file:
-                            readme_content = readme_file.read()
-                            out.write("README:\n")
-                            out.write("=" * 80 + "\n")
-                            out.write(readme_content)
-                            out.write("\n\n" + "=" * 80 + "\n\n")
-                    except Exception as e:
-                        out.write(f"[Ошибка чтения README: {e}]\n\n")
-
-                # Генерируем структуру проекта
-                out.write("СТРУКТУРА ПРОЕКТА:\n")
-                out.write("=" * 80 + "\n")
-                project_structure = generate_project_structure(directory, exclude_folders)
-                out.write(project_structure + "\n\n")
-                out.write("=" * 80 + "\n\n")
-
-                out.write("СОДЕРЖИМОЕ ФАЙЛОВ:\n")
-                out.write("=" * 80 + "\n\n")
-
-                # Если нужно группировать по типу
-                if group_by_type:
-                    grouped_files = {}
-                    # Сначала собираем все файлы по типам
-                    collect_files_by_type(directory, grouped_files, exclude_extensions, exclude_folders, exclude_files)
-
-                    # Затем выводим их группами
-                    for ext, files in grouped_files.items():
-                        language = get_language_by_extension(ext)
+                      include_metadata, progress_callback=None, read_workers=4, prefetch_depth=32,
+                      truncate_mode="head", fallback_encodings=("cp1251",), cache=None,
+                      symbol_pool=None, exclude_patterns=(), source_mode="fs", since=None, token_budget=0, deduplicate=True,
+                      shard_max_bytes=0, cancel_event=None, compression=None, tree_max_entries=0, stats=None,
+                      io_limit=None, query="", query_top_k=20, query_neighbors=1, minify=False):
+    """Сохраняет содержимое проекта в формате txt, JSON, JSON Lines или в снимок SQLite (output_format="sqlite",
+    см. write_snapshot). Возвращает путь к результату.
+
+    При token_budget > 0 файлы распределяются по бюджету токенов (см. plan_token_budget).
+    При deduplicate повторы одного и того же содержимого выводятся ссылкой на первый файл.
+    При shard_max_bytes > 0 txt и JSON Lines пишутся частями (см. ShardWriter), и
+    возвращается путь к манифесту частей.
+    compression ("gzip" или "xz") сжимает результат по ходу записи (см. CompressedOutput).
+    При tree_max_entries > 0 структура проекта строится компактной (см. compact_project_structure).
+    В stats (new_stats()) записывается время фаз и сведения о прочитанных файлах.
+    io_limit (семафор) ограничивает число одновременно читаемых файлов, например для пакета проектов.
+    При непустом query выводятся только файлы, подходящие к запросу (см. plan_query).
+    При minify из кода убираются комментарии и лишние пустые строки (см. minify_content).
+    """
+    if output_format not in ("txt", "json", "jsonl", "sqlite"):
+        raise ValueError(f"Неизвестный формат вывода: {output_format}")
+    if shard_max_bytes > 0 and output_format in ("json", "sqlite"):
+        raise ValueError("Вывод частями поддерживается только для форматов txt и jsonl")
+    if output_format == "sqlite" and (compression or token_budget > 0 or query):
+        raise ValueError("Снимок SQLite не сжимается и не ограничивается бюджетом токенов или запросом")
+
+    progress = new_progress(progress_callback, cancel_event)
+    # Один проход по диску: все режимы дальше читают данные из индекса
+    phase_start = time.perf_counter()
+    rules = make_exclude_rules(exclude_extensions, exclude_folders, exclude_files, exclude_patterns)
+    tree = build_source_index(directory, rules, source_mode, since)
+    add_phase(stats, "index", phase_start)
+    check_cancelled(progress)
+
+    read_options = {"max_file_size": max_file_size, "truncate_mode": truncate_mode,
+                    "fallback_encodings": fallback_encodings, "cache": cache, "symbol_pool": symbol_pool,
+                    "stats": stats, "io_limit": io_limit}
+
+    phase_start = time.perf_counter()
+    project_structure = generate_project_structure(tree, max_entries=tree_max_entries)
+    add_phase(stats, "structure", phase_start)
+    phase_start = time.perf_counter()
+    readme_path = find_readme(tree)
+    priority_entries = find_priority_files(tree, parse_ordered_list(prioritize_files))
+    priority_ranks = {entry["path"]: rank for rank, entry in enumerate(priority_entries)}
+    query_report = None
+    if query:
+        query_report, query_ranks = plan_query(tree, query, read_options, query_top_k, query_neighbors,
+                                               read_workers, prefetch_depth, progress)
+        # В бюджете после приоритетных файлов идут найденные, в порядке релевантности
+        for path in sorted(query_ranks, key=query_ranks.get):
+            priority_ranks.setdefault(path, len(priority_ranks))
+        add_phase(stats, "query", phase_start)
+        phase_start = time.perf_counter()
+    budget_report = None
+    if token_budget > 0:
+        base_tokens = estimate_tokens(project_structure) + HEADER_TOKENS
+        if readme_path:
+            base_tokens += (os.path.getsize(readme_path) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+        budget_report = plan_token_budget(tree, token_budget, base_tokens, max_file_size, priority_ranks)
+    add_phase(stats, "plan", phase_start)
+    phase_start = time.perf_counter()
+    total_items = count_listed_files(tree)  # Прогресс считает выведенные файлы
+    set_progress(progress, maximum=total_items)
+    add_phase(stats, "count", phase_start)
+    add_index_stats(stats, tree)
+
+    # Хэш содержимого -> путь первого выведенного файла с таким содержимым
+    seen_hashes = None
+    if deduplicate:
+        mark_duplicate_candidates(tree)
+        seen_hashes = {}
+
+    def load_text_record(entry):
+        return load_file_record(entry, read_options, get_language_by_extension(entry["ext"]))
+
+    # Первые копии лицензий и счетчики байт минификации (см. minify_content)
+    minifier = new_minifier() if minify else None
+
+    # Чтение и запись идут вперемешку: время ожидания прочитанных файлов (iter_prefetched)
+    # идет в фазу "read", остальное — в "output"
+    phase_start = time.perf_counter()
+    read_before = stats["phases"].get("read", 0.0) if stats is not None else 0.0
+    # Проверяем формат выходного файла
+    if output_format == "txt":
+        with open_output(output_path, shard_max_bytes, compression) as out:
+            # Добавляем заголовок и метаданные
+            out.write("=" * 80 + "\n")
+            out.write(f"ПРОЕКТ: {os.path.basename(directory)}\n")
+            out.write(f"ДАТА СКАНИРОВАНИЯ: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            if since:
+                out.write(f"ИЗМЕНЕНИЯ С РЕВИЗИИ: {since}\n")
+            if query_report:
+                out.write(f"ЗАПРОС: {format_query_report(query_report)}\n")
+            if budget_report:
+                out.write(f"БЮДЖЕТ ТОКЕНОВ: {format_budget_report(budget_report)}\n")
+            out.write("=" * 80 + "\n\n")
+
+            # Добавляем README если он есть
+            if readme_path:
+                try:
+                    with open(readme_path, "r", encoding="utf-8") as readme_file:
+                        readme_content = readme_file.read()
+                        out.write("README:\n")
+                        out.write("=" * 80 + "\n")
+                        out.write(readme_content)
+                        out.write("\n\n" + "=" * 80 + "\n\n")
+                except Exception as e:
+                    out.write(f"[Ошибка чтения README: {e}]\n\n")
+
+            # Генерируем структуру проекта
+            out.write("СТРУКТУРА ПРОЕКТА:\n")
+            out.write("=" * 80 + "\n")
+            out.write(project_structure + "\n\n")
+            out.write("=" * 80 + "\n\n")
+            end_output_item(out)
+
+            out.write("СОДЕРЖИМОЕ ФАЙЛОВ:\n")
+            out.write("=" * 80 + "\n\n")
+
+            # Если нужно группировать по типу
+            if group_by_type:
+                grouped_files = {}
+                # Сначала собираем все файлы по типам
+                collect_files_by_type(tree, grouped_files)
+
+                # Затем выводим их группами; чтение идет с опережением сразу по всем группам
+                grouped_entries = [entry for files in grouped_files.values() for entry in files]
+                current_ext = None
+                for entry, record in iter_prefetched(grouped_entries, load_text_record, read_workers, prefetch_depth,
+                                                     stats):
+                    language = get_language_by_extension(entry["ext"])
+                    if entry["ext"] != current_ext:
+                        current_ext = entry["ext"]
                         out.write(f"\n{'-' * 40}\n")
-                        out.write(f"ФАЙЛЫ ТИПА: {ext} ({language})\n")
+                        out.write(f"ФАЙЛЫ ТИПА: {current_ext} ({language})\n")
                         out.write(f"{'-' * 40}\n\n")
 
-                        for file_path in files:
-                            process_file(file_path, out, max_file_size, include_metadata,
-                                         ext, language, progress)
+                    process_file(entry, out, read_options, include_metadata, language, record, seen_hashes,
+                                 minifier)
+                    advance_progress(progress)
+            else:
+                # Приоритетные файлы выводятся первыми, и общий обход их пропускает
+                priority_entries = [entry for entry in priority_entries if not is_budget_omitted(entry)]
+                if priority_entries:
+                    for entry, record in iter_prefetched(priority_entries, load_text_record,
+                                                         read_workers, prefetch_depth, stats):
+                        language = get_language_by_extension(entry["ext"])
+
+                        out.write(f"\n{'-' * 40}\n")
+                        out.write(f"ПРИОРИТЕТНЫЙ ФАЙЛ: {entry['path']}\n")
+                        out.write(f"{'-' * 40}\n\n")
+
+                        process_file(entry, out, read_options, include_metadata, language, record, seen_hashes,
+                                     minifier)
+                        advance_progress(progress)
+
+                # Обычный скан
+                scan_folder(tree, out, read_options, include_metadata, progress, read_workers, prefetch_depth,
+                            seen_hashes, {entry["path"] for entry in priority_entries}, minifier)
+
+    else:
+        # JSON и JSON Lines пишутся потоково: каждая запись о файле попадает на диск сразу после чтения;
+        # снимок SQLite — пачками в одной транзакции
+        header = {
+            "project_name": os.path.basename(directory),
+            "scan_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "structure": project_structure.split("\n"),
+        }
+        if since:
+            header["since"] = since
+        if query_report:
+            header["query"] = query_report
+        if budget_report:
+            header["token_budget"] = budget_report
+
+        # README
+        readme = {}
+        if readme_path:
+            try:
+                with open(readme_path, "r", encoding="utf-8") as readme_file:
+                    readme["readme"] = readme_file.read()
+            except Exception:
+                readme["readme"] = "[Ошибка чтения README]"
+
+        if output_format == "sqlite":
+            counts = write_snapshot(output_path, tree, dict(header, **readme), read_options, progress,
+                                    read_workers, prefetch_depth)
+            if stats is not None:
+                stats["snapshot"] = counts
+        else:
+            with open_output(output_path, shard_max_bytes, compression) as out:
+                if output_format == "json":
+                    # README пишется после списка файлов, как и раньше при json.dump всего проекта
+                    files_writer = JsonArrayWriter(out, header, "files")
                 else:
-                    # Если нужно приоритизировать файлы
-                    if prioritize_files:
-                        priority_list = prioritize_files.split(",")
-                        for priority_file in priority_list:
-                            priority_file = priority_file.strip()
-                            if not priority_file:
-                                continue
-
-                            # Ищем файлы с таким именем
-                            for root, _, files in os.walk(directory):
-                                for file in files:
-                                    if file == priority_file:
-                                        file_path = os.path.join(root, file)
-                                        ext = os.path.splitext(file)[1].lower()
-                                        language = get_language_by_extension(ext)
-
-                                        out.write(f"\n{'-' * 40}\n")
-                                        out.write(f"ПРИОРИТЕТНЫЙ ФАЙЛ: {file_path}\n")
-                                        out.write(f"{'-' * 40}\n\n")
-
-                                        process_file(file_path, out, max_file_size, include_metadata,
-                                                     ext, language, progress)
-
-                    # Обычный скан
-                    scan_folder(directory, out, exclude_extensions, exclude_folders, exclude_files,
-                                max_file_size, include_metadata, progress)
-
-        elif output_format == "json":
-            # Создаем структуру JSON
-            project_data = {
-                "project_name": os.path.basename(directory),
-                "scan_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "structure": generate_project_structure(directory, exclude_folders).split("\n"),
-                "files": []
-            }
+                    files_writer = JsonLinesWriter(out, dict(header, **readme))
+
+                # Сканируем файлы для JSON
+                scan_folder_json(tree, files_writer, read_options, progress, read_workers, prefetch_depth, seen_hashes,
+                                 minifier)
+                files_writer.close(readme)
+
+    set_progress(progress, value=total_items)  # Делаем 100%, если вдруг не дошло
+    add_phase(stats, "output", phase_start)
+    if stats is not None:
+        stats["phases"]["output"] -= stats["phases"].get("read", 0.0) - read_before
+    if stats is not None and minifier is not None:
+        stats["minify"] = {key: value for key, value in minifier.items() if key != "licenses"}
+    if shard_max_bytes > 0:
+        return out.manifest_path
+    return output_path
+
+
+def shard_limit(max_bytes=0, max_tokens=0):
+    """Предел размера одной части в байтах: меньший из заданных пределов по байтам и по токенам."""
+    limits = [int(max_bytes), int(max_tokens) * CHARS_PER_TOKEN]
+    limits = [limit for limit in limits if limit > 0]
+    return min(limits) if limits else 0
+
+
+def open_output(output_path, shard_max_bytes=0, compression=None):
+    """Открывает файл результата или, при shard_max_bytes > 0, запись частями; compression — "gzip" или "xz"."""
+    if shard_max_bytes > 0:
+        return ShardWriter(output_path, shard_max_bytes, compression)
+    if compression:
+        return io.TextIOWrapper(io.BufferedWriter(CompressedOutput(output_path, compression), COMPRESS_CHUNK_SIZE),
+                                encoding="utf-8")
+    return open(output_path, "w", encoding="utf-8")
+
+
+# Сжатие результата: на больших проектах текст сжимается примерно в 10 раз
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "xz": ".xz"}
+COMPRESS_CHUNK_SIZE = 1024 * 1024  # текст передается потоку сжатия блоками такого размера
+COMPRESS_QUEUE_SIZE = 8  # сколько блоков может ждать сжатия, пока запись не притормозит
+
+
+def output_compression(output_path, compression="auto"):
+    """Способ сжатия результата: "gzip", "xz" или None.
+
+    При compression="auto" он определяется по расширению файла (.gz, .xz).
+    """
+    if compression == "auto":
+        for name, suffix in COMPRESSION_SUFFIXES.items():
+            if output_path.lower().endswith(suffix):
+                return name
+        return None
+    if compression in ("", "none"):
+        return None
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Неизвестный способ сжатия: {compression}")
+    return compression
+
+
+def strip_compression_suffix(path):
+    """Путь без расширения сжатия: dump.txt.gz -> dump.txt."""
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if path.lower().endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+class CompressedOutput(io.RawIOBase):
+    """Двоичный файл, который сжимается gzip или xz в отдельном потоке.
+
+    write() только ставит блок в очередь, поэтому сжатие идет параллельно с чтением
+    файлов проекта (zlib и lzma отпускают GIL). Очередь ограничена: если сжатие не
+    успевает, запись ждет, и несжатый текст не копится в памяти.
+    """
+
+    def __init__(self, path, compression, level=6):
+        super().__init__()
+        if compression == "gzip":
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # заголовок gzip
+        else:
+            self.compressor = lzma.LZMACompressor(lzma.FORMAT_XZ, preset=level)
+        self.file = open(path, "wb")
+        self.chunks = queue.Queue(COMPRESS_QUEUE_SIZE)
+        self.error = None
+        self.thread = threading.Thread(target=self._compress, daemon=True)
+        self.thread.start()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self.chunks.put(bytes(data))  # BufferedWriter передает memoryview своего буфера
+        return len(data)
+
+    def _compress(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            if self.error is not None:
+                continue  # после ошибки только разбираем очередь, чтобы write() не завис
+            try:
+                self.file.write(self.compressor.compress(chunk))
+            except Exception as e:
+                self.error = e
+        if self.error is None:
+            try:
+                self.file.write(self.compressor.flush())
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self.chunks.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+
+def end_output_item(out, label=None):
+    """Отмечает конец записи об одном файле: при выводе частями новая часть начинается только здесь."""
+    if isinstance(out, ShardWriter):
+        out.end_item(label)
+
+
+class ShardWriter:
+    """Пишет текстовый результат частями name.001.txt, name.002.txt, ... не больше max_bytes каждая.
+
+    Текст одного файла копится до end_item() и целиком попадает в одну часть; между частями
+    делится только запись, которая сама больше max_bytes. Части пишутся по ходу сканирования,
+    а при закрытии рядом сохраняется манифест name.txt.manifest.json: какие файлы в какой части.
+    Части прошлого запуска с тем же именем удаляются, чтобы в папке не осталось лишних.
+    """
+
+    def __init__(self, output_path, max_bytes, compression=None):
+        # При сжатии части называются name.001.txt.gz; max_bytes считается по несжатому тексту
+        output_path = strip_compression_suffix(output_path)
+        root, ext = os.path.splitext(output_path)
+        self.name_pattern = root + ".{:03d}" + ext + COMPRESSION_SUFFIXES.get(compression, "")
+        # Расширение остается в имени манифеста: у name.txt и name.jsonl манифесты разные
+        self.manifest_path = output_path + ".manifest.json"
+        for suffix in ("", *COMPRESSION_SUFFIXES.values()):
+            number = 1
+            while os.path.exists(root + f".{number:03d}" + ext + suffix):
+                os.remove(root + f".{number:03d}" + ext + suffix)
+                number += 1
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.pending = []
+        self.shards = []
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, text):
+        self.pending.append(text)
+
+    def end_item(self, label=None):
+        data = "".join(self.pending)
+        self.pending = []
+        if not data:
+            return
+        if os.linesep != "\n":
+            data = data.replace("\n", os.linesep)  # как при записи в текстовом режиме
+        data = data.encode("utf-8")
+
+        if self.file is None or (self.shards[-1]["bytes"] > 0
+                                 and self.shards[-1]["bytes"] + len(data) > self.max_bytes):
+            self._next_shard()
+        # Запись больше целой части делится по строкам, не разрывая символы UTF-8
+        while len(data) > self.max_bytes - self.shards[-1]["bytes"]:
+            room = self.max_bytes - self.shards[-1]["bytes"]
+            cut = data.rfind(b"\n", 0, room) + 1
+            if cut == 0:
+                cut = room
+                while cut > 0 and 0x80 <= data[cut] < 0xC0:
+                    cut -= 1
+                if cut == 0:
+                    # Часть меньше одного символа: пишем символ целиком, иначе цикл не закончится
+                    cut = 1
+                    while cut < len(data) and 0x80 <= data[cut] < 0xC0:
+                        cut += 1
+            self._write_chunk(data[:cut], label)
+            data = data[cut:]
+            if not data:
+                return  # последний символ занял часть целиком
+            self._next_shard()
+        self._write_chunk(data, label)
+
+    def _next_shard(self):
+        if self.file is not None:
+            self.file.close()
+        path = self.name_pattern.format(len(self.shards) + 1)
+        if self.compression:
+            self.file = io.BufferedWriter(CompressedOutput(path, self.compression), COMPRESS_CHUNK_SIZE)
+        else:
+            self.file = open(path, "wb")
+        self.shards.append({"file": os.path.basename(path), "bytes": 0, "tokens": 0, "files": []})
 
-            # Добавляем README
-            readme_path = find_readme(directory)
-            if readme_path:
+    def _write_chunk(self, chunk, label):
+        if not chunk:
+            return
+        shard = self.shards[-1]
+        self.file.write(chunk)
+        shard["bytes"] += len(chunk)
+        if label and (not shard["files"] or shard["files"][-1] != label):
+            shard["files"].append(label)
+
+    def close(self):
+        if self.file is None and not self.pending:
+            return
+        self.end_item()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        for shard in self.shards:
+            shard["tokens"] = (shard["bytes"] + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"max_bytes": self.max_bytes, "shards": self.shards}, f, ensure_ascii=False, indent=2)
+
+
+class JsonArrayWriter:
+    """Потоково пишет JSON-объект вида {**header, key: [...], **trailer}.
+
+    Элементы массива добавляются через append() и сразу попадают в файл; результат
+    совпадает с json.dump(..., ensure_ascii=False, indent=2) для того же объекта.
+    """
+
+    def __init__(self, out, header, key):
+        self.out = out
+        self.count = 0
+        out.write("{\n")
+        for name, value in header.items():
+            out.write(f"  {self._dumps(name)}: {self._dumps(value, 1)},\n")
+        out.write(f"  {self._dumps(key)}: [")
+
+    @staticmethod
+    def _dumps(value, level=0):
+        text = json.dumps(value, ensure_ascii=False, indent=2)
+        return text.replace("\n", "\n" + "  " * level) if level else text
+
+    def append(self, record):
+        self.out.write(",\n" if self.count else "\n")
+        self.out.write("    " + self._dumps(record, 2))
+        self.count += 1
+
+    def close(self, trailer=None):
+        self.out.write("\n  ]" if self.count else "]")
+        for name, value in (trailer or {}).items():
+            self.out.write(f",\n  {self._dumps(name)}: {self._dumps(value, 1)}")
+        self.out.write("\n}")
+
+
+class JsonLinesWriter:
+    """Пишет JSON Lines: первая строка — сведения о проекте, далее по одной строке на файл."""
+
+    def __init__(self, out, header):
+        self.out = out
+        self._write(dict({"type": "project"}, **header))
+
+    def _write(self, record):
+        self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        end_output_item(self.out, record.get("path"))
+
+    def append(self, record):
+        self._write(dict({"type": "file" if "path" in record else "error"}, **record))
+
+    def close(self, trailer=None):
+        # Все сведения о проекте уже записаны в первой строке
+        pass
+
+
+SNAPSHOT_VERSION = 1  # при изменении схемы снимок пересоздается
+SNAPSHOT_BATCH_SIZE = 500  # столько файлов записывается одним executemany
+
+SNAPSHOT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    language TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT,
+    encoding TEXT,
+    binary INTEGER NOT NULL,
+    truncated INTEGER NOT NULL,
+    skeleton INTEGER NOT NULL,
+    content TEXT,
+    docstring TEXT,
+    error TEXT);
+CREATE TABLE IF NOT EXISTS symbols (file_id INTEGER NOT NULL, kind TEXT NOT NULL, name TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name);
+CREATE INDEX IF NOT EXISTS symbols_file ON symbols (file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(path, content, content='files', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts (rowid, path, content) VALUES (new.id, new.path, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts (files_fts, rowid, path, content) VALUES ('delete', old.id, old.path, old.content);
+    DELETE FROM symbols WHERE file_id = old.id;
+END;
+"""
+
+
+def open_snapshot(path):
+    """Открывает (или создает) снимок проекта в SQLite: файлы, символы и полнотекстовый индекс FTS5."""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_check USING fts5(x)")
+    except sqlite3.OperationalError:
+        conn.close()
+        raise RuntimeError("SQLite в этой сборке Python не поддерживает FTS5, снимок создать нельзя")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);")
+    row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if row is not None and row[0] != str(SNAPSHOT_VERSION):
+        conn.executescript("DROP TABLE IF EXISTS files_fts; DROP TABLE IF EXISTS symbols; "
+                           "DROP TABLE IF EXISTS files; DELETE FROM meta;")
+    conn.executescript(SNAPSHOT_SCHEMA)
+    return conn
+
+
+def write_snapshot(output_path, tree, header, read_options, progress, read_workers=4, prefetch_depth=32):
+    """Записывает файлы индекса в снимок SQLite (см. open_snapshot) и возвращает счетчики
+    {"written", "unchanged", "removed"}.
+
+    Снимок обновляется на месте: файлы с прежними размером и mtime_ns не читаются вовсе,
+    измененные перезаписываются, исчезнувшие удаляются. Если сменились корень проекта или
+    настройки чтения, снимок заполняется заново. Все изменения идут одной транзакцией,
+    строки пишутся пачками по SNAPSHOT_BATCH_SIZE.
+    """
+    conn = open_snapshot(output_path)
+    try:
+        root = os.path.abspath(tree["path"])
+        options = options_fingerprint(read_options)
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        if meta.get("root") != root or meta.get("options") != options:
+            conn.execute("DELETE FROM files")
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                 conn.execute("SELECT path, size, mtime_ns FROM files")}
+
+        def load(item):
+            kind, entry, _ = item
+            if kind != "file" or known.get(entry["rel_path"]) == (entry["size"], entry["mtime_ns"]):
+                return None
+            entry["dup_candidate"] = True  # в снимке хэш нужен у всех файлов
+            return load_file_record(entry, read_options, get_language_by_extension(entry["ext"]))
+
+        counts = {"written": 0, "unchanged": 0, "removed": 0}
+        seen = set()
+        stale, rows, symbols = [], [], []
+
+        def flush():
+            conn.executemany("DELETE FROM files WHERE path = ?", stale)
+            conn.executemany("INSERT INTO files (path, language, size, mtime_ns, hash, encoding, binary, truncated, "
+                             "skeleton, content, docstring, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany("INSERT INTO symbols SELECT id, ?, ? FROM files WHERE path = ?", symbols)
+            stale.clear()
+            rows.clear()
+            symbols.clear()
+
+        for (kind, entry, _), record in iter_prefetched(iter_scan_items(tree), load, read_workers, prefetch_depth,
+                                                        read_options.get("stats")):
+            if kind != "file":
+                continue
+            rel_path = entry["rel_path"]
+            seen.add(rel_path)
+            advance_progress(progress)
+            if record is None:
+                counts["unchanged"] += 1
+                continue
+            if rel_path in known:
+                stale.append((rel_path,))
+            error = record["error"]
+            rows.append((rel_path, get_language_by_extension(entry["ext"]), entry["size"], entry["mtime_ns"],
+                         record["hash"], record["encoding"], record["binary"], record["truncated"],
+                         record.get("skeleton", False), record["content"], record.get("docstring"),
+                         None if error is None else str(error)))
+            for _, key in CODE_INFO_TITLES:
+                symbols.extend((key, name, rel_path) for name in (record.get("code_info") or {}).get(key, ()))
+            counts["written"] += 1
+            if len(rows) >= SNAPSHOT_BATCH_SIZE:
+                flush()
+
+        # Файлы, которых больше нет в проекте (или которые теперь исключены)
+        removed = known.keys() - seen
+        stale.extend((path,) for path in removed)
+        counts["removed"] = len(removed)
+        flush()
+
+        meta = dict(header, root=root, options=options, version=SNAPSHOT_VERSION)
+        conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                         ((key, value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+                          for key, value in meta.items()))
+        conn.execute("INSERT INTO files_fts (files_fts) VALUES ('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+    return counts
+
+
+def fts_query(text):
+    """Превращает строку поиска в запрос FTS5: все слова обязательны, спецсимволы не считаются синтаксисом."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+def search_snapshot(path, query, limit=20):
+    """Ищет в снимке SQLite файлы, где встречаются все слова query (в пути или тексте).
+
+    Возвращает список пар (путь, фрагмент), самые релевантные (по bm25) первыми.
+    """
+    if not os.path.exists(path):
+        raise ValueError(f"Снимок не найден: {path}")
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT path, snippet(files_fts, 1, '[', ']', '…', 16) FROM files_fts "
+                            "WHERE files_fts MATCH ? ORDER BY rank LIMIT ?", (fts_query(query), limit)).fetchall()
+    finally:
+        conn.close()
+    return [(path, " ".join(fragment.split())) for path, fragment in rows]
+
+
+# Сколько байт из начала файла читается для определения типа и кодировки
+SNIFF_SIZE = 8192
+
+# Метки порядка байтов; UTF-32 проверяется раньше UTF-16, так как начинается так же
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# Байты, которые встречаются в обычном тексте (управляющие \a \b \t \n \f \r ESC и все печатные)
+TEXT_BYTES = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7f})
+
+
+def sniff_file(block, fallback_encodings=()):
+    """По первому блоку файла определяет, двоичный ли он, и подбирает кодировку.
+
+    Возвращает (is_binary, encoding).
+    """
+    for bom, encoding in BOMS:
+        if block.startswith(bom):
+            return False, encoding
+    if not block:
+        return False, "utf-8"
+    # Нулевой байт или много управляющих символов — признак двоичного файла
+    if b"\0" in block or len(block.translate(None, TEXT_BYTES)) > len(block) * 0.3:
+        return True, None
+
+    for encoding in ("utf-8", *fallback_encodings):
+        try:
+            decode_prefix(block, encoding)
+            return False, encoding
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return True, None
+
+
+def decode_prefix(data, encoding="utf-8"):
+    """Декодирует начало файла, отбрасывая незавершенный многобайтовый символ в конце.
+
+    Возвращает (текст, сколько байт реально декодировано).
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    text = decoder.decode(data, final=False)
+    return text, len(data) - len(decoder.getstate()[0])
+
+
+def normalize_newlines(text):
+    """Приводит переводы строк к \\n, как при чтении в текстовом режиме."""
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+# Чтение файла: выполняется в пуле потоков, запись результата остается последовательной
+def read_file_record(entry, read_options, language=None):
+    """Читает и декодирует файл. Для кода (language не "text") также извлекает функции, классы и документацию.
+
+    Сначала читается только первый блок: двоичные файлы дальше не читаются, а для
+    текстовых по нему выбирается кодировка (BOM, UTF-8 или fallback_encodings).
+    Файлы больше max_file_size байт читаются только в пределах лимита: начало
+    (truncate_mode="head") или начало и конец через seek (truncate_mode="head_tail").
+    При truncate_mode="skeleton" код читается целиком и заменяется скелетом (build_skeleton).
+    У файлов с пометкой dup_candidate дочитывается остаток, чтобы посчитать хэш содержимого.
+    """
+    max_file_size = read_options["max_file_size"]
+    fallback_encodings = read_options.get("fallback_encodings", ())
+    io_limit = read_options.get("io_limit") or contextlib.nullcontext()
+    record = empty_file_record()
+    try:
+        with io_limit, open(entry["path"], "rb") as f:
+            block = f.read(SNIFF_SIZE)
+            is_binary, encoding = sniff_file(block, fallback_encodings)
+            if is_binary:
+                record["binary"] = True
+                return record
+
+            # Читаем на байт больше лимита, чтобы понять, нужно ли усечение, не полагаясь на старый stat
+            if max_file_size <= 0:
+                data = block + f.read()
+            elif len(block) > max_file_size:
+                data = block[:max_file_size + 1]
+            else:
+                data = block + f.read(max_file_size + 1 - len(block))
+
+            if entry.get("dup_candidate"):
+                # Хэш считается по всему файлу, даже если в результат попадет только начало;
+                # при лимите меньше блока data короче уже прочитанного блока
+                digest = hashlib.blake2b(block if len(data) < len(block) else data, digest_size=16)
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                record["hash"] = digest.hexdigest()
+
+            if max_file_size <= 0 or len(data) <= max_file_size:
                 try:
-                    with open(readme_path, "r", encoding="utf-8") as readme_file:
-                        project_data["readme"] = readme_file.read()
-                except Exception:
-                    project_data["readme"] = "[Ошибка чтения README]"
-
-            # Сканируем файлы для JSON
-            scan_folder_json(directory, project_data["files"], exclude_extensions,
-                             exclude_folders, exclude_files, max_file_size, progress)
-
-            # Записываем JSON в файл
-            with open(output_path, "w", encoding="utf-8") as out:
-                json.dump(project_data, out, ensure_ascii=False, indent=2)
-
-        progress["value"] = total_items  # Делаем 100%, если вдруг не дошло
-        progress.update_idletasks()
-        status_label.config(text="✅ Готово!")
-        messagebox.showinfo("Готово", f"Данные сохранены в {output_path}")
+                    content = data.decode(encoding)
+                except UnicodeDecodeError:
+                    # Первый блок был в UTF-8, а дальше нет — пробуем запасные кодировки
+                    content, encoding = decode_with_fallback(data, fallback_encodings)
+                record["shown_size"] = len(data)
+            else:
+                original_size = entry["size"]
+                if original_size <= max_file_size:
+                    original_size = os.fstat(f.fileno()).st_size  # файл вырос после сканирования
+                record["truncated"] = True
+                record["original_size"] = original_size
+
+                skeleton = None
+                if read_options.get("truncate_mode") == "skeleton" and original_size <= SKELETON_READ_LIMIT:
+                    # JSON-режим не передает language, но скелет нужен и там
+                    parse_start = time.perf_counter()
+                    skeleton = read_skeleton(f, encoding, fallback_encodings,
+                                             language or get_language_by_extension(entry["ext"]), max_file_size,
+                                             read_options.get("symbol_pool"))
+                    add_parse_time(read_options.get("stats"), parse_start)
+                if skeleton is not None:
+                    content, record["shown_size"] = skeleton
+                    record["skeleton"] = True
+                elif read_options.get("truncate_mode") == "head_tail":
+                    head_size = max_file_size // 2
+                    tail_size = max_file_size - head_size
+                    head, head_used, encoding = decode_prefix_with_fallback(data[:head_size], encoding,
+                                                                            fallback_encodings)
+                    tail_start = max(original_size - tail_size, head_size)
+                    tail_encoding, unit = bomless_encoding(encoding, block)
+                    tail_start += -tail_start % unit  # хвост начинается на границе кодовой единицы
+                    f.seek(tail_start)
+                    tail_data = f.read(tail_size)
+                    # Пропускаем байты продолжения UTF-8 в начале хвоста
+                    start = 0
+                    if tail_encoding == "utf-8":
+                        while start < min(len(tail_data), 3) and 0x80 <= tail_data[start] < 0xC0:
+                            start += 1
+                    try:
+                        tail = tail_data[start:].decode(tail_encoding)
+                    except UnicodeDecodeError:
+                        # Как и для начала файла, пробуем запасные кодировки, иначе заменяем неверные байты
+                        try:
+                            tail, encoding = decode_with_fallback(tail_data[start:], fallback_encodings)
+                        except UnicodeDecodeError:
+                            tail = tail_data[start:].decode(tail_encoding, "replace")
+                    tail_used = len(tail_data) - start
+                    skipped = original_size - head_used - tail_used
+                    content = f"{head}\n\n... (пропущено {skipped} байт) ...\n\n{tail}"
+                    record["shown_size"] = head_used + tail_used
+                else:
+                    content, record["shown_size"], encoding = decode_prefix_with_fallback(
+                        data[:max_file_size], encoding, fallback_encodings)
     except Exception as e:
-        messagebox.showerror("Ошибка", f"Произошла ошибка: {e}")
-        status_label.config(text="❌ Ошибка!")
+        record["error"] = e
+        return record
+
+    record["content"] = normalize_newlines(content)
+    record["encoding"] = encoding
+    parse_start = time.perf_counter()
+    add_code_info(record, language, read_options.get("symbol_pool"))
+    add_parse_time(read_options.get("stats"), parse_start)
+    return record
+
+
+def read_skeleton(f, encoding, fallback_encodings, language, max_file_size, symbol_pool=None):
+    """Читает открытый файл целиком и строит скелет не длиннее max_file_size байт.
+
+    Возвращает (скелет, размер в байтах) или None, если скелет не строится.
+    """
+    if language not in SYMBOL_EXTRACTORS:
+        return None
+    f.seek(0)
+    data = f.read()
+    try:
+        content = data.decode(encoding)
+    except UnicodeDecodeError:
+        try:
+            content, _ = decode_with_fallback(data, fallback_encodings)
+        except UnicodeDecodeError:
+            return None
+    skeleton = run_parser(symbol_pool if language == "python" else None, build_skeleton,
+                          normalize_newlines(content), language)
+    if skeleton is None:
+        return None
+    data = skeleton.encode("utf-8")
+    if len(data) > max_file_size:
+        # Скелет тоже не поместился — обрезаем по последней целой строке
+        cut = data.rfind(b"\n", 0, max_file_size)
+        skeleton, _ = decode_prefix(data[:cut if cut > 0 else max_file_size], "utf-8")
+        data = skeleton.encode("utf-8")
+    return skeleton, len(data)
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """Хэш содержимого файла (BLAKE2b, 128 бит) для поиска одинаковых файлов."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def mark_duplicate_candidates(tree):
+    """Помечает dup_candidate файлы, размер которых совпадает с размером другого выводимого файла.
+
+    Только у них при чтении считается хэш: файл уникального размера не может быть копией.
+    """
+    by_size = {}
+    for entry in iter_tree_files(tree):
+        if not entry["excluded"] and not is_budget_omitted(entry) and entry["size"] > 0:
+            by_size.setdefault(entry["size"], []).append(entry)
+    for entries in by_size.values():
+        if len(entries) > 1:
+            for entry in entries:
+                entry["dup_candidate"] = True
+
+
+def find_duplicate(seen_hashes, entry, record):
+    """Возвращает путь ранее выведенного файла с тем же содержимым или None.
+
+    Первый файл с данным хэшем запоминается в seen_hashes; повторный вывод того же файла
+    (например, приоритетного) дубликатом не считается.
+    """
+    if seen_hashes is None or not record.get("hash"):
+        return None
+    original = seen_hashes.setdefault(record["hash"], entry["path"])
+    return original if original != entry["path"] else None
+
+
+def empty_file_record():
+    """Запись о файле без содержимого — начальное значение для read_file_record."""
+    return {"content": None, "error": None, "truncated": False, "original_size": None, "shown_size": None,
+            "binary": False, "encoding": None, "hash": None, "skeleton": False}
+
+
+def add_code_info(record, language, symbol_pool=None):
+    """Добавляет в запись функции, классы и документацию, если это полный текст кода и их еще нет.
+
+    Символы берутся из реестра SYMBOL_EXTRACTORS. Python разбирается через ast, в пуле
+    процессов symbol_pool, если он передан; остальные языки — быстрым проходом здесь же.
+    """
+    if (record["content"] is None or record["truncated"] or language is None or language == "text"
+            or "code_info" in record):
+        return False
+    info = run_parser(symbol_pool if language == "python" else None, extract_symbols, record["content"], language)
+    record["docstring"] = info.pop("docstring")
+    record["code_info"] = info
+    return True
+
+
+def new_symbol_pool(workers):
+    """Пул процессов разбора кода или None, если workers <= 1.
+
+    Пул запускает процессы из потоков чтения, поэтому они создаются через forkserver
+    (или spawn, где его нет), а не копированием многопоточного процесса через fork.
+    """
+    if workers <= 1:
+        return None
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method))
+
+
+def run_parser(symbol_pool, func, *args):
+    """Вызывает func(*args) в пуле процессов symbol_pool, а без пула — здесь же."""
+    if symbol_pool is not None:
+        try:
+            return symbol_pool.submit(func, *args).result()
+        except Exception:
+            pass  # пул недоступен (например, процесс упал) — разбираем здесь
+    return func(*args)
+
+
+def bomless_encoding(encoding, block):
+    """Кодек для чтения с середины файла (там нет BOM) и размер кодовой единицы в байтах."""
+    if encoding == "utf-8-sig":
+        return "utf-8", 1
+    if encoding == "utf-16":
+        return ("utf-16-le" if block.startswith(codecs.BOM_UTF16_LE) else "utf-16-be"), 2
+    if encoding == "utf-32":
+        return ("utf-32-le" if block.startswith(codecs.BOM_UTF32_LE) else "utf-32-be"), 4
+    return encoding, 1
+
+
+def decode_prefix_with_fallback(data, encoding, encodings):
+    """То же, что decode_prefix, но если первый блок был в UTF-8, а дальше нет, пробует запасные кодировки.
+
+    Возвращает (текст, сколько байт декодировано, кодировка).
+    """
+    try:
+        return (*decode_prefix(data, encoding), encoding)
+    except UnicodeDecodeError:
+        for fallback in encodings:
+            try:
+                return (*decode_prefix(data, fallback), fallback)
+            except (UnicodeDecodeError, LookupError):
+                continue
+        raise
+
+
+def decode_with_fallback(data, encodings):
+    """Декодирует данные первой подходящей кодировкой из списка. Возвращает (текст, кодировка)."""
+    for encoding in encodings:
+        try:
+            return data.decode(encoding), encoding
+        except (UnicodeDecodeError, LookupError):
+            continue
+    # Ни одна не подошла — повторяем ошибку UTF-8
+    return data.decode("utf-8"), "utf-8"
+
+
+# Постоянный кэш обработанных файлов
+CACHE_FILE = "file_scanner_cache.sqlite"
+CACHE_VERSION = 6  # увеличивается при изменении формата записи read_file_record
+
+
+def open_scan_cache(path=CACHE_FILE, max_bytes=256 * 1024 * 1024):
+    """Открывает (или создает) кэш обработанных файлов в SQLite.
+
+    Запись находится по пути и отпечатку настроек чтения и годится, только пока совпадают
+    размер и mtime_ns файла. Поэтому измененные файлы и смена настроек дают промах, а
+    устаревшие записи со временем вытесняются: при закрытии кэш ужимается до max_bytes.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                        path TEXT NOT NULL,
+                        options TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        mtime_ns INTEGER NOT NULL,
+                        record TEXT NOT NULL,
+                        nbytes INTEGER NOT NULL,
+                        last_used REAL NOT NULL,
+                        PRIMARY KEY (path, options))""")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if row is None or row[0] != str(CACHE_VERSION):
+        conn.execute("DELETE FROM files")
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(CACHE_VERSION),))
+    conn.commit()
+    return {"conn": conn, "lock": threading.Lock(), "max_bytes": max_bytes,
+            "used": [], "writes": 0, "hits": 0, "misses": 0}
+
+
+def options_fingerprint(read_options):
+    """Отпечаток настроек, от которых зависит результат read_file_record."""
+    return json.dumps({key: value for key, value in read_options.items()
+                       if key not in ("cache", "symbol_pool", "stats", "io_limit")},
+                      sort_keys=True, default=list)
+
+
+def cache_lookup(cache, key, entry):
+    """Возвращает запись из кэша, если файл с тех пор не менялся, иначе None."""
+    with cache["lock"]:
+        row = cache["conn"].execute("SELECT size, mtime_ns, record FROM files WHERE path = ? AND options = ?",
+                                    key).fetchone()
+        if row is None or row[0] != entry["size"] or row[1] != entry["mtime_ns"]:
+            cache["misses"] += 1
+            return None
+        cache["hits"] += 1
+        cache["used"].append(key)
+    return json.loads(row[2])
+
+
+def cache_store(cache, key, entry, record):
+    """Сохраняет запись о файле в кэш."""
+    data = json.dumps(record, ensure_ascii=False)
+    with cache["lock"]:
+        cache["conn"].execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (*key, entry["size"], entry["mtime_ns"], data, len(data.encode("utf-8")), time.time()))
+        cache["writes"] += 1
+        if cache["writes"] % 500 == 0:
+            cache["conn"].commit()
+
+
+def close_scan_cache(cache):
+    """Отмечает использованные записи, вытесняет самые старые сверх лимита и закрывает кэш."""
+    with cache["lock"]:
+        conn = cache["conn"]
+        now = time.time()
+        conn.executemany("UPDATE files SET last_used = ? WHERE path = ? AND options = ?",
+                         ((now, *key) for key in cache["used"]))
+        excess = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM files").fetchone()[0] - cache["max_bytes"]
+        if excess > 0:
+            victims = []
+            for path, options, nbytes in conn.execute("SELECT path, options, nbytes FROM files ORDER BY last_used"):
+                if excess <= 0:
+                    break
+                victims.append((path, options))
+                excess -= nbytes
+            conn.executemany("DELETE FROM files WHERE path = ? AND options = ?", victims)
+        conn.commit()
+        conn.executescript("PRAGMA incremental_vacuum;")  # возвращаем освободившееся место диску
+        conn.close()
+
+
+def load_file_record(entry, read_options, language=None):
+    """То же, что read_file_record, но сначала ищет результат в кэше read_options["cache"].
+
+    Неизмененные файлы берутся из кэша и вообще не открываются. Если в read_options есть
+    "stats" (new_stats()), время и результат чтения учитываются в статистике.
+    """
+    stats = read_options.get("stats")
+    if stats is None:
+        return _load_file_record(entry, read_options, language)
+    start = time.perf_counter()
+    record = _load_file_record(entry, read_options, language)
+    add_file_stats(stats, entry, record, time.perf_counter() - start)
+    return record
+
+
+def _load_file_record(entry, read_options, language):
+    if entry.get("budget") and entry["budget"][0] != "full":
+        return load_budgeted_record(entry, read_options, language)
+
+    cache = read_options.get("cache")
+    if cache is None:
+        return read_file_record(entry, read_options, language)
+
+    key = (os.path.abspath(entry["path"]), options_fingerprint(read_options))
+    record = cache_lookup(cache, key, entry)
+    if record is not None:
+        # В кэше может лежать запись без разбора кода (например, после JSON-режима) или без хэша
+        changed = add_code_info(record, language, read_options.get("symbol_pool"))
+        if entry.get("dup_candidate") and record["hash"] is None and record["content"] is not None:
+            record["hash"] = hash_file(entry["path"])
+            changed = True
+        if changed:
+            cache_store(cache, key, entry, record)
+        return record
+
+    record = read_file_record(entry, read_options, language)
+    if record["error"] is None:
+        cache_store(cache, key, entry, record)
+    return record
+
+
+# Минификация: комментарии убираются по правилам языка, строки и heredoc не меняются.
+# Повторяющийся заголовок лицензии выводится один раз, в остальных файлах — ссылкой на первый.
+LICENSE_RE = re.compile(r"copyright|licen[cs]e|spdx-license-identifier", re.IGNORECASE)
+# Объявление кодировки (PEP 263, в Ruby — magic comment) в первых двух строках
+CODING_RE = re.compile(r"^[ \t\f]*#.*?coding[:=][ \t]*[-\w.]+")
+
+
+def make_comment_syntax(line=None, block=(), quotes="", multiline="", heredoc=None, reference="// {}"):
+    """Правила комментариев языка для strip_comments.
+
+    line — регулярное выражение начала строчного комментария, block — пары (начало, конец),
+    quotes — кавычки строк, multiline — те из них, что могут продолжаться на следующих строках,
+    heredoc — выражение с группой tag (конец heredoc — строка, равная tag), reference — формат
+    однострочного комментария для ссылки на лицензию.
+    """
+    parts = []
+    if line:
+        parts.append(f"(?P<line>{line})")
+    parts.extend(f"(?P<block{index}>{re.escape(start)})" for index, (start, _) in enumerate(block))
+    if quotes:
+        parts.append(f"(?P<quote>[{re.escape(quotes)}])")
+    return {
+        "strip": strip_comments,
+        "regex": re.compile("|".join(parts)),
+        "block": list(block),
+        "string_end": {quote: re.compile(rf"(?:\\.|[^{re.escape(quote)}\\])*{re.escape(quote)}") for quote in quotes},
+        "multiline": multiline,
+        "heredoc": re.compile(heredoc) if heredoc else None,
+        "reference": reference,
+    }
+
+
+def strip_comments(content, lines, syntax):
+    """Построчно убирает комментарии. Выдает на каждую строку (текст, был ли комментарий, защищена ли строка);
+    защищенные строки (внутри многострочной строки или heredoc) дальше не меняются.
+    """
+    regex = syntax["regex"]
+    state = None  # ("block", конец), ("string", кавычка) или ("heredoc", метка)
+    for line in lines:
+        if state is not None and state[0] == "heredoc":
+            if line.strip() == state[1]:
+                state = None
+            yield line, False, True
+            continue
+        protected = state is not None and state[0] == "string"
+        parts = []
+        pos = 0
+        removed = False
+        while pos < len(line):
+            if state is not None:
+                kind, end = state
+                if kind == "block":
+                    removed = True
+                    index = line.find(end, pos)
+                    if index == -1:
+                        break
+                    pos = index + len(end)
+                    state = None
+                    if parts and not parts[-1][-1:].isspace() and not line[pos:pos + 1].isspace():
+                        parts.append(" ")  # a/* */b не должно склеиться в ab
+                    continue
+                match = syntax["string_end"][end].match(line, pos)
+                if match is None:
+                    parts.append(line[pos:])
+                    break
+                parts.append(line[pos:match.end()])
+                pos = match.end()
+                state = None
+                continue
+            match = regex.search(line, pos)
+            if match is None:
+                parts.append(line[pos:])
+                break
+            parts.append(line[pos:match.start()])
+            group = match.lastgroup
+            if group == "line":
+                removed = True
+                break
+            if group == "quote":
+                quote = match.group()
+                end = syntax["string_end"][quote].match(line, match.end())
+                if end is None:
+                    parts.append(line[match.start():])
+                    if quote in syntax["multiline"]:
+                        state = ("string", quote)
+                    break
+                parts.append(line[match.start():end.end()])
+                pos = end.end()
+                continue
+            state = ("block", syntax["block"][int(group[len("block"):])][1])
+            removed = True
+            pos = match.end()
+        text = "".join(parts)
+        if state is not None and state[0] == "string":
+            protected = True  # пробелы в конце строки — часть строкового литерала
+        elif state is None and syntax["heredoc"] is not None:
+            match = syntax["heredoc"].search(text)
+            if match:
+                state = ("heredoc", match.group("tag"))
+        yield text, removed, protected
+
+
+# Токены f-строк есть только с Python 3.12
+FSTRING_START = getattr(tokenize, "FSTRING_START", None)
+FSTRING_END = getattr(tokenize, "FSTRING_END", None)
+
+
+def python_comment_lines(content, lines, syntax):
+    """То же для Python через tokenize: комментарии находятся точно, многострочные строки не меняются."""
+    comments = {}  # номер строки -> позиция "#"
+    protected = set()
+    fstring_starts = []
+    last_row = 0
+    try:
+        for kind, _, start, end, _ in tokenize.generate_tokens(io.StringIO(content).readline):
+            if kind == tokenize.COMMENT:
+                comments[start[0]] = start[1]
+            elif kind == tokenize.STRING:
+                if start[0] != end[0]:
+                    protected.update(range(start[0], end[0] + 1))
+            elif kind == FSTRING_START:
+                fstring_starts.append(start[0])
+            elif kind == FSTRING_END and fstring_starts:
+                start_row = fstring_starts.pop()
+                if start_row != end[0]:
+                    protected.update(range(start_row, end[0] + 1))
+            last_row = end[0]
+    except (tokenize.TokenError, SyntaxError):
+        # Незакрытая строка или скобка (например, у усеченного файла): дальше ничего не меняем
+        protected.update(range(last_row + 1, len(lines) + 1))
+    for row, line in enumerate(lines, 1):
+        if row in protected:
+            yield line, False, True
+        elif row in comments:
+            yield line[:comments[row]], True, False
+        else:
+            yield line, False, False
+
+
+YAML_COMMENT_RE = re.compile(r""""(?:\\.|[^"\\])*"|'(?:[^']|'')*'|(?P<comment>(?<!\S)#)""")
+YAML_BLOCK_SCALAR_RE = re.compile(r"(?:^|[\s:])[|>][-+0-9]*$")
+
+
+def yaml_comment_lines(content, lines, syntax):
+    """То же для YAML: текст блоков "|" и ">" (строки глубже строки с индикатором) не меняется."""
+    block_indent = None
+    for line in lines:
+        indent = len(line) - len(line.lstrip(" "))
+        if block_indent is not None:
+            if not line.strip() or indent > block_indent:
+                yield line, False, True
+                continue
+            block_indent = None
+        text, removed = line, False
+        for match in YAML_COMMENT_RE.finditer(line):
+            if match.group("comment"):
+                text, removed = line[:match.start()], True
+                break
+        if YAML_BLOCK_SCALAR_RE.search(text.rstrip()):
+            block_indent = indent
+        yield text, removed, False
+
+
+C_LIKE_COMMENTS = {"line": r"//", "block": [("/*", "*/")], "quotes": "\"'"}
+# Реестр: язык (как в get_language_by_extension) -> правила комментариев; остальные языки не меняются
+MINIFY_SYNTAX = {
+    "python": {"strip": python_comment_lines, "reference": "# {}"},
+    "yaml": {"strip": yaml_comment_lines, "reference": "# {}"},
+    "javascript": make_comment_syntax(**dict(C_LIKE_COMMENTS, quotes="\"'`", multiline="`")),
+    "typescript": make_comment_syntax(**dict(C_LIKE_COMMENTS, quotes="\"'`", multiline="`")),
+    "go": make_comment_syntax(**dict(C_LIKE_COMMENTS, quotes="\"'`", multiline="`")),
+    # Одинарные кавычки в Rust — еще и времена жизни, а обычные строки бывают многострочными
+    "rust": make_comment_syntax(**dict(C_LIKE_COMMENTS, quotes="\"", multiline="\"")),
+    "java": make_comment_syntax(**C_LIKE_COMMENTS),
+    "c": make_comment_syntax(**C_LIKE_COMMENTS),
+    "cpp": make_comment_syntax(**C_LIKE_COMMENTS),
+    "csharp": make_comment_syntax(**C_LIKE_COMMENTS),
+    "php": make_comment_syntax(**dict(C_LIKE_COMMENTS, line=r"//|#(?!\[)"),
+                               heredoc=r"<<<[ \t]*[\"']?(?P<tag>[A-Za-z_]\w*)"),
+    "css": make_comment_syntax(block=[("/*", "*/")], quotes="\"'", reference="/* {} */"),
+    "html": make_comment_syntax(block=[("<!--", "-->")], reference="<!-- {} -->"),
+    "xml": make_comment_syntax(block=[("<!--", "-->")], reference="<!-- {} -->"),
+    "ruby": make_comment_syntax(line=r"(?<!\S)#", quotes="\"'", multiline="\"'",
+                                heredoc=r"<<[~-]?[\"'`]?(?P<tag>[A-Z_][A-Z0-9_]*)", reference="# {}"),
+    "bash": make_comment_syntax(line=r"(?<!\S)#", quotes="\"'", multiline="\"'",
+                                heredoc=r"(?<!<)<<-?[ \t]*[\"']?(?P<tag>[A-Za-z_]\w*)", reference="# {}"),
+    "powershell": make_comment_syntax(line=r"(?<!\S)#", block=[("<#", "#>")], quotes="\"'", multiline="\"'",
+                                      reference="# {}"),
+    "sql": make_comment_syntax(line=r"--", block=[("/*", "*/")], quotes="'\"", multiline="'", reference="-- {}"),
+}
+
+
+def new_minifier():
+    """Состояние минификации на один запуск: первые копии лицензий и счетчики байт."""
+    return {"licenses": {}, "files": 0, "bytes_before": 0, "bytes_after": 0, "licenses_replaced": 0}
+
+
+def minify_content(minifier, content, language, path):
+    """Убирает комментарии, пробелы в концах строк и серии пустых строк; отступы не меняются.
+
+    Первая копия заголовка лицензии сохраняется, повторы (с точностью до годов) заменяются
+    строкой "Лицензия: как в <путь>". Строка #! и объявление кодировки остаются: это не комментарии,
+    а сведения для интерпретатора. Языки не из MINIFY_SYNTAX возвращаются как есть.
+    """
+    syntax = MINIFY_SYNTAX.get(language)
+    if syntax is None:
+        return content
+    lines = content.split("\n")
+    items = syntax["strip"](content, lines, syntax)
+
+    # Заголовок — строки в начале файла, от которых после удаления комментариев ничего не осталось
+    head = []
+    for item in items:
+        head.append(item)
+        if item[0].strip() or item[2]:
+            break
+    header_size = len(head) - 1 if head and (head[-1][0].strip() or head[-1][2]) else len(head)
+    keep = {index for index, line in enumerate(lines[:2])
+            if (index == 0 and line.startswith("#!")) or CODING_RE.match(line)}
+    header_lines = [index for index in range(header_size) if index not in keep]
+    header = "\n".join(lines[index] for index in header_lines)
+    keep_header = replacement = None
+    if LICENSE_RE.search(header):
+        key = " ".join(re.sub(r"\d+", "0", header).split())
+        first = minifier["licenses"].setdefault(key, path)
+        if first == path:
+            keep_header = True
+        else:
+            replacement = syntax["reference"].format(f"Лицензия: как в {first}")
+            if len(replacement) < len(header):
+                minifier["licenses_replaced"] += 1
+            else:
+                replacement = None
+
+    def iter_items():
+        yield from head
+        yield from items
+
+    def iter_lines():
+        blank = True  # пустые строки в начале файла тоже убираются
+        for index, (text, removed, protected) in enumerate(iter_items()):
+            if index in keep:
+                blank = False
+                yield lines[index]
+                continue
+            if index < header_size:
+                if replacement is not None:
+                    if index == header_lines[0]:
+                        yield replacement
+                    continue
+                if keep_header:
+                    yield lines[index]
+                    continue
+            if protected:
+                blank = False
+                yield text
+                continue
+            text = text.rstrip()
+            if not text:
+                # От строки остался только комментарий, или это повтор пустой строки
+                if removed or blank:
+                    continue
+                blank = True
+            else:
+                blank = False
+            yield text
+
+    result = "\n".join(iter_lines()).rstrip("\n")
+    minifier["files"] += 1
+    minifier["bytes_before"] += len(content.encode("utf-8"))
+    minifier["bytes_after"] += len(result.encode("utf-8"))
+    return result
+
+
+def format_minify_report(report):
+    saved = report["bytes_before"] - report["bytes_after"]
+    percent = saved * 100 / report["bytes_before"] if report["bytes_before"] else 0
+    text = f"сэкономлено {format_size(saved)} из {format_size(report['bytes_before'])} ({percent:.0f}%)"
+    if report["licenses_replaced"]:
+        text += f", повторов лицензии заменено ссылкой: {report['licenses_replaced']}"
+    return text
 
 
 # Функция для обработки отдельного файла
-def process_file(file_path, out, max_file_size, include_metadata, ext, language, progress):
+def process_file(entry, out, read_options, include_metadata, language, record=None, seen_hashes=None,
+                 minifier=None):
+    file_path = entry["path"]
     try:
-        file_size = os.path.getsize(file_path)
-        file_name = os.path.basename(file_path)
+        file_size = entry["size"]
+
+        # Читаем содержимое файла, если его не прочитали заранее
+        if record is None:
+            record = load_file_record(entry, read_options, language)
+        content = record["content"]
 
         # Записываем разделитель и имя файла
         out.write(f"\n{'=' * 80}\n")
@@ -553,53 +3572,74 @@ def process_file(file_path, out, max_file_size, include_metadata, ext, language,
         if include_metadata:
             out.write(f"РАЗМЕР: {file_size} байт\n")
             out.write(f"ТИП: {language}\n")
-            out.write(f"ПОСЛЕДНЕЕ ИЗМЕНЕНИЕ: {time.ctime(os.path.getmtime(file_path))}\n")
+            if record["encoding"] not in (None, "utf-8"):
+                out.write(f"КОДИРОВКА: {record['encoding']}\n")
+            out.write(f"ПОСЛЕДНЕЕ ИЗМЕНЕНИЕ: {time.ctime(entry['mtime'])}\n")
             out.write(f"{'-' * 80}\n\n")
 
-        # Читаем содержимое файла
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-
-                # Если файл слишком большой, усекаем
-                if max_file_size > 0 and len(content) > max_file_size:
-                    preview = content[:max_file_size]
-                    out.write(f"{preview}\n\n... (файл усечен, показано {max_file_size} из {len(content)} байт)\n")
-                else:
-                    # Если это код, добавляем маркеры языка
-                    if language != "text":
-                        # Извлекаем информацию о функциях и классах
-                        code_info = extract_functions_and_classes(content, language)
-                        docstring = extract_docstring(content, language)
-
-                        # Добавляем информацию о файле
-                        if code_info["functions"] or code_info["classes"]:
-                            out.write("СОДЕРЖИТ:\n")
-                            if code_info["classes"]:
-                                out.write(f"Классы: {', '.join(code_info['classes'])}\n")
-                            if code_info["functions"]:
-                                out.write(f"Функции: {', '.join(code_info['functions'])}\n")
-                            out.write("\n")
-
-                        if docstring:
-                            out.write(f"ДОКУМЕНТАЦИЯ:\n{docstring}\n\n")
-
-                        out.write(f"```{language}\n{content}\n```\n\n")
-                    else:
-                        out.write(f"{content}\n\n")
-        except Exception as e:
-            out.write(f"[Ошибка чтения файла: {e}]\n\n")
-
-        progress["value"] += 1
-        progress.update_idletasks()
+        original = find_duplicate(seen_hashes, entry, record)
+        if minifier is not None and original is None and content is not None:
+            content = minify_content(minifier, content, language, file_path)
+        if original is not None:
+            out.write(f"[Совпадает с {original}]\n\n")
+        elif record["error"] is not None:
+            out.write(f"[Ошибка чтения файла: {record['error']}]\n\n")
+        elif record["binary"]:
+            out.write(f"[Двоичный файл, {file_size} байт — содержимое пропущено]\n\n")
+        elif content is None:
+            # Только сигнатуры: содержимое не вошло в бюджет токенов
+            code_info = record.get("code_info") or {}
+            if code_info.get("signatures"):
+                out.write("СИГНАТУРЫ:\n" + "\n".join(code_info["signatures"]) + "\n")
+            else:
+                write_code_info(out, code_info)
+            if record.get("docstring"):
+                out.write(f"ДОКУМЕНТАЦИЯ:\n{record['docstring']}\n")
+            out.write(f"[Содержимое пропущено ради бюджета токенов, {file_size} байт]\n\n")
+        elif record.get("skeleton"):
+            out.write(f"```{language}\n{content}\n```\n\n... (скелет файла: импорты, объявления и документация "
+                      f"без тел функций, {record['shown_size']} из {record['original_size']} байт)\n")
+        elif record["truncated"]:
+            out.write(f"{content}\n\n... (файл усечен, показано {record['shown_size']} из {record['original_size']} байт)\n")
+        elif language != "text":
+            # Если это код, добавляем маркеры языка и информацию о функциях и классах;
+            # при бюджете токенов (entry["budget"]) они не повторяют то, что уже есть в тексте
+            code_info = {} if entry.get("budget") else record["code_info"]
+            docstring = None if entry.get("budget") else record["docstring"]
+
+            # Добавляем информацию о файле
+            if any(code_info.get(key) for _, key in CODE_INFO_TITLES):
+                out.write("СОДЕРЖИТ:\n")
+                write_code_info(out, code_info)
+                out.write("\n")
+
+            if docstring:
+                out.write(f"ДОКУМЕНТАЦИЯ:\n{docstring}\n\n")
+
+            out.write(f"```{language}\n{content}\n```\n\n")
+        else:
+            out.write(f"{content}\n\n")
     except Exception as e:
         out.write(f"[Ошибка обработки файла {file_path}: {e}]\n\n")
+    end_output_item(out, file_path)
+
+
+# Заголовки списков символов в выводе
+CODE_INFO_TITLES = [("Классы", "classes"), ("Функции", "functions"), ("Методы", "methods"), ("Типы", "types"),
+                    ("Экспорт", "exports")]
 
 
+def write_code_info(out, code_info, separator="\n"):
+    """Пишет строки "Классы:", "Функции:", "Методы:", "Типы:" и "Экспорт:" для непустых списков."""
+    for title, key in CODE_INFO_TITLES:
+        if code_info.get(key):
+            out.write(f"{title}: {', '.join(code_info[key])}{separator}")
 
 
 # Открытие файла с помощью стандартной программы ОС
 def open_file(file_path):
+    from tkinter import messagebox
+
     if os.path.exists(file_path):
         if os.name == 'nt':  # Windows
             os.startfile(file_path)
@@ -612,6 +3652,9 @@ def open_file(file_path):
 def start_gui():
     global source_folder_var, output_file_var
 
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+
     root = tk.Tk()
     root.title("AI-Friendly Копирование содержимого файлов")
     root.geometry("650x600")
@@ -627,7 +3670,7 @@ def start_gui():
     main_frame = ttk.Frame(root, padding="10 10 10 10")
     main_frame.pack(fill=tk.BOTH, expand=True)
 
-    ai_friendly_var = tk.BooleanVar(value=False)
+    ai_friendly_var = tk.BooleanVar(value=DEFAULT_SETTINGS["ai_friendly"])
 
     def select_source_folder():
         folder = filedialog.askdirectory()
@@ -635,17 +3678,30 @@ def start_gui():
             source_folder_var.set(folder)
 
     def select_output_file():
-        file_types = [("Текстовые файлы", "*.txt"), ("JSON файлы", "*.json")]
+        file_types = [("Текстовые файлы", "*.txt"), ("JSON файлы", "*.json"), ("JSON Lines файлы", "*.jsonl"),
+                      ("Снимок SQLite", "*.sqlite *.db"), ("Сжатые файлы", "*.gz *.xz")]
         file = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=file_types)
         if file:
             output_file_var.set(file)
-            # Обновляем формат вывода на основе расширения файла
-            if file.endswith(".json"):
+            # Обновляем формат вывода на основе расширения файла (dump.jsonl.gz — тоже jsonl)
+            name = strip_compression_suffix(file)
+            if name.endswith(".jsonl"):
+                output_format_var.set("jsonl")
+            elif name.endswith(".json"):
                 output_format_var.set("json")
+            elif name.endswith((".sqlite", ".db")):
+                output_format_var.set("sqlite")
             else:
                 output_format_var.set("txt")
 
+    # События от рабочего потока: виджеты Tk меняются только в главном потоке (см. poll_events)
+    events = queue.Queue()
+    cancel_event = threading.Event()
+    scan_state = {"running": False, "start": 0.0, "ai_friendly": False, "write_stats": False}
+
     def start_processing():
+        if scan_state["running"]:
+            return
         source_folder = source_folder_var.get()
         output_file = output_file_var.get()
 
@@ -654,16 +3710,7 @@ def start_gui():
             return
 
         try:
-            exclude_extensions = set(ext.strip() for ext in exclude_extensions_var.get().split(",") if ext.strip())
-            exclude_folders = set(folder.strip() for folder in exclude_folders_var.get().split(",") if folder.strip())
-            # Add parse for exclude_files
-            exclude_files = set(file.strip() for file in exclude_files_var.get().split(",") if file.strip())
-            max_file_size = max_file_size_var.get()
-            output_format = output_format_var.get()
-            group_by_type = group_by_type_var.get()
-            prioritize_files = prioritize_files_var.get()
-            include_metadata = include_metadata_var.get()
-            ai_friendly = ai_friendly_var.get()
+            settings = collect_settings()
         except Exception as e:
             messagebox.showerror("Ошибка", f"Неверный формат параметров: {e}")
             return
@@ -674,84 +3721,188 @@ def start_gui():
         # Сохраняем настройки в файле конфигурации для следующего запуска
         save_settings()
 
-        # Выбираем нужную функцию обработки
-        if ai_friendly:
-            thread = threading.Thread(target=create_ai_friendly_summary, args=(
-                source_folder, output_file, exclude_extensions, exclude_folders, exclude_files,
-                progress_bar, status_label))
-        else:
-            thread = threading.Thread(target=process_directory, args=(
-                source_folder, output_file, exclude_extensions, exclude_folders, exclude_files,
-                max_file_size, output_format, group_by_type, prioritize_files,
-                include_metadata, progress_bar, status_label))
+        cancel_event.clear()
+        scan_state.update(running=True, start=time.monotonic(), ai_friendly=settings["ai_friendly"],
+                          write_stats=settings["write_stats"])
+        start_button.config(state=tk.DISABLED)
+        cancel_button.config(state=tk.NORMAL)
+
+        def update_progress(value, maximum):
+            events.put(("progress", (value, maximum)))
+
+        # Статистика собирается, только если ее просили сохранить или нужен итог минификации
+        stats = new_stats() if settings["write_stats"] or settings["minify"] else None
+
+        def worker():
+            try:
+                output_path = run_scan(settings, update_progress, cancel_event, stats)
+            except ScanCancelled:
+                events.put(("cancelled", None))
+            except Exception as e:
+                events.put(("error", e))
+            else:
+                events.put(("done", (output_path, stats)))
 
+        thread = threading.Thread(target=worker)
         thread.daemon = True  # Поток завершится при закрытии программы
         thread.start()
+        root.after(GUI_POLL_MS, poll_events)
+
+    def poll_events():
+        # Забираем все накопившиеся события; из прогресса важно только последнее значение
+        last_progress = None
+        finished = None
+        while True:
+            try:
+                kind, payload = events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                last_progress = payload
+            else:
+                finished = (kind, payload)
+
+        if last_progress is not None:
+            value, maximum = last_progress
+            progress_bar["maximum"] = maximum
+            progress_bar["value"] = value
+            if finished is None and not cancel_event.is_set():
+                elapsed = time.monotonic() - scan_state["start"]
+                status_label.config(text="⏳ " + format_progress(value, maximum, elapsed))
+
+        if finished is None:
+            root.after(GUI_POLL_MS, poll_events)
+            return
+
+        scan_state["running"] = False
+        start_button.config(state=tk.NORMAL)
+        cancel_button.config(state=tk.DISABLED)
+        kind, payload = finished
+        if kind == "done":
+            payload, stats = payload
+            if stats is not None and scan_state["write_stats"]:
+                status_label.config(text="✅ Готово: " + format_stats_summary(stats["report"]))
+            elif stats is not None and "minify" in stats["report"]:
+                status_label.config(text="✅ Готово, минификация: " + format_minify_report(stats["report"]["minify"]))
+            else:
+                status_label.config(text="✅ Готово!")
+            if scan_state["ai_friendly"]:
+                messagebox.showinfo("Готово", f"Краткое описание сохранено в {payload}")
+            else:
+                messagebox.showinfo("Готово", f"Данные сохранены в {payload}")
+        elif kind == "cancelled":
+            status_label.config(text="⛔ Отменено, результат неполный")
+        else:
+            if scan_state["ai_friendly"]:
+                messagebox.showerror("Ошибка", f"Произошла ошибка при создании краткого описания: {payload}")
+            else:
+                messagebox.showerror("Ошибка", f"Произошла ошибка: {payload}")
+            status_label.config(text="❌ Ошибка!")
+
+    def cancel_processing():
+        if scan_state["running"]:
+            cancel_event.set()
+            status_label.config(text="⏳ Отмена...")
+
+    # Настройки, которых нет в форме (например, из файла конфигурации), сохраняются как есть
+    gui_settings = dict(DEFAULT_SETTINGS)
+
+    # Собирает настройки из полей формы
+    def collect_settings():
+        return dict(gui_settings, **{
+            "source_folder": source_folder_var.get(),
+            "output_file": output_file_var.get(),
+            "exclude_extensions": exclude_extensions_var.get(),
+            "exclude_folders": exclude_folders_var.get(),
+            "exclude_files": exclude_files_var.get(),
+            "exclude_patterns": exclude_patterns_var.get(),
+            "use_gitignore": use_gitignore_var.get(),
+            "max_file_size": max_file_size_var.get(),
+            "token_budget": token_budget_var.get(),
+            "query": query_var.get().strip(),
+            "query_top_k": query_top_k_var.get(),
+            "shard_max_bytes": shard_max_bytes_var.get(),
+            "tree_max_entries": tree_max_entries_var.get(),
+            "output_format": output_format_var.get(),
+            "group_by_type": group_by_type_var.get(),
+            "prioritize_files": prioritize_files_var.get(),
+            "include_metadata": include_metadata_var.get(),
+            "ai_friendly": ai_friendly_var.get(),
+            "truncate_mode": truncate_mode_var.get(),
+            "use_cache": use_cache_var.get(),
+            "deduplicate": deduplicate_var.get(),
+            "write_stats": write_stats_var.get(),
+            "minify": minify_var.get(),
+            "source_mode": "git" if git_source_var.get() else "fs",
+            "since": since_var.get().strip(),
+        })
 
     # Функция для сохранения настроек
     def save_settings():
         try:
-            with open("file_scanner_config.txt", "w", encoding="utf-8") as f:
-                f.write(f"source_folder={source_folder_var.get()}\n")
-                f.write(f"output_file={output_file_var.get()}\n")
-                f.write(f"exclude_extensions={exclude_extensions_var.get()}\n")
-                f.write(f"exclude_folders={exclude_folders_var.get()}\n")
-                f.write(f"exclude_files={exclude_files_var.get()}\n")  # Add exclude_files
-                f.write(f"max_file_size={max_file_size_var.get()}\n")
-                f.write(f"output_format={output_format_var.get()}\n")
-                f.write(f"group_by_type={group_by_type_var.get()}\n")
-                f.write(f"prioritize_files={prioritize_files_var.get()}\n")
-                f.write(f"include_metadata={include_metadata_var.get()}\n")
-                f.write(f"ai_friendly={ai_friendly_var.get()}\n")
+            save_settings_file(collect_settings())
         except Exception:
             pass
 
-
-            # Функция для загрузки настроек
-
+    # Функция для загрузки настроек
     def load_settings():
         try:
-            if os.path.exists("file_scanner_config.txt"):
-                settings = {}
-                with open("file_scanner_config.txt", "r", encoding="utf-8") as f:
-                    for line in f.readlines():
-                        if "=" in line:
-                            key, value = line.strip().split("=", 1)
-                            settings[key] = value
-
-                if "source_folder" in settings:
-                    source_folder_var.set(settings["source_folder"])
-                if "output_file" in settings:
-                    output_file_var.set(settings["output_file"])
-                if "exclude_extensions" in settings:
-                    exclude_extensions_var.set(settings["exclude_extensions"])
-                if "exclude_folders" in settings:
-                    exclude_folders_var.set(settings["exclude_folders"])
-                if "max_file_size" in settings and settings["max_file_size"].isdigit():
-                    max_file_size_var.set(int(settings["max_file_size"]))
-                if "output_format" in settings:
-                    output_format_var.set(settings["output_format"])
-                if "group_by_type" in settings:
-                    group_by_type_var.set(settings["group_by_type"] == "True")
-                if "prioritize_files" in settings:
-                    prioritize_files_var.set(settings["prioritize_files"])
-                if "include_metadata" in settings:
-                    include_metadata_var.set(settings["include_metadata"] == "True")
-                if "exclude_files" in settings:
-                    exclude_files_var.set(settings["exclude_files"])
+            settings = load_settings_file()
         except Exception:
-            pass  # Игнорируем ошибки при загрузке настроек
+            return  # Игнорируем ошибки при загрузке настроек
+
+        gui_settings.update(settings)
+
+        source_folder_var.set(settings["source_folder"])
+        output_file_var.set(settings["output_file"])
+        exclude_extensions_var.set(settings["exclude_extensions"])
+        exclude_folders_var.set(settings["exclude_folders"])
+        exclude_files_var.set(settings["exclude_files"])
+        exclude_patterns_var.set(settings["exclude_patterns"])
+        use_gitignore_var.set(settings["use_gitignore"])
+        max_file_size_var.set(settings["max_file_size"])
+        token_budget_var.set(settings["token_budget"])
+        query_var.set(settings["query"])
+        query_top_k_var.set(settings["query_top_k"])
+        shard_max_bytes_var.set(settings["shard_max_bytes"])
+        tree_max_entries_var.set(settings["tree_max_entries"])
+        output_format_var.set(settings["output_format"])
+        group_by_type_var.set(settings["group_by_type"])
+        prioritize_files_var.set(settings["prioritize_files"])
+        include_metadata_var.set(settings["include_metadata"])
+        ai_friendly_var.set(settings["ai_friendly"])
+        truncate_mode_var.set(settings["truncate_mode"])
+        use_cache_var.set(settings["use_cache"])
+        deduplicate_var.set(settings["deduplicate"])
+        write_stats_var.set(settings["write_stats"])
+        minify_var.set(settings["minify"])
+        git_source_var.set(settings["source_mode"] == "git")
+        since_var.set(settings["since"])
 
     source_folder_var = tk.StringVar()
     output_file_var = tk.StringVar()
-    exclude_extensions_var = tk.StringVar(value=".exe, .dll, .zip, .mp4, .jpg, .jpeg, .png, .gif, .bin")
-    exclude_folders_var = tk.StringVar(value="node_modules, __pycache__, .git, venv, .vscode, build, dist")
-    exclude_files_var = tk.StringVar(value="")  # Add new variable for excluding specific files
-    max_file_size_var = tk.IntVar(value=50000)  # По умолчанию ограничение 50KB
-    output_format_var = tk.StringVar(value="txt")
-    group_by_type_var = tk.BooleanVar(value=False)
-    prioritize_files_var = tk.StringVar(value="settings.py, urls.py, models.py, views.py")
-    include_metadata_var = tk.BooleanVar(value=True)
+    exclude_extensions_var = tk.StringVar(value=DEFAULT_SETTINGS["exclude_extensions"])
+    exclude_folders_var = tk.StringVar(value=DEFAULT_SETTINGS["exclude_folders"])
+    exclude_files_var = tk.StringVar(value=DEFAULT_SETTINGS["exclude_files"])
+    exclude_patterns_var = tk.StringVar(value=DEFAULT_SETTINGS["exclude_patterns"])
+    use_gitignore_var = tk.BooleanVar(value=DEFAULT_SETTINGS["use_gitignore"])
+    max_file_size_var = tk.IntVar(value=DEFAULT_SETTINGS["max_file_size"])  # По умолчанию ограничение 50KB
+    token_budget_var = tk.IntVar(value=DEFAULT_SETTINGS["token_budget"])
+    query_var = tk.StringVar(value=DEFAULT_SETTINGS["query"])
+    query_top_k_var = tk.IntVar(value=DEFAULT_SETTINGS["query_top_k"])
+    shard_max_bytes_var = tk.IntVar(value=DEFAULT_SETTINGS["shard_max_bytes"])
+    tree_max_entries_var = tk.IntVar(value=DEFAULT_SETTINGS["tree_max_entries"])
+    output_format_var = tk.StringVar(value=DEFAULT_SETTINGS["output_format"])
+    group_by_type_var = tk.BooleanVar(value=DEFAULT_SETTINGS["group_by_type"])
+    prioritize_files_var = tk.StringVar(value=DEFAULT_SETTINGS["prioritize_files"])
+    include_metadata_var = tk.BooleanVar(value=DEFAULT_SETTINGS["include_metadata"])
+    truncate_mode_var = tk.StringVar(value=DEFAULT_SETTINGS["truncate_mode"])
+    use_cache_var = tk.BooleanVar(value=DEFAULT_SETTINGS["use_cache"])
+    deduplicate_var = tk.BooleanVar(value=DEFAULT_SETTINGS["deduplicate"])
+    write_stats_var = tk.BooleanVar(value=DEFAULT_SETTINGS["write_stats"])
+    minify_var = tk.BooleanVar(value=DEFAULT_SETTINGS["minify"])
+    git_source_var = tk.BooleanVar(value=DEFAULT_SETTINGS["source_mode"] == "git")
+    since_var = tk.StringVar(value=DEFAULT_SETTINGS["since"])
 
     # Создаем вкладки для лучшей организации опций
     notebook = ttk.Notebook(main_frame)
@@ -787,6 +3938,8 @@ def start_gui():
     ttk.Label(format_frame, text="Формат вывода:").pack(side=tk.LEFT)
     ttk.Radiobutton(format_frame, text="Текст", variable=output_format_var, value="txt").pack(side=tk.LEFT, padx=5)
     ttk.Radiobutton(format_frame, text="JSON", variable=output_format_var, value="json").pack(side=tk.LEFT, padx=5)
+    ttk.Radiobutton(format_frame, text="JSON Lines", variable=output_format_var, value="jsonl").pack(side=tk.LEFT, padx=5)
+    ttk.Radiobutton(format_frame, text="SQLite", variable=output_format_var, value="sqlite").pack(side=tk.LEFT, padx=5)
 
     # Группа исключений
     exclude_frame = ttk.LabelFrame(basic_frame, text="Исключения через запитую")
@@ -826,17 +3979,78 @@ def start_gui():
     size_entry = ttk.Entry(size_frame, textvariable=max_file_size_var, width=10)
     size_entry.pack(side=tk.LEFT, padx=5)
     ttk.Label(size_frame, text="(0 = без ограничений)").pack(side=tk.LEFT)
+    # Бюджет токенов на весь результат
+    budget_frame = ttk.Frame(advanced_frame)
+    budget_frame.pack(fill=tk.X, padx=5, pady=5)
+    ttk.Label(budget_frame, text="Бюджет токенов:").pack(side=tk.LEFT)
+    budget_entry = ttk.Entry(budget_frame, textvariable=token_budget_var, width=10)
+    budget_entry.pack(side=tk.LEFT, padx=5)
+    ttk.Label(budget_frame, text="(0 = без ограничений, например 128000)").pack(side=tk.LEFT)
+    # Только файлы, подходящие к запросу
+    query_frame = ttk.Frame(advanced_frame)
+    query_frame.pack(fill=tk.X, padx=5, pady=5)
+    ttk.Label(query_frame, text="Запрос:").pack(side=tk.LEFT)
+    query_entry = ttk.Entry(query_frame, textvariable=query_var, width=30)
+    query_entry.pack(side=tk.LEFT, padx=5)
+    create_context_menu(query_entry)
+    enable_copy_paste(query_entry)
+    ttk.Label(query_frame, text="лучших файлов:").pack(side=tk.LEFT)
+    ttk.Entry(query_frame, textvariable=query_top_k_var, width=5).pack(side=tk.LEFT, padx=5)
+    ttk.Label(query_frame, text="(0 = все совпавшие)").pack(side=tk.LEFT)
+    # Вывод частями
+    shard_frame = ttk.Frame(advanced_frame)
+    shard_frame.pack(fill=tk.X, padx=5, pady=5)
+    ttk.Label(shard_frame, text="Делить результат на части по (байт):").pack(side=tk.LEFT)
+    shard_entry = ttk.Entry(shard_frame, textvariable=shard_max_bytes_var, width=10)
+    shard_entry.pack(side=tk.LEFT, padx=5)
+    ttk.Label(shard_frame, text="(0 = один файл; только txt и jsonl)").pack(side=tk.LEFT)
+    # Компактная структура проекта
+    tree_frame = ttk.Frame(advanced_frame)
+    tree_frame.pack(fill=tk.X, padx=5, pady=5)
+    ttk.Label(tree_frame, text="Сворачивать в структуре папки больше:").pack(side=tk.LEFT)
+    tree_entry = ttk.Entry(tree_frame, textvariable=tree_max_entries_var, width=10)
+    tree_entry.pack(side=tk.LEFT, padx=5)
+    ttk.Label(tree_frame, text="элементов (0 = полный список)").pack(side=tk.LEFT)
+    # Что показывать у файлов больше максимального размера
+    truncate_frame = ttk.Frame(advanced_frame)
+    truncate_frame.pack(fill=tk.X, padx=5)
+    ttk.Label(truncate_frame, text="Большие файлы:").pack(side=tk.LEFT)
+    ttk.Radiobutton(truncate_frame, text="начало", variable=truncate_mode_var, value="head").pack(side=tk.LEFT, padx=5)
+    ttk.Radiobutton(truncate_frame, text="начало и конец", variable=truncate_mode_var,
+                    value="head_tail").pack(side=tk.LEFT, padx=5)
+    ttk.Radiobutton(truncate_frame, text="скелет кода", variable=truncate_mode_var,
+                    value="skeleton").pack(side=tk.LEFT, padx=5)
 
     # Опции группировки
     group_frame = ttk.Frame(advanced_frame)
     group_frame.pack(fill=tk.X, padx=5, pady=5)
     ttk.Checkbutton(group_frame, text="Группировать файлы по типу", variable=group_by_type_var).pack(anchor=tk.W)
     ttk.Checkbutton(group_frame, text="Включать метаданные файлов", variable=include_metadata_var).pack(anchor=tk.W)
+    ttk.Checkbutton(group_frame, text="Одинаковые файлы выводить один раз",
+                    variable=deduplicate_var).pack(anchor=tk.W)
+    ttk.Checkbutton(group_frame, text="Убирать комментарии и лишние пустые строки из кода",
+                    variable=minify_var).pack(anchor=tk.W)
+    ttk.Checkbutton(group_frame, text="Кэшировать обработанные файлы между запусками",
+                    variable=use_cache_var).pack(anchor=tk.W)
+    ttk.Checkbutton(group_frame, text="Сохранять статистику запуска (stats.json)",
+                    variable=write_stats_var).pack(anchor=tk.W)
+    ttk.Checkbutton(group_frame, text="Брать список файлов из git (учитывает .gitignore)",
+                    variable=git_source_var).pack(anchor=tk.W)
+
+    # Только изменения относительно ревизии git
+    since_frame = ttk.Frame(advanced_frame)
+    since_frame.pack(fill=tk.X, padx=5, pady=5)
+    ttk.Label(since_frame, text="Только изменения с ревизии git:").pack(side=tk.LEFT)
+    since_entry = ttk.Entry(since_frame, textvariable=since_var, width=20)
+    since_entry.pack(side=tk.LEFT, padx=5)
+    ttk.Label(since_frame, text="(например, main или HEAD~5)").pack(side=tk.LEFT)
+    create_context_menu(since_entry)
+    enable_copy_paste(since_entry)
 
     # Приоритетные файлы
     priority_frame = ttk.Frame(advanced_frame)
     priority_frame.pack(fill=tk.X, padx=5, pady=5)
-    ttk.Label(priority_frame, text="Приоритетные файлы:").pack(anchor=tk.W)
+    ttk.Label(priority_frame, text="Приоритетные файлы (имена или шаблоны: **/settings*.py, src/main.*):").pack(anchor=tk.W)
     priority_entry = ttk.Entry(priority_frame, textvariable=prioritize_files_var)
     priority_entry.pack(fill=tk.X, padx=5, pady=2)
     ttk.Label(priority_frame, text="(через запятую, эти файлы будут обработаны первыми)").pack(anchor=tk.W, padx=5)
@@ -851,6 +4065,16 @@ def start_gui():
     create_context_menu(exclude_files_entry)
     enable_copy_paste(exclude_files_entry)
 
+    patterns_exclude_frame = ttk.Frame(exclude_frame)
+    patterns_exclude_frame.pack(fill=tk.X, padx=5, pady=5)
+    ttk.Label(patterns_exclude_frame, text="Шаблоны (.gitignore):").pack(side=tk.LEFT)
+    exclude_patterns_entry = ttk.Entry(patterns_exclude_frame, textvariable=exclude_patterns_var)
+    exclude_patterns_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+    create_context_menu(exclude_patterns_entry)
+    enable_copy_paste(exclude_patterns_entry)
+    ttk.Checkbutton(exclude_frame, text="Учитывать .gitignore проекта",
+                    variable=use_gitignore_var).pack(anchor=tk.W, padx=5, pady=2)
+
     # Группа справки
     help_frame = ttk.LabelFrame(advanced_frame, text="Справка")
     help_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -886,6 +4110,10 @@ def start_gui():
                              bg="green", fg="white", font=("Arial", 10, "bold"))
     start_button.pack(side=tk.LEFT, padx=5, pady=5)
 
+    cancel_button = tk.Button(button_frame, text="Отмена", command=cancel_processing, state=tk.DISABLED,
+                              bg="red", fg="white", font=("Arial", 10, "bold"))
+    cancel_button.pack(side=tk.LEFT, padx=5, pady=5)
+
     open_result_button = tk.Button(button_frame, text="Открыть результат",
                                    command=lambda: open_file(output_file_var.get()),
                                    bg="blue", fg="white", font=("Arial", 10, "bold"))
@@ -897,7 +4125,7 @@ def start_gui():
     load_settings()
 
     # Сохраняем настройки при закрытии
-    root.protocol("WM_DELETE_WINDOW", lambda: (save_settings(), root.destroy()))
+    root.protocol("WM_DELETE_WINDOW", lambda: (cancel_event.set(), save_settings(), root.destroy()))
 
     # Функция для центрирования окна после полной загрузки интерфейса
     def center_window(event=None):
@@ -916,5 +4144,185 @@ def start_gui():
 
     root.mainloop()
 
+
+# Командная строка
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="AI_frendly",
+        description="Объединяет файлы проекта в один текстовый/JSON файл для ИИ. "
+                    "Без аргументов запускает графический интерфейс.")
+    parser.add_argument("source_folder", nargs="?", help="папка проекта для сканирования")
+    parser.add_argument("-o", "--output", dest="output_file", help="файл для сохранения результата")
+    parser.add_argument("-c", "--config", help=f"файл настроек в формате {CONFIG_FILE}")
+    parser.add_argument("-f", "--format", dest="output_format", choices=["txt", "json", "jsonl", "sqlite"],
+                        help="формат вывода (sqlite — обновляемый снимок с полнотекстовым поиском)")
+    parser.add_argument("--exclude-extensions", help="исключаемые расширения через запятую")
+    parser.add_argument("--exclude-folders", help="исключаемые папки через запятую")
+    parser.add_argument("--exclude-files", help="исключаемые файлы через запятую")
+    parser.add_argument("--exclude-patterns",
+                        help="шаблоны исключения в синтаксисе .gitignore через запятую (*.min.js, docs/**/generated, !keep.js)")
+    parser.add_argument("--gitignore", dest="use_gitignore", action=argparse.BooleanOptionalAction, default=None,
+                        help="добавить шаблоны из .gitignore в корне проекта")
+    parser.add_argument("--max-file-size", type=int, help="максимальный размер файла в байтах (0 = без ограничений)")
+    parser.add_argument("--prioritize-files",
+                        help="приоритетные файлы через запятую: имена, глобы по имени или пути от корня "
+                             "(settings.py, **/settings*.py, src/main.*); выводятся первыми, в порядке списка")
+    parser.add_argument("--tree-max-entries", type=int, metavar="N",
+                        help="компактная структура проекта: без исключенных файлов, с размерами папок, "
+                             "папки больше N элементов сворачиваются в сводку (0 = полный список)")
+    parser.add_argument("--query", metavar="TEXT",
+                        help="вывести только файлы, подходящие к запросу (ранжирование BM25 по пути и тексту)")
+    parser.add_argument("--top-k", dest="query_top_k", type=int, metavar="K",
+                        help="сколько лучших по запросу файлов выводить (0 = все совпавшие, по умолчанию 20)")
+    parser.add_argument("--neighbors", dest="query_neighbors", type=int, metavar="N",
+                        help="добавлять к каждому найденному файлу N соседних из той же папки (по умолчанию 1)")
+    parser.add_argument("--token-budget", type=int, metavar="TOKENS",
+                        help="уместить результат примерно в TOKENS токенов (например, 128000)")
+    parser.add_argument("--group-by-type", action=argparse.BooleanOptionalAction, default=None,
+                        help="группировать файлы по типу")
+    parser.add_argument("--metadata", dest="include_metadata", action=argparse.BooleanOptionalAction, default=None,
+                        help="включать метаданные файлов")
+    parser.add_argument("--ai-friendly", action=argparse.BooleanOptionalAction, default=None,
+                        help="создать краткое описание для ИИ")
+    parser.add_argument("--shard-bytes", dest="shard_max_bytes", type=int, metavar="BYTES",
+                        help="писать txt/jsonl частями name.001.txt, ... не больше BYTES байт и манифест")
+    parser.add_argument("--shard-tokens", dest="shard_max_tokens", type=int, metavar="TOKENS",
+                        help="то же, но предел части — примерное число токенов")
+    parser.add_argument("--compress", dest="compression", choices=["auto", "none", "gzip", "xz"],
+                        help="сжимать результат (auto — по расширению -o: .gz или .xz)")
+    parser.add_argument("--minify", action=argparse.BooleanOptionalAction, default=None,
+                        help="убирать из кода комментарии, пробелы в концах строк и серии пустых строк; "
+                             "повторы заголовка лицензии заменяются ссылкой на первый")
+    parser.add_argument("--dedup", dest="deduplicate", action=argparse.BooleanOptionalAction, default=None,
+                        help="одинаковые по содержимому файлы выводить один раз, остальные — ссылкой")
+    parser.add_argument("--truncate-mode", choices=["head", "head_tail", "skeleton"],
+                        help="что показывать у файлов больше max-file-size: начало, начало и конец "
+                             "или скелет кода (импорты, сигнатуры, документация)")
+    parser.add_argument("--fallback-encodings",
+                        help="кодировки для файлов не в UTF-8 через запятую (по умолчанию cp1251)")
+    parser.add_argument("--git", dest="source_mode", action="store_const", const="git",
+                        help="брать список файлов из git ls-files (учитывает .gitignore)")
+    parser.add_argument("--since", metavar="REV", help="только файлы, измененные относительно ревизии git")
+    parser.add_argument("--cache", dest="use_cache", action=argparse.BooleanOptionalAction, default=None,
+                        help="брать неизмененные файлы из кэша и сохранять туда новые")
+    parser.add_argument("--cache-path", help="файл кэша (по умолчанию file_scanner_cache.sqlite)")
+    parser.add_argument("--cache-max-mb", type=int, help="максимальный размер кэша в МБ")
+    parser.add_argument("--workers", dest="read_workers", type=int, help="потоков чтения файлов (1 = последовательно)")
+    parser.add_argument("--parse-workers", type=int,
+                        help="процессов для разбора кода Python (0 = по числу ядер, 1 = в основном процессе; "
+                             "при --workers 1 разбор всегда идет в основном процессе)")
+    parser.add_argument("--prefetch", dest="prefetch_depth", type=int,
+                        help="сколько файлов читать с опережением записи")
+    parser.add_argument("--stats", dest="write_stats", action=argparse.BooleanOptionalAction, default=None,
+                        help="сохранить статистику запуска (время фаз, прочитанные и исключенные файлы, "
+                             "самые медленные и большие файлы) в name.txt.stats.json и вывести сводку")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="пакетный запуск: профили проектов [имя] с source_folder, output_file и своими "
+                             "настройками; остальные параметры служат значениями по умолчанию")
+    parser.add_argument("--batch-workers", type=int, default=BATCH_WORKERS,
+                        help=f"сколько проектов пакета обрабатывать одновременно (по умолчанию {BATCH_WORKERS})")
+    parser.add_argument("--max-open-files", type=int, default=BATCH_MAX_OPEN_FILES,
+                        help="сколько файлов всех проектов пакета читать одновременно "
+                             f"(по умолчанию {BATCH_MAX_OPEN_FILES})")
+    parser.add_argument("--search", metavar="QUERY",
+                        help="найти файлы в снимке SQLite из -o по словам QUERY вместо сканирования")
+    parser.add_argument("-q", "--quiet", action="store_true", help="не выводить прогресс")
+    parser.add_argument("--gui", action="store_true", help="запустить графический интерфейс")
+    return parser
+
+
+def settings_from_args(args):
+    """Собирает настройки: значения по умолчанию, затем файл конфигурации, затем аргументы."""
+    settings = load_settings_file(args.config) if args.config else dict(DEFAULT_SETTINGS)
+    for key in DEFAULT_SETTINGS:
+        value = getattr(args, key, None)
+        if value is not None:
+            settings[key] = value
+    return settings
+
+
+def make_console_progress(stream=sys.stderr):
+    """Возвращает callback прогресса, который переписывает в stream строку с процентом, скоростью и ETA."""
+    start = time.monotonic()
+    last = [""]
+
+    def print_progress(value, maximum):
+        percent = min(100, value * 100 // maximum) if maximum else 100
+        line = f"{percent:3d}% {format_progress(value, maximum, time.monotonic() - start)}"
+        # Дополняем пробелами, чтобы затереть хвост более длинной предыдущей строки
+        stream.write("\r" + line.ljust(len(last[0])))
+        stream.flush()
+        last[0] = line
+
+    return print_progress
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        start_gui()
+        return 0
+
+    args = build_arg_parser().parse_args(argv)
+    if args.gui:
+        start_gui()
+        return 0
+
+    settings = settings_from_args(args)
+    if args.batch:
+        return run_batch_cli(args, settings)
+    if args.search:
+        try:
+            matches = search_snapshot(settings["output_file"], args.search)
+        except (ValueError, sqlite3.Error) as e:
+            sys.stderr.write(f"❌ Ошибка: {e}\n")
+            return 1
+        for path, fragment in matches:
+            print(f"{path}: {fragment}")
+        return 0
+    # Сэкономленные минификацией байты тоже считаются в статистике
+    stats = new_stats() if settings["write_stats"] or settings["minify"] else None
+    try:
+        output_path = run_scan(settings, None if args.quiet else make_console_progress(), stats=stats)
+    except Exception as e:
+        if not args.quiet:
+            sys.stderr.write("\n")
+        sys.stderr.write(f"❌ Ошибка: {e}\n")
+        return 1
+
+    if not args.quiet:
+        sys.stderr.write("\n")
+        if settings["write_stats"]:
+            sys.stderr.write(f"Статистика: {format_stats_summary(stats['report'])}\n")
+        elif stats is not None and "minify" in stats["report"]:
+            sys.stderr.write(f"Минификация: {format_minify_report(stats['report']['minify'])}\n")
+    print(f"✅ Данные сохранены в {output_path}")
+    return 0
+
+
+def run_batch_cli(args, settings):
+    """Пакетный запуск из командной строки: по строке на завершенный проект, в конце таблица итогов."""
+    try:
+        profiles = load_batch_file(args.batch, settings)
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"❌ Ошибка: {e}\n")
+        return 1
+
+    done = [0]
+
+    def report_done(result):
+        done[0] += 1
+        status = "готово" if result["error"] is None else f"ошибка: {result['error']}"
+        sys.stderr.write(f"[{done[0]}/{len(profiles)}] {result['name']}: {status} за {result['seconds']:.2f} с\n")
+
+    start = time.perf_counter()
+    results = run_batch(profiles, args.batch_workers, int(settings["parse_workers"]), args.max_open_files,
+                        done_callback=None if args.quiet else report_done)
+    print(format_batch_summary(results) + f" за {time.perf_counter() - start:.2f} с")
+    return 0 if all(result["error"] is None for result in results) else 1
+
+
 if __name__ == "__main__":
-    start_gui()
\ No newline at end of file
+    # В собранном PyInstaller .exe процессы пула иначе заново запускали бы main()
+    multiprocessing.freeze_support()
+    sys.exit(main())
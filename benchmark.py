@@ -0,0 +1,383 @@
+"""Замеры производительности AI_frendly.
+
+Генерирует воспроизводимое синтетическое дерево проекта, замеряет каждый режим вывода
+(txt, txt с группировкой, json, ai_friendly) по фазам и сохраняет результат в JSON,
+который можно сравнить с прошлым запуском:
+
+    python benchmark.py --files 5000 --out results.json
+    python benchmark.py --files 5000 --baseline results.json
+
+Каждый режим запускается в отдельном процессе, чтобы пиковая память (RSS) не смешивалась.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import AI_frendly
+
+try:
+    import resource  # нет в Windows: пиковая память тогда не замеряется
+except ImportError:
+    resource = None
+
+# Небольшие фрагменты кода, из которых повторением собираются файлы нужного размера.
+# В каждом есть объявления, комментарии и строки, похожие на объявления.
+SAMPLES = {
+    "python": '''
+class Model{n}(Base):
+    """Модель {n}. def fake_in_docstring(): pass"""
+
+    def save(self, force: bool = False) -> None:
+        # def fake_in_comment(): pass
+        self.data = {{"id": {n}, "query": "class FakeInString: pass"}}
+
+def helper_{n}(items, *args, limit=10, **kwargs):
+    return [item for item in items if item][:limit]
+''',
+    "javascript": '''
+// function fakeInComment{n}() {{}}
+export class Widget{n} extends Base {{
+  render() {{ return `<div>function fakeInTemplate() {{}}</div>`; }}
+}}
+export async function load{n}(id) {{ return fetch("/api/" + id); }}
+const helper{n} = (a, b) => a + b;
+module.exports.value{n} = "class FakeInString {{}}";
+''',
+    "typescript": '''
+/* interface FakeInComment{n} {{}} */
+export interface Props{n} {{ id: number; name: string }}
+export type Id{n} = string | number;
+export default class Store{n}<T> {{
+  private items: T[] = [];
+}}
+export const select{n} = (state: Props{n}): Id{n} => state.id;
+''',
+    "go": '''
+// func FakeInComment{n}() {{}}
+type Server{n} struct {{ addr string }}
+
+func (s *Server{n}) Serve(ctx context.Context) error {{
+	msg := "func FakeInString() {{}}"
+	return nil
+}}
+
+func newServer{n}(addr string) *Server{n} {{ return &Server{n}{{addr: addr}} }}
+''',
+    "rust": '''
+// fn fake_in_comment_{n}() {{}}
+pub struct Point{n}<'a> {{ name: &'a str }}
+
+impl<'a> Point{n}<'a> {{
+    pub fn new(name: &'a str) -> Self {{ Point{n} {{ name }} }}
+    fn describe(&self) -> String {{ format!("fn fake_in_string() {{}}") }}
+}}
+
+pub trait Shape{n} {{ fn area(&self) -> f64; }}
+''',
+    "java": '''
+/** class FakeInJavadoc{n} {{}} */
+public class Service{n} extends Base {{
+    private final Repo repo;
+
+    public Service{n}(Repo repo) {{ this.repo = repo; }}
+
+    public List<User> findAll(int limit) throws IOException {{
+        if (limit > 0) {{ return repo.all("void fakeInString() {{}}"); }}
+        return new ArrayList<>();
+    }}
+}}
+''',
+}
+
+# Состав синтетического проекта: расширение -> (язык шаблона или None для текста, вес)
+TREE_EXTENSIONS = {
+    ".py": ("python", 30), ".js": ("javascript", 15), ".ts": ("typescript", 10), ".go": ("go", 5),
+    ".rs": ("rust", 5), ".java": ("java", 5), ".md": (None, 10), ".json": (None, 10), ".txt": (None, 10),
+}
+BINARY_EXTENSIONS = (".png", ".dat")  # .png исключается по расширению, .dat распознается как двоичный
+TEXT_LINE = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor {n}.\n"
+
+MODES = {
+    "txt": {"output_format": "txt"},
+    "grouped": {"output_format": "txt", "group_by_type": True},
+    "json": {"output_format": "json"},
+    "ai": {"ai_friendly": True},
+}
+RESULT_EXTENSIONS = {"txt": ".txt", "grouped": ".txt", "json": ".json", "ai": ".md"}
+
+
+def make_source(language, size):
+    """Собирает исходник на языке language размером не меньше size байт."""
+    parts = []
+    total = 0
+    n = 0
+    while total < size:
+        part = SAMPLES[language].format(n=n)
+        parts.append(part)
+        total += len(part.encode("utf-8"))
+        n += 1
+    return "".join(parts)
+
+
+def best_time(func, repeat):
+    """Лучшее время из repeat запусков func(), в секундах."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_extractors(size_mb=1.0, repeat=3, out=sys.stdout):
+    """Стоимость извлечения символов на мегабайт исходника для каждого языка реестра."""
+    size = int(size_mb * 1024 * 1024)
+    out.write(f"{'язык':<12}{'символов':>10}{'мс/МБ':>10}{'МБ/с':>10}\n")
+    rows = [(language, lambda content=content, language=language: AI_frendly.extract_symbols(content, language))
+            for language, content in ((language, make_source(language, size)) for language in SAMPLES)]
+    # Запасной разбор Python регулярными выражениями — для сравнения с ast
+    python_source = make_source("python", size)
+    rows.append(("python/re", lambda: AI_frendly.extract_functions_and_classes(python_source, "python")))
+
+    results = {}
+    for name, func in rows:
+        info = func()
+        symbols = sum(len(value) for key, value in info.items() if key not in ("signatures", "docstring"))
+        seconds = best_time(func, repeat)
+        megabytes = size / (1024 * 1024)
+        results[name] = seconds / megabytes
+        out.write(f"{name:<12}{symbols:>10}{seconds * 1000 / megabytes:>10.1f}{megabytes / seconds:>10.1f}\n")
+    return results
+
+
+# Синтетическое дерево проекта
+def generate_tree(root, files=2000, depth=4, files_per_dir=20, median_size=4000, size_sigma=1.2,
+                  max_size=2 * 1024 * 1024, binary_share=0.05, node_modules_depth=4, node_modules_files=50,
+                  seed=1):
+    """Создает в root воспроизводимое дерево проекта; одинаковые параметры дают одинаковые файлы.
+
+    Размеры файлов — логнормальные с медианой median_size байт, доля binary_share файлов
+    двоичные. Вложенные node_modules (node_modules_depth уровней по node_modules_files файлов)
+    проверяют, что исключенные папки не обходятся. Возвращает параметры дерева.
+    """
+    params = {"files": files, "depth": depth, "files_per_dir": files_per_dir, "median_size": median_size,
+              "size_sigma": size_sigma, "max_size": max_size, "binary_share": binary_share,
+              "node_modules_depth": node_modules_depth, "node_modules_files": node_modules_files, "seed": seed}
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+
+    # Папки: у каждой новой папки случайный родитель не глубже depth
+    dirs = [("", 0)]
+    for index in range(max(0, files // files_per_dir - 1)):
+        parent, level = rng.choice([item for item in dirs if item[1] < depth] or dirs[:1])
+        dirs.append((os.path.join(parent, f"dir{index}"), level + 1))
+    for path, _ in dirs:
+        os.makedirs(os.path.join(root, path), exist_ok=True)
+
+    extensions = list(TREE_EXTENSIONS)
+    weights = [TREE_EXTENSIONS[ext][1] for ext in extensions]
+    for index in range(files):
+        folder = rng.choice(dirs)[0]
+        size = min(max_size, int(rng.lognormvariate(math.log(median_size), size_sigma)))
+        if rng.random() < binary_share:
+            ext = rng.choice(BINARY_EXTENSIONS)
+            data = b"\x89PNG\r\n\x1a\n\0" + rng.randbytes(max(size - 9, 0))
+        else:
+            ext = rng.choices(extensions, weights)[0]
+            data = synthetic_text(TREE_EXTENSIONS[ext][0], size, index).encode("utf-8")
+        with open(os.path.join(root, folder, f"file{index}{ext}"), "wb") as f:
+            f.write(data)
+
+    # Глубокие node_modules: исключаются настройками по умолчанию
+    folder = root
+    for level in range(node_modules_depth):
+        folder = os.path.join(folder, "node_modules", f"pkg{level}")
+        os.makedirs(folder, exist_ok=True)
+        for index in range(node_modules_files):
+            with open(os.path.join(folder, f"index{index}.js"), "w", encoding="utf-8") as f:
+                f.write(synthetic_text("javascript", median_size, index))
+    return params
+
+
+def synthetic_text(language, size, seed):
+    """Текст файла примерно size байт: код по шаблону языка или строки текста."""
+    if language is None:
+        line = TEXT_LINE.format(n=seed)
+        return line * max(1, size // len(line))
+    return make_source(language, size)[:max(size, 1)]
+
+
+# Замеры режимов вывода
+def peak_rss_mb():
+    """Пиковая память процесса в МБ или None, если замерить нельзя."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)  # в macOS — байты
+
+
+# Фазы run_scan (stats["phases"]) в столбцах таблицы. В txt и json чтение идет в потоках параллельно
+# с записью: read — сколько запись ждала прочитанных файлов, output — остальное время записи
+PHASES = ("index", "count", "structure", "read", "output")
+
+
+def run_mode(source, output_dir, mode, repeat=1, overrides=None):
+    """Замеряет один режим: общее время и фазы, которые записывает сам run_scan (index — обход и индекс,
+    count, structure, read, output — чтение файлов и запись результата), — лучший из repeat запусков.
+    Выполняется в отдельном процессе."""
+    settings = dict(AI_frendly.DEFAULT_SETTINGS, source_folder=source,
+                    output_file=os.path.join(output_dir, "result" + RESULT_EXTENSIONS[mode]),
+                    **MODES[mode], **(overrides or {}))
+    best = None
+    for _ in range(repeat):
+        stats = AI_frendly.new_stats()
+        start = time.perf_counter()
+        output = AI_frendly.run_scan(settings, stats=stats)
+        total = time.perf_counter() - start
+        if best is None or total < best["seconds"]:
+            best = {"seconds": total, "phases": dict(stats["phases"])}
+
+    # Объем данных считается отдельно и в замер не входит
+    rules = AI_frendly.make_exclude_rules(AI_frendly.parse_name_list(settings["exclude_extensions"]),
+                                          AI_frendly.parse_name_list(settings["exclude_folders"]),
+                                          AI_frendly.parse_name_list(settings["exclude_files"]),
+                                          AI_frendly.parse_ordered_list(settings["exclude_patterns"]))
+    listed = [entry for entry in AI_frendly.iter_tree_files(AI_frendly.build_source_index(source, rules))
+              if not entry["excluded"]]
+    files = len(listed)
+    megabytes = sum(entry["size"] for entry in listed) / (1024 * 1024)
+    return {
+        "seconds": round(best["seconds"], 4),
+        "phases": {name: round(value, 4) for name, value in best["phases"].items()},
+        "files": files,
+        "megabytes": round(megabytes, 2),
+        "files_per_sec": round(files / best["seconds"], 1),
+        "mb_per_sec": round(megabytes / best["seconds"], 2),
+        "output_bytes": os.path.getsize(output),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_mode_isolated(*args):
+    """run_mode в новом процессе: пиковая память не зависит от предыдущих режимов."""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(run_mode, args)
+
+
+def bench_modes(source, modes, repeat=1, overrides=None, out=sys.stdout):
+    """Замеряет режимы по очереди и печатает таблицу. Возвращает {режим: результат}."""
+    results = {}
+    out.write(f"{'режим':<10}{'сек':>9}" + "".join(f"{name[:6]:>8}" for name in PHASES)
+              + f"{'файл/с':>10}{'МБ/с':>8}{'RSS МБ':>8}\n")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for mode in modes:
+            result = run_mode_isolated(source, output_dir, mode, repeat, overrides)
+            results[mode] = result
+            phases = result["phases"]
+            out.write(f"{mode:<10}{result['seconds']:>9.3f}"
+                      + "".join(f"{phases.get(name, 0.0):>8.3f}" for name in PHASES)
+                      + f"{result['files_per_sec']:>10.0f}{result['mb_per_sec']:>8.1f}"
+                      f"{result['peak_rss_mb'] or 0:>8.1f}\n")
+    return results
+
+
+def compare_with_baseline(current, baseline, threshold=0.15, out=sys.stdout):
+    """Сравнивает время и пиковую память режимов с прошлым результатом.
+
+    Возвращает список регрессий: значения хуже базового больше чем на threshold.
+    """
+    regressions = []
+    for mode, result in current["modes"].items():
+        base = baseline.get("modes", {}).get(mode)
+        if base is None:
+            continue
+        for key in ("seconds", "peak_rss_mb"):
+            if not base.get(key) or result.get(key) is None:
+                continue
+            change = result[key] / base[key] - 1
+            mark = ""
+            if change > threshold:
+                mark = "  <-- регрессия"
+                regressions.append((mode, key, base[key], result[key]))
+            out.write(f"{mode:<10}{key:<12}{base[key]:>10}{result[key]:>10}{change:>+9.1%}{mark}\n")
+    if current.get("tree") != baseline.get("tree"):
+        out.write("Внимание: параметры дерева отличаются от базового замера\n")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности AI_frendly")
+    parser.add_argument("--files", type=int, default=2000, help="число файлов в синтетическом дереве")
+    parser.add_argument("--depth", type=int, default=4, help="максимальная глубина папок")
+    parser.add_argument("--files-per-dir", type=int, default=20, help="в среднем файлов на папку")
+    parser.add_argument("--median-size", type=int, default=4000, help="медианный размер файла, байт")
+    parser.add_argument("--size-sigma", type=float, default=1.2, help="разброс размеров (sigma логнормального)")
+    parser.add_argument("--binary-share", type=float, default=0.05, help="доля двоичных файлов")
+    parser.add_argument("--node-modules-depth", type=int, default=4, help="уровней вложенных node_modules")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора")
+    parser.add_argument("--root", help="папка для дерева (по умолчанию временная, удаляется после замера)")
+    parser.add_argument("--modes", default=",".join(MODES), help="режимы через запятую: " + ", ".join(MODES))
+    parser.add_argument("--repeat", type=int, default=3, help="сколько раз повторять замер (берется лучший)")
+    parser.add_argument("--parse-workers", type=int, help="процессов разбора Python (как --parse-workers)")
+    parser.add_argument("--size-mb", type=float, default=1.0, help="размер исходника на язык для замера разбора, МБ")
+    parser.add_argument("--no-extractors", action="store_true", help="не замерять разбор символов по языкам")
+    parser.add_argument("--out", help="сохранить результат в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого замера для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="допустимое ухудшение относительно baseline (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"неизвестные режимы: {', '.join(unknown)}")
+    overrides = {"parse_workers": args.parse_workers} if args.parse_workers is not None else None
+
+    root = args.root or tempfile.mkdtemp(prefix="ai_frendly_bench_")
+    try:
+        start = time.perf_counter()
+        tree_params = generate_tree(root, args.files, args.depth, args.files_per_dir, args.median_size,
+                                    args.size_sigma, binary_share=args.binary_share,
+                                    node_modules_depth=args.node_modules_depth, seed=args.seed)
+        print(f"Дерево: {args.files} файлов в {root} ({time.perf_counter() - start:.1f} с)")
+        results = {
+            "tree": tree_params,
+            "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpu_count": os.cpu_count()},
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "modes": bench_modes(root, modes, args.repeat, overrides),
+        }
+    finally:
+        if args.root is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if not args.no_extractors:
+        results["extractors_ms_per_mb"] = {name: round(value * 1000, 1) for name, value in
+                                           bench_extractors(args.size_mb, args.repeat).items()}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Результат сохранен в {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"Регрессий: {len(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import AI_frendly
+
+
+def scan(tmp_path, stats=None, **settings):
+    """Сканирует tmp_path/src и возвращает путь к результату."""
+    settings.setdefault("output_file", str(tmp_path / "dump.json"))
+    settings.setdefault("output_format", "json")
+    settings.setdefault("read_workers", 1)
+    settings.setdefault("parse_workers", 1)
+    return AI_frendly.run_scan(dict(source_folder=str(tmp_path / "src"), **settings), stats=stats)
+
+
+def json_files(path):
+    with open(path, encoding="utf-8") as f:
+        return {item["name"]: item for item in json.load(f)["files"] if "name" in item}
+
+
+def test_duplicate_hash_covers_whole_first_block(tmp_path):
+    # Файлы одного размера различаются только после лимита, но внутри первого блока
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "a.txt").write_text("x" * 100 + "a" * 100)
+    (tmp_path / "src" / "b.txt").write_text("x" * 100 + "b" * 100)
+    assert 200 < AI_frendly.SNIFF_SIZE
+    files = json_files(scan(tmp_path, max_file_size=50))
+    assert "duplicate_of" not in files["a.txt"]
+    assert "duplicate_of" not in files["b.txt"]
+
+
+def test_token_budget_caps_written_output(tmp_path):
+    # Много коротких функций: сигнатуры занимают больше, чем десятая часть файла
+    (tmp_path / "src").mkdir()
+    for i in range(30):
+        functions = "".join(f"def function_{i}_{n}(first, second, third=None):\n    return first\n\n\n"
+                            for n in range(60))
+        (tmp_path / "src" / f"module_{i}.py").write_text(f'"""Модуль {i}."""\n\n\n{functions}')
+    for budget in (2000, 6000, 20000):
+        for output_format in ("txt", "jsonl"):
+            output_file = scan(tmp_path, token_budget=budget, output_format=output_format,
+                               output_file=str(tmp_path / f"dump.{output_format}"))
+            with open(output_file, encoding="utf-8") as f:
+                assert AI_frendly.estimate_tokens(f.read()) <= budget
+
+
+def test_truncated_file_falls_back_to_cp1251(tmp_path):
+    # Первый блок ASCII (определяется как UTF-8), дальше текст в cp1251
+    (tmp_path / "src").mkdir()
+    data = b"x" * AI_frendly.SNIFF_SIZE + "Привет, мир\n".encode("cp1251") * 100
+    (tmp_path / "src" / "a.txt").write_bytes(data)
+    for truncate_mode in ("head", "head_tail"):
+        files = json_files(scan(tmp_path, max_file_size=len(data) - 10, truncate_mode=truncate_mode,
+                                fallback_encodings="cp1251"))
+        assert files["a.txt"]["truncated"]
+        assert files["a.txt"]["encoding"] == "cp1251"
+        assert "Привет, мир" in files["a.txt"]["content"]
+
+
+def test_minify_keeps_shebang_and_coding_cookie(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "run.sh").write_text("#!/bin/sh\n# комментарий\necho ok  # и еще\n")
+    (tmp_path / "src" / "tool.py").write_text("#!/usr/bin/env python3\n# -*- coding: utf-8 -*-\n"
+                                              "# комментарий\nprint('ok')  # и еще\n")
+    files = json_files(scan(tmp_path, minify=True))
+    assert files["run.sh"]["content"] == "#!/bin/sh\necho ok"
+    assert files["tool.py"]["content"] == "#!/usr/bin/env python3\n# -*- coding: utf-8 -*-\nprint('ok')"
+
+
+def test_budgeted_files_are_counted_once_in_stats(tmp_path):
+    (tmp_path / "src").mkdir()
+    for i in range(3):
+        (tmp_path / "src" / f"module_{i}.py").write_text("".join(f"def f{n}():\n    return {n}\n" for n in range(300)))
+    stats = AI_frendly.new_stats()
+    scan(tmp_path, token_budget=3000, output_format="txt", output_file=str(tmp_path / "dump.txt"), stats=stats)
+    report = stats["report"]
+    assert 1 <= report["files"]["truncated"] <= 3
+    assert report["files"]["read"] == report["files"]["listed"] == 3
+
+
+def make_query_tree(tmp_path):
+    for rel_path, text in {"a/alpha.py": "cookie = parse_cookie(cookie_header)\n" * 5,
+                           "a/beta.py": "value = 1\n", "a/gamma.py": "value = 2\n",
+                           "b/other.py": "# cookie\nvalue = 3\n"}.items():
+        (tmp_path / "src" / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / "src" / rel_path).write_text(text)
+
+
+def test_query_selects_top_k_and_neighbors(tmp_path):
+    make_query_tree(tmp_path)
+    files = json_files(scan(tmp_path, query="cookie", query_top_k=1, query_neighbors=1))
+    assert set(files) == {"alpha.py", "beta.py"}
+    files = json_files(scan(tmp_path, query="cookie", query_top_k=0, query_neighbors=0))
+    assert set(files) == {"alpha.py", "other.py"}
+
+
+def test_ai_friendly_query_uses_same_selection(tmp_path):
+    make_query_tree(tmp_path)
+    stats = AI_frendly.new_stats()
+    output_file = scan(tmp_path, stats=stats, ai_friendly=True, output_file=str(tmp_path / "summary.md"),
+                       query="cookie", query_top_k=1, query_neighbors=1)
+    with open(output_file, encoding="utf-8") as f:
+        key_files = {line[4:].strip() for line in f if line.startswith("### ")}
+    assert key_files == {"alpha.py", "beta.py"}
+    assert stats["report"]["files"]["read"] == 2  # чтение для ранжирования в статистику не входит
+
+
+def test_shards_match_manifest(tmp_path):
+    (tmp_path / "src").mkdir()
+    for i in range(10):
+        (tmp_path / "src" / f"file_{i}.txt").write_text(f"строка {i}\n" * 40)
+    out = tmp_path / "out"
+    out.mkdir()
+    for shard_max_bytes in (1500, 6000):  # второй запуск дает меньше частей, лишние удаляются
+        manifest_path = scan(tmp_path, output_format="txt", output_file=str(out / "dump.txt"),
+                             shard_max_bytes=shard_max_bytes)
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        shards = [shard["file"] for shard in manifest["shards"]]
+        assert sorted(path.name for path in out.glob("dump.*.txt")) == shards
+        assert all(shard["bytes"] <= shard_max_bytes for shard in manifest["shards"])
+        listed = [label for shard in manifest["shards"] for label in shard["files"]]
+        assert len(set(listed)) == len(listed) == 10  # каждый файл целиком в одной части
+    # У txt и jsonl с одним именем разные манифесты
+    jsonl_manifest = scan(tmp_path, output_format="jsonl", output_file=str(out / "dump.jsonl"), shard_max_bytes=6000)
+    assert jsonl_manifest != manifest_path
+    assert (out / "dump.txt.manifest.json").exists() and (out / "dump.jsonl.manifest.json").exists()
+
+
+def test_shard_smaller_than_character_does_not_hang(tmp_path):
+    writer = AI_frendly.ShardWriter(str(tmp_path / "dump.txt"), 1)
+    with writer:
+        writer.write("ёж")
+        writer.end_item("a")
+    assert [shard["bytes"] for shard in writer.shards] == [2, 2]
+    assert "".join((tmp_path / shard["file"]).read_text(encoding="utf-8") for shard in writer.shards) == "ёж"
+
+
+def test_skeleton_closes_declaration_braces():
+    go = "package main\n\nfunc Foo(a int) int {\n\treturn a\n}\n\nfunc Bar() { return }\n"
+    assert AI_frendly.build_skeleton(go, "go") == "package main\nfunc Foo(a int) int { ... }\nfunc Bar() { ... }"
+    java = "public class A {\n    public int m(int x) {\n        return x;\n    }\n}\n"
+    assert AI_frendly.build_skeleton(java, "java") == "public class A {\n    public int m(int x) { ... }\n}"
+
+
+def test_stats_sidecar_keeps_output_extension(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "a.txt").write_text("a")
+    for output_format in ("txt", "json"):
+        scan(tmp_path, output_format=output_format, output_file=str(tmp_path / f"dump.{output_format}"),
+             write_stats=True)
+    for output_format in ("txt", "json"):
+        with open(tmp_path / f"dump.{output_format}.stats.json", encoding="utf-8") as f:
+            assert json.load(f)["output"].endswith(f"dump.{output_format}")
+
+
+def test_single_reader_parses_in_process(tmp_path, monkeypatch):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "a.py").write_text("def f():\n    pass\n")
+    pools = []
+    monkeypatch.setattr(AI_frendly, "new_symbol_pool", lambda workers: pools.append(workers))
+    scan(tmp_path, read_workers=1, parse_workers=4)
+    assert pools == []
+    scan(tmp_path, read_workers=2, parse_workers=4)
+    assert pools == [4]
+
+
+def test_stats_split_reading_from_writing(tmp_path):
+    (tmp_path / "src").mkdir()
+    for i in range(20):
+        (tmp_path / "src" / f"file_{i}.txt").write_text("строка\n" * 1000)
+    for read_workers in (1, 4):
+        stats = AI_frendly.new_stats()
+        scan(tmp_path, stats=stats, read_workers=read_workers, output_format="txt",
+             output_file=str(tmp_path / "dump.txt"))
+        phases = stats["phases"]
+        assert phases["read"] > 0 and phases["output"] >= 0
+
+
+def json_paths(path, root):
+    """Пути выведенных файлов относительно root, через "/"."""
+    with open(path, encoding="utf-8") as f:
+        return {os.path.relpath(item["path"], root).replace(os.sep, "/")
+                for item in json.load(f)["files"] if "path" in item}
+
+
+def test_exclude_patterns_follow_gitignore_rules(tmp_path):
+    for rel_path in ["app.log", "keep.log", "build/out.js", "src/build/util.js", "docs/a/b/generated/x.md",
+                     "docs/readme.md", "tmp/cache.txt", "src/tmp", "main.py"]:
+        (tmp_path / "src" / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / "src" / rel_path).write_text("x")
+    # Отрицание, якорь "/", "**" и правило только для папок ("tmp/")
+    output_file = scan(tmp_path, exclude_patterns="*.log, !keep.log, /build, docs/**/generated, tmp/",
+                       exclude_folders="", exclude_extensions="")
+    assert json_paths(output_file, tmp_path / "src") == {"keep.log", "src/build/util.js", "docs/readme.md",
+                                                         "src/tmp", "main.py"}
+
+
+def test_gitignore_file_is_applied(tmp_path):
+    (tmp_path / "src" / "node").mkdir(parents=True)
+    (tmp_path / "src" / ".gitignore").write_text("# комментарий\nnode/\n*.tmp\n")
+    (tmp_path / "src" / "node" / "a.js").write_text("x")
+    (tmp_path / "src" / "a.tmp").write_text("x")
+    (tmp_path / "src" / "a.py").write_text("x")
+    output_file = scan(tmp_path, use_gitignore=True, exclude_folders="", exclude_extensions="")
+    assert json_paths(output_file, tmp_path / "src") == {".gitignore", "a.py"}
+
+
+def test_sqlite_snapshot_updates_incrementally(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "a.py").write_text("def parse_cookie(header):\n    return header\n")
+    (tmp_path / "src" / "b.py").write_text("def render_page():\n    pass\n")
+    (tmp_path / "src" / "c.txt").write_text("обычный текст\n")
+    snapshot = str(tmp_path / "dump.sqlite")
+    stats = AI_frendly.new_stats()
+    scan(tmp_path, stats=stats, output_format="sqlite", output_file=snapshot)
+    assert stats["snapshot"] == {"written": 3, "unchanged": 0, "removed": 0}
+
+    (tmp_path / "src" / "b.py").write_text("def render_template_page():\n    pass\n")
+    (tmp_path / "src" / "c.txt").unlink()
+    stats = AI_frendly.new_stats()
+    scan(tmp_path, stats=stats, output_format="sqlite", output_file=snapshot)
+    assert stats["snapshot"] == {"written": 1, "unchanged": 1, "removed": 1}
+
+    found = [os.path.basename(path) for path, _ in AI_frendly.search_snapshot(snapshot, "render template")]
+    assert found == ["b.py"]
+    assert [os.path.basename(path) for path, _ in AI_frendly.search_snapshot(snapshot, "cookie")] == ["a.py"]
+    assert AI_frendly.search_snapshot(snapshot, "обычный") == []
+    with contextlib.closing(sqlite3.connect(snapshot)) as conn:
+        assert conn.execute("SELECT count(*) FROM files").fetchone()[0] == 2
+        names = {row[0] for row in conn.execute("SELECT name FROM symbols")}
+    assert {"parse_cookie", "render_template_page"} <= names
+
+
+def test_scan_can_be_cancelled(tmp_path):
+    (tmp_path / "src").mkdir()
+    for i in range(50):
+        (tmp_path / "src" / f"file_{i}.txt").write_text("x")
+    cancel_event = threading.Event()
+    calls = []
+
+    def progress(value, maximum):
+        calls.append(value)
+        cancel_event.set()
+
+    with pytest.raises(AI_frendly.ScanCancelled):
+        AI_frendly.run_scan(dict(source_folder=str(tmp_path / "src"), output_file=str(tmp_path / "dump.txt"),
+                                 read_workers=1, parse_workers=1),
+                            progress_callback=progress, cancel_event=cancel_event)
+    assert calls and max(calls) < 50
+
+
+def test_batch_runs_profiles_independently(tmp_path):
+    (tmp_path / "one").mkdir()
+    (tmp_path / "one" / "a.py").write_text("x = 1\n")
+    (tmp_path / "two").mkdir()
+    (tmp_path / "two" / "b.txt").write_text("текст\n")
+    profiles_path = tmp_path / "profiles.txt"
+    profiles_path.write_text("read_workers=1\n\n[one]\nsource_folder=one\noutput_file=out/one.txt\n\n"
+                             "[two]\nsource_folder=two\noutput_file=out/two.jsonl\noutput_format=jsonl\n\n"
+                             "[missing]\nsource_folder=missing\noutput_file=out/missing.txt\n", encoding="utf-8")
+    (tmp_path / "out").mkdir()
+    profiles = AI_frendly.load_batch_file(str(profiles_path), AI_frendly.DEFAULT_SETTINGS)
+    assert [name for name, _ in profiles] == ["one", "two", "missing"]
+    assert profiles[0][1]["source_folder"] == str(tmp_path / "one")  # пути — от папки файла профилей
+    results = AI_frendly.run_batch(profiles, workers=2, parse_workers=1)
+    assert [result["name"] for result in results] == ["one", "two", "missing"]
+    assert results[0]["error"] is None and results[1]["error"] is None
+    assert isinstance(results[2]["error"], ValueError)  # ошибка одного проекта не мешает остальным
+    assert (tmp_path / "out" / "one.txt").exists() and (tmp_path / "out" / "two.jsonl").exists()